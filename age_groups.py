@@ -0,0 +1,28 @@
+import numpy as np
+
+
+# Upper bounds of the delay & age groups of the age/delay contingency table (classes of analyse_spark.delay_group & age_group)
+DELAY_EDGES = (0, 30, 60, 120, 180)
+AGE_EDGES = (5, 10, 15, 20, 25)
+
+
+def age_delay_counts(delay, age, delay_edges=DELAY_EDGES, age_edges=AGE_EDGES):
+    """ Returns the (delay groups x age groups) count array of arrays of delays & plane ages
+    (a value equal to an edge belongs to the lower group).
+
+    Parameters
+    ------------
+        delay:
+            array of departure delays.
+        age:
+            array of plane ages.
+        delay_edges:
+            upper bounds of the delay groups.
+        age_edges:
+            upper bounds of the age groups.
+
+    """
+    shape = (len(delay_edges) + 1, len(age_edges) + 1)
+    d = np.searchsorted(delay_edges, delay, side="left")
+    a = np.searchsorted(age_edges, age, side="left")
+    return np.bincount(d * shape[1] + a, minlength=shape[0] * shape[1]).reshape(shape)
@@ -1,18 +1,19 @@
 import csv
 import json
 import datetime
-import functools
 import collections
 import numpy as np
 import cassandra
 import cassandra.cluster
 import feed_cassandra
 import flight_data
+import moments
+import shared_reduce
 import matplotlib.pyplot as plt
 
 
 def _corr_mapping(flight):
-    """ Returns from a flight's data a tuple containing the values needed to calculate Pearson's empirical correlation of departure hour and delay time. 
+    """ Returns from a flight's data the (departure hour, delay time) pair needed to calculate Pearson's empirical correlation. 
 
     Parameters
     ------------
@@ -27,55 +28,59 @@ def _corr_mapping(flight):
     """
     x = flight.CRSDepHour
     y = flight.DepDelay
-    return (1, x, y, x * y, x ** 2, y ** 2)
+    return (x, y)
 
 
-def addtuple(x, y):
-    """ Sums elements of 2 iterables by pairs of values. Returns a tuple containing the results. (Reducer)
+def _reduce(stream, mapping, fields, processes=None):
+    """ Returns the Moments accumulator of the mapped values of a flight stream, or of the fields of a FlightChunk, 
+    reduced in this process (processes=None) or by a process pool (shared columns of a FlightChunk, bounded batches of a stream; see shared_reduce). 
 
     Parameters
     ------------
-        x: 
-            first iterable.
-        y:
-            second iterable.
+        stream:
+                flight data generator, or flight_data.FlightChunk of columns (e.g. the memory-mapped cache of flight_cache.open_flight_cache).
+        mapping:
+                function mapping a flight to its observation.
+        fields:
+                Flight fields of the observation.
+        processes:
+                number of worker processes. If None, the reduction runs in this process.
 
     """
-    return tuple(a + b for (a, b) in zip(x, y))
+    if isinstance(stream, flight_data.FlightChunk):
+        if processes is not None:
+            return shared_reduce.reduce_columns_parallel(stream, fields, processes)
+        X = np.column_stack([np.asarray(getattr(stream, f))[stream.Valid] for f in fields])
+        return moments.Moments(len(fields)).update_batch(X)
+
+    mapped_stream = map(mapping, stream)
+    if processes is not None:
+        return shared_reduce.reduce_stream_parallel(mapped_stream, len(fields), processes)
+    return moments.reduce_stream(mapped_stream, len(fields))
 
 
-def corr_emp(stream):
+def corr_emp(stream, processes=None):
     
-    """ Returns Pearson's empirical correlation of departure hour and delay time from a flight data generator (using Map/Reduce). 
+    """ Returns Pearson's empirical correlation of departure hour and delay time from a flight data generator (using Map/Reduce with a mergeable moments accumulator, see moments.Moments). 
 
     Parameters
     ------------
         stream:
-                stream of flight data to use to calculate the correlation coefficient. (flight data generator) 
+                stream of flight data to use to calculate the correlation coefficient. (flight data generator, or FlightChunk of columns) 
+        processes:
+                number of worker processes reducing shared columns (see shared_reduce). If None, the stream is reduced in this process.
 
     """
-    mapped_stream = map(_corr_mapping, stream)
-    
-    f0 = flight_data.Flight(0, 0, 0, 0, 
-                0, 0, 0, 0,  0, 0, 
-                0, 0, 0, 0, 0, 
-                0, 0, 0)   #initializer
+    acc = _reduce(stream, _corr_mapping, ("CRSDepHour", "DepDelay"), processes)
 
-    (s1, sx, sy, sxy, sx2, sy2) = functools.reduce(addtuple, mapped_stream, f0)
-
-    mean_x = sx / s1
-    mean_y = sy / s1
-    var_x = sx2 / s1 - mean_x ** 2
-    var_y = sy2 / s1 - mean_y ** 2
-    covar_xy = sxy / s1 - mean_x * mean_y
-    corr = covar_xy / np.sqrt(var_x * var_y)
+    corr = acc.corr[0, 1]
 
     return corr
 
 
 def _meanvar_bydow_mapping(flight):
     
-    """ Returns from a flight's data a tuple containing the values needed to compute mean & variance values of flight delay time. 
+    """ Returns from a flight's data the delay time used to compute mean & variance values of flight delay time. 
 
     Parameters
     ------------
@@ -89,32 +94,27 @@ def _meanvar_bydow_mapping(flight):
 
     """
     x = flight.DepDelay
-    return (1, x, x ** 2)
+    return x
 
 
 
-def meanvar_bydow(stream):
+def meanvar_bydow(stream, processes=None):
     
-    """ Returns mean and variance values of departure delay time from a flight data generator (using Map/Reduce). 
+    """ Returns mean and variance values of departure delay time from a flight data generator (using Map/Reduce with a mergeable moments accumulator, see moments.Moments). 
 
     Parameters
     ------------
         stream:
-                stream of flight data to use to calculate mean & variance. (flight data generator) 
+                stream of flight data to use to calculate mean & variance. (flight data generator, or FlightChunk of columns) 
+        processes:
+                number of worker processes reducing shared columns (see shared_reduce). If None, the stream is reduced in this process.
 
     """
 
-    mapped_stream = map(_meanvar_bydow_mapping, stream)
-    
-    f0 = flight_data.Flight(0, 0, 0, 0, 
-                0, 0, 0, 0,  0, 0, 
-                0, 0, 0, 0, 0, 
-                0, 0, 0)   #initializer
-
-    (s1, sx, sx2) = functools.reduce(addtuple, mapped_stream, [0,0,0])
+    acc = _reduce(stream, _meanvar_bydow_mapping, ("DepDelay",), processes)
 
-    mean = sx / s1
-    var = sx2 / s1 - mean ** 2
+    mean = acc.mean[0]
+    var = acc.var[0]
 
     return mean, var
 
@@ -122,7 +122,7 @@ def meanvar_bydow(stream):
 
 def _meanvar_bymonth_mapping(flight):
     
-    """ Returns from a flight's data a tuple containing the values needed to compute mean & variance values of general & weather-related flight delay time. 
+    """ Returns from a flight's data the (delay time, weather delay time) pair used to compute mean & variance values of general & weather-related flight delay time. 
 
     Parameters
     ------------
@@ -138,34 +138,94 @@ def _meanvar_bymonth_mapping(flight):
 
     x = flight.DepDelay
     y = flight.WeatherDelay
-    return (1, x, x ** 2, y, y**2)
+    return (x, y)
 
 
 
-def meanvar_bymonth(stream):
+def meanvar_bymonth(stream, processes=None):
     
-    """ Returns mean and variance values of departure delay time (general & weather-related) from a flight data generator (using Map/Reduce). 
+    """ Returns mean and variance values of departure delay time (general & weather-related) from a flight data generator (using Map/Reduce with a mergeable moments accumulator, see moments.Moments). 
 
     Parameters
     ------------
         stream:
-                stream of flight data to use to calculate mean & variance. (flight data generator) 
+                stream of flight data to use to calculate mean & variance. (flight data generator, or FlightChunk of columns) 
+        processes:
+                number of worker processes reducing shared columns (see shared_reduce). If None, the stream is reduced in this process.
 
     """
 
-    mapped_stream = map(_meanvar_bymonth_mapping, stream)
+    acc = _reduce(stream, _meanvar_bymonth_mapping, ("DepDelay", "WeatherDelay"), processes)
+
+    mean_x, mean_y = acc.mean
+    var_x, var_y = acc.var
+
+    return mean_x, var_x, mean_y, var_y
+
+
+
+def corr_emp_batches(batches):
     
-    f0 = flight_data.Flight(0, 0, 0, 0, 
-                0, 0, 0, 0,  0, 0, 
-                0, 0, 0, 0, 0, 
-                0, 0, 0)   #initializer
+    """ Returns Pearson's empirical correlation of departure hour and delay time from column batches 
+    (e.g. FlightData.get_flight_batches_by_month(month, columns=("dep_hour", "depdelay"))), reduced a whole batch at a time. 
+
+    Parameters
+    ------------
+        batches:
+                iterable of dicts column -> NumPy array holding the "dep_hour" & "depdelay" columns.
+
+    """
+
+    acc = moments.Moments(2)
+    for batch in batches:
+        acc.update_batch(np.column_stack((batch["dep_hour"], batch["depdelay"])))
+
+    corr = acc.corr[0, 1]
+
+    return corr
+
 
-    (s1, sx, sx2, sy, sy2) = functools.reduce(addtuple, mapped_stream, f0)
 
-    mean_x = sx / s1
-    var_x = sx2 / s1 - mean_x ** 2
+def meanvar_bydow_batches(batches):
+    
+    """ Returns mean and variance values of departure delay time from column batches 
+    (e.g. FlightData.get_flight_batches_by_dow(dow, yow, columns=("depdelay",))), reduced a whole batch at a time. 
+
+    Parameters
+    ------------
+        batches:
+                iterable of dicts column -> NumPy array holding the "depdelay" column.
+
+    """
+
+    acc = moments.Moments(1)
+    for batch in batches:
+        acc.update_batch(batch["depdelay"])
+
+    mean = acc.mean[0]
+    var = acc.var[0]
+
+    return mean, var
+
+
+
+def meanvar_bymonth_batches(batches):
+    
+    """ Returns mean and variance values of departure delay time (general & weather-related) from column batches 
+    (e.g. FlightData.get_flight_batches_by_month(month, columns=("depdelay", "weatherdel"))), reduced a whole batch at a time. 
+
+    Parameters
+    ------------
+        batches:
+                iterable of dicts column -> NumPy array holding the "depdelay" & "weatherdel" columns.
+
+    """
+
+    acc = moments.Moments(2)
+    for batch in batches:
+        acc.update_batch(np.column_stack((batch["depdelay"], batch["weatherdel"])))
 
-    mean_y = sy / s1
-    var_y = sy2 / s1 - mean_y ** 2
+    mean_x, mean_y = acc.mean
+    var_x, var_y = acc.var
 
-    return mean_x, var_x, mean_y, var_y
\ No newline at end of file
+    return mean_x, var_x, mean_y, var_y
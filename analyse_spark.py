@@ -1,38 +1,130 @@
-import sys
-import textwrap
 import itertools
+import collections
 import numpy as np
 import matplotlib.pyplot as plt
-import get_rdd as grdd
-import scipy as sp
+from age_groups import DELAY_EDGES, AGE_EDGES, age_delay_counts
 from scipy.stats import chi2_contingency
-from scipy.stats import chi2
 
 
 
 
-def Mean_Age(D):
+AgeStats = collections.namedtuple("AgeStats", ("count", "mean", "var"))
 
-    """ Returns average age of the planes in a dataset (using Map/Reduce). 
+# Result of Mean_Age: AgeStats of all flights, dicts year -> AgeStats & age group -> AgeStats (None if not requested)
+AgeSummary = collections.namedtuple("AgeSummary", ("stats", "by_year", "by_age"))
+
+
+def _age_stats(acc):
+    """ Returns AgeStats (count, mean, population variance) from summed (count, sum, sum of squares) counters."""
+    n, s, ss = (int(v) for v in acc)
+    if n == 0:
+        return AgeStats(0, np.nan, np.nan)
+    return AgeStats(n, s / n, (n * ss - s * s) / n ** 2)
+
+
+def _merge_age(x, y):
+    """ Sums two dicts key -> (count, sum, sum of squares) array of plane ages. Returns a new dict. (Reducer)
+
+    Parameters
+    ------------
+        x:
+            first dict.
+        y:
+            second dict.
+
+    """
+    merged = dict(x)
+    for key, acc in y.items():
+        merged[key] = merged[key] + acc if key in merged else acc
+    return merged
+
+
+def _age_partition(flights, by_year, age_edges, chunksize = 65536):
+
+    """ Returns the plane age counters of a RDD partition as a dict key -> (count, sum, sum of squares) array, 
+    key being ("all", None), ("year", year) or ("age", age group). Flights of planes with an unknown manufacture year (0) are skipped.
+
+    Parameters
+    ------------
+        flights:
+            iterator of flight data (RDD partition).
+        by_year:
+            if True, counters are also computed per flight year.
+        age_edges:
+            upper bounds of the age groups of the per-age breakdown (None for no breakdown).
+        chunksize:
+            number of flights processed at once.
+
+    """
+
+    acc = {}
+    while True:
+        chunk = [(flight.Year, flight.MFRYear) for flight in itertools.islice(flights, chunksize)]
+        if not chunk:
+            break
+        year, mfryear = np.array(chunk, dtype = np.int64).T
+        known = mfryear > 0
+        year = year[known]
+        age = year - mfryear[known]
+        parts = {("all", None): np.array([len(age), age.sum(), (age * age).sum()])}
+
+        if by_year:
+            years, inverse = np.unique(year, return_inverse = True)
+            n = np.bincount(inverse, minlength = len(years))
+            s = np.bincount(inverse, weights = age, minlength = len(years))
+            ss = np.bincount(inverse, weights = age * age, minlength = len(years))
+            for i, y in enumerate(years.tolist()):
+                parts[("year", y)] = np.array([n[i], s[i], ss[i]], dtype = np.int64)
+
+        if age_edges is not None:
+            group = np.searchsorted(age_edges, age, side = "left")
+            size = len(age_edges) + 1
+            n = np.bincount(group, minlength = size)
+            s = np.bincount(group, weights = age, minlength = size)
+            ss = np.bincount(group, weights = age * age, minlength = size)
+            for g in np.flatnonzero(n).tolist():
+                parts[("age", g)] = np.array([n[g], s[g], ss[g]], dtype = np.int64)
+
+        acc = _merge_age(acc, parts)
+    yield acc
+
+
+def Mean_Age(D, by_year = False, by_age_group = False, age_edges = None, depth = 2):
+
+    """ Returns average age of the planes in a dataset (using Map/Reduce), as an AgeSummary: AgeStats (count, mean, variance)
+    of all flights, dict year -> AgeStats & dict age group -> AgeStats (None in place of a breakdown not requested).
+    The age of a plane is computed at the year of each flight (Year - MFRYear); flights of planes with an unknown 
+    manufacture year (0) are skipped (count_age_del only skips them with skip_unknown). Every partition is reduced to (count, sum, sum of squares) 
+    counters, summed with a tree aggregation; the optional breakdowns are computed in the same pass.
 
     Parameters
     ------------
         D:
             RDD of flight data to use to compute the age mean.
+        by_year:
+            if True, also returns the statistics per flight year.
+        by_age_group:
+            if True, also returns the statistics per plane age group (age_group classes, or age_edges).
+        age_edges:
+            upper bounds of the age groups. If None, AGE_EDGES is used.
+        depth:
+            depth of the aggregation tree.
 
     """
 
-    DN = (
-        D.map(lambda flight : (1, 2005 - flight.MFRYear))
-         .reduce(lambda x, y : x + y)
-         .collect()
-    )
-
-    (count, total) = DN
+    edges = np.asarray(AGE_EDGES if age_edges is None else age_edges) if by_age_group else None
 
-    mean = total / float(count)
+    acc = (
+        D.mapPartitions(lambda flights : _age_partition(flights, by_year, edges))
+         .treeAggregate({}, _merge_age, _merge_age, depth = depth)
+    )
 
-    return DN
+    breakdown = lambda kind : dict(sorted((key, _age_stats(v)) for (k, key), v in acc.items() if k == kind))
+    return AgeSummary(
+        _age_stats(acc.get(("all", None), (0, 0, 0))),
+        breakdown("year") if by_year else None,
+        breakdown("age") if by_age_group else None,
+    )
 
 
 def delay_group(x):
@@ -81,34 +173,76 @@ def age_group(x):
        return 4
     return 5
 
-def count_age_del(D):
+def _count_partition(flights, delay_edges, age_edges, skip_unknown = False, chunksize = 65536):
 
-   """ Returns age/delay contingency table & Chi-square test results.
+    """ Returns the age/delay counts of a RDD partition as a single (delay groups x age groups) array, 
+    binning DepDelay & plane age (Year - MFRYear) by chunks with searchsorted/bincount.
 
-   Parameters
-   ------------
-      D:
-            RDD of flight data to use to create contingency table.
+    Parameters
+    ------------
+        flights:
+            iterator of flight data (RDD partition).
+        delay_edges:
+            upper bounds of the delay groups (a delay equal to an edge belongs to the lower group).
+        age_edges:
+            upper bounds of the age groups.
+        skip_unknown:
+            if True, flights of planes with an unknown manufacture year (0) are skipped.
+        chunksize:
+            number of flights binned at once.
 
-   """
+    """
 
-  count_agedel = (D.map(lambda flight : ((delay_group(flight.DepDelay), age_group(flight.Year - flight.MFRYear)), 1))
-                             .reduceByKey(lambda x,y : x+y)
-                             .collect()
-                            )
+    shape = (len(delay_edges) + 1, len(age_edges) + 1)
+    counts = np.zeros(shape, dtype = np.int64)
+    while True:
+        chunk = [(flight.DepDelay, flight.Year, flight.MFRYear) for flight in itertools.islice(flights, chunksize)]
+        if not chunk:
+            break
+        delay, year, mfryear = np.array(chunk, dtype = np.int64).T
+        if skip_unknown:
+            known = mfryear > 0
+            delay, year, mfryear = delay[known], year[known], mfryear[known]
+        counts += age_delay_counts(delay, year - mfryear, delay_edges, age_edges)
+    yield counts
 
-  m_count_agedel = np.zeros((6,6), dtype = int)
 
-  for (d,a), c in count_agedel:
-      m_count_agedel[d, a] = c
+def count_age_del(D, delay_edges = DELAY_EDGES, age_edges = AGE_EDGES, depth = 2, skip_unknown = False):
 
-  X2, pval, df, pred = chi2_contingency(m_count_agedel)
+    """ Returns age/delay contingency table & Chi-square test results.
+    Every partition is binned into one count array (see _count_partition) & the arrays are summed with a tree aggregation.
+    By default every flight is counted: planes with an unknown manufacture year (0) get an age of Year & fall in the
+    oldest age group, as in the original table.
 
-  fig, (ax_real, ax_pred) = plt.subplots(2,1)
-  ax_real.imshow(m_count_agedel, cmap = "jet")
-  ax_pred.imshow(pred, cmap = "jet")
+    Parameters
+    ------------
+        D:
+            RDD of flight data to use to create contingency table.
+        delay_edges:
+            upper bounds of the delay groups (default: the delay_group classes).
+        age_edges:
+            upper bounds of the age groups (default: the age_group classes).
+        depth:
+            depth of the aggregation tree.
+        skip_unknown:
+            if True, flights of planes with an unknown manufacture year are left out of the table (as in Mean_Age),
+            which changes the input of the chi-square test.
 
-  return m_count_agedel, fig, (X2, pval, df, pred)
+    """
+
+    delay_edges = np.asarray(delay_edges)
+    age_edges = np.asarray(age_edges)
+    shape = (len(delay_edges) + 1, len(age_edges) + 1)
+
+    m_count_agedel = (
+        D.mapPartitions(lambda flights : _count_partition(flights, delay_edges, age_edges, skip_unknown))
+         .treeAggregate(np.zeros(shape, dtype = np.int64), np.add, np.add, depth = depth)
+    )
 
+    X2, pval, df, pred = chi2_contingency(m_count_agedel)
 
+    fig, (ax_real, ax_pred) = plt.subplots(2,1)
+    ax_real.imshow(m_count_agedel, cmap = "jet")
+    ax_pred.imshow(pred, cmap = "jet")
 
+    return m_count_agedel, fig, (X2, pval, df, pred)
@@ -0,0 +1,269 @@
+import os
+import json
+import argparse
+import numpy as np
+import flight_data as fd
+import flight_cache
+import moments
+from age_groups import DELAY_EDGES, AGE_EDGES, age_delay_counts
+
+
+STATE_VERSION = 1
+
+
+class Partial:
+    """ Mergeable partial results of the analyses over a set of flights (a source file or partition):
+
+        corr:       Moments of (CRSDepHour, DepDelay)                  -> analyse_cassandra.corr_emp
+        by_dow:     {day of week: Moments of DepDelay}                 -> analyse_cassandra.meanvar_bydow
+        by_month:   {month: Moments of (DepDelay, WeatherDelay)}       -> analyse_cassandra.meanvar_bymonth
+        age_delay:  (delay groups x age groups) counts                 -> analyse_spark.count_age_del
+
+    """
+
+    def __init__(self):
+        self.corr = moments.Moments(2)
+        self.by_dow = {}
+        self.by_month = {}
+        self.age_delay = np.zeros((len(DELAY_EDGES) + 1, len(AGE_EDGES) + 1), dtype=np.int64)
+
+    @property
+    def n(self):
+        return self.corr.n
+
+    def update_chunk(self, chunk):
+        """ Adds the valid rows of a flight_data.FlightChunk. Returns the partial.
+
+        Parameters
+        ------------
+            chunk:
+                FlightChunk (column arrays & Valid mask).
+
+        """
+        valid = chunk.Valid
+        hour = chunk.CRSDepHour[valid]
+        dep = chunk.DepDelay[valid]
+        wea = chunk.WeatherDelay[valid]
+        dow = chunk.DayOfWeek[valid]
+        month = chunk.Month[valid]
+        age = chunk.Year[valid] - chunk.MFRYear[valid]
+
+        self.corr.update_batch(np.column_stack((hour, dep)))
+        for key in np.unique(dow).tolist():
+            self.by_dow.setdefault(key, moments.Moments(1)).update_batch(dep[dow == key])
+        for key in np.unique(month).tolist():
+            mask = month == key
+            self.by_month.setdefault(key, moments.Moments(2)).update_batch(np.column_stack((dep[mask], wea[mask])))
+        self.age_delay += age_delay_counts(dep, age)   #every flight, as analyse_spark.count_age_del counts by default
+        return self
+
+    def merge(self, other, sign=1):
+        """ Adds (sign=1) or removes (sign=-1) the flights of another partial. Returns the partial.
+
+        Parameters
+        ------------
+            other:
+                Partial.
+            sign:
+                1 to merge other, -1 to subtract it (other must have been merged before).
+
+        """
+        combine = moments.Moments.merge if sign > 0 else moments.Moments.subtract
+        combine(self.corr, other.corr)
+        for groups, other_groups in ((self.by_dow, other.by_dow), (self.by_month, other.by_month)):
+            for key, acc in other_groups.items():
+                if key not in groups:
+                    groups[key] = moments.Moments(acc.dim)
+                combine(groups[key], acc)
+                if groups[key].n == 0:
+                    del groups[key]
+        self.age_delay += sign * other.age_delay
+        return self
+
+    def to_dict(self):
+        """ Returns a JSON-serializable dict of the partial."""
+        return {
+            "corr": self.corr.to_dict(),
+            "by_dow": {str(k): acc.to_dict() for k, acc in sorted(self.by_dow.items())},
+            "by_month": {str(k): acc.to_dict() for k, acc in sorted(self.by_month.items())},
+            "age_delay": self.age_delay.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        """ Returns the partial of a dict written by to_dict."""
+        partial = cls()
+        partial.corr = moments.Moments.from_dict(d["corr"])
+        partial.by_dow = {int(k): moments.Moments.from_dict(v) for k, v in d["by_dow"].items()}
+        partial.by_month = {int(k): moments.Moments.from_dict(v) for k, v in d["by_month"].items()}
+        partial.age_delay = np.array(d["age_delay"], dtype=np.int64)
+        return partial
+
+
+def file_partial(file, planeDict, cache_dir=None):
+    """ Returns the Partial of a flight csv file (read by chunks, or from its column cache when cache_dir is given).
+
+    Parameters
+    ------------
+        file:
+            name of the source CSV file.
+        planeDict:
+            Dictionary containing Plane data.
+        cache_dir:
+            directory of the binary column caches (see flight_cache). If None, the CSV file is parsed directly.
+
+    """
+    if cache_dir is None:
+        chunks = fd.read_flight_chunks(file, planeDict)
+    else:
+        chunks = flight_cache.read_cached_chunks(file, planeDict, cache_dir)
+    partial = Partial()
+    for chunk in chunks:
+        partial.update_chunk(chunk)
+    return partial
+
+
+class AnalysisState:
+    """ Persistent analysis state: the Partial of every source (file or partition) & their merge.
+
+    Adding a new monthly file only computes the partial of that file & merges it; replacing a file subtracts its
+    previous partial from the merged state before merging the new one. Results are served from the merged state:
+
+        state = AnalysisState.load("analysis_state.json")
+        state.add_file("2008-01.csv", planeDict)
+        state.corr_emp()
+        state.save("analysis_state.json")
+
+    """
+
+    def __init__(self):
+        self.sources = {}   #source -> (stamp, Partial)
+        self.total = Partial()
+
+    def add_partial(self, source, partial, stamp=None):
+        """ Adds (or replaces) the partial results of a source.
+
+        Parameters
+        ------------
+            source:
+                identifier of the source (file name, partition key, ...).
+            partial:
+                Partial of the source.
+            stamp:
+                identity of the source version (JSON-serializable, e.g. flight_cache.source_stamp). Optional.
+
+        """
+        self.remove(source)
+        self.sources[source] = (stamp, partial)
+        self.total.merge(partial)
+
+    def remove(self, source):
+        """ Removes the contribution of a source (if present). Returns True if it was present.
+
+        Parameters
+        ------------
+            source:
+                identifier of the source.
+
+        """
+        if source not in self.sources:
+            return False
+        _, partial = self.sources.pop(source)
+        self.total.merge(partial, sign=-1)
+        return True
+
+    def add_file(self, file, planeDict, cache_dir=None):
+        """ Adds a flight csv file, or replaces its contribution if the file (or the plane data) changed since it was added.
+        Returns False (without reading the file) if the same version of the file is already in the state.
+
+        Parameters
+        ------------
+            file:
+                name of the source CSV file.
+            planeDict:
+                Dictionary containing Plane data.
+            cache_dir:
+                directory of the binary column caches (see flight_cache). Optional.
+
+        """
+        source = os.path.abspath(file)
+        stamp = dict(flight_cache.source_stamp(file), planes=flight_cache.plane_fingerprint(planeDict))
+        if source in self.sources and self.sources[source][0] == stamp:
+            return False
+        self.add_partial(source, file_partial(file, planeDict, cache_dir), stamp)
+        return True
+
+    def rebuild(self):
+        """ Recomputes the merged state from the partials of the sources (drops the rounding errors of subtractions)."""
+        self.total = Partial()
+        for _, partial in self.sources.values():
+            self.total.merge(partial)
+
+    def corr_emp(self):
+        """ Returns Pearson's empirical correlation of departure hour and delay time."""
+        return self.total.corr.corr[0, 1]
+
+    def meanvar_bydow(self, dow):
+        """ Returns mean and variance values of departure delay time of a day of week."""
+        acc = self.total.by_dow.get(dow, moments.Moments(1))
+        return acc.mean[0] if acc.n else np.nan, acc.var[0]
+
+    def meanvar_bymonth(self, month):
+        """ Returns mean and variance values of departure delay time (general & weather-related) of a month."""
+        acc = self.total.by_month.get(month, moments.Moments(2))
+        mean_x, mean_y = acc.mean if acc.n else (np.nan, np.nan)
+        var_x, var_y = acc.var
+        return mean_x, var_x, mean_y, var_y
+
+    def age_delay_table(self):
+        """ Returns the age/delay contingency table (input of the chi-square test of analyse_spark.count_age_del)."""
+        return self.total.age_delay.copy()
+
+    def save(self, path):
+        """ Atomically writes the state to a JSON file."""
+        state = {
+            "version": STATE_VERSION,
+            "sources": [
+                {"source": source, "stamp": stamp, "partial": partial.to_dict()}
+                for source, (stamp, partial) in sorted(self.sources.items())
+            ],
+        }
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """ Reads a state written by save (a new empty state if the file is missing)."""
+        state = cls()
+        if not os.path.exists(path):
+            return state
+        with open(path) as f:
+            d = json.load(f)
+        if d.get("version") != STATE_VERSION:
+            raise ValueError(f"unsupported analysis state version: {d.get('version')}")
+        for item in d["sources"]:
+            stamp, partial = item["stamp"], Partial.from_dict(item["partial"])
+            state.sources[item["source"]] = (stamp, partial)
+            state.total.merge(partial)
+        return state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Updates the analysis state with new or changed flight csv files.")
+    parser.add_argument("state", help="JSON analysis state file (created if missing)")
+    parser.add_argument("files", nargs="*", help="flight csv files to add or replace")
+    parser.add_argument("--planes", required=True, help="plane-data.csv file")
+    parser.add_argument("--cache-dir", help="directory of the binary column caches")
+    parser.add_argument("--remove", nargs="+", default=[], help="flight csv files to remove from the state")
+    args = parser.parse_args()
+
+    state = AnalysisState.load(args.state)
+    for f in args.remove:
+        state.remove(os.path.abspath(f))
+    planeDict = fd.createPlaneIndex_from_csv(args.planes)
+    for f in args.files:
+        print(f"{f}: {'updated' if state.add_file(f, planeDict, args.cache_dir) else 'unchanged'}")
+    state.save(args.state)
+    print(f"flights: {state.total.n}, corr(dep hour, delay): {state.corr_emp():.4f}")
@@ -0,0 +1,360 @@
+import os
+import sys
+import bz2
+import csv
+import json
+import time
+import shutil
+import argparse
+import itertools
+import platform
+import tempfile
+import subprocess
+import flight_data as fd
+import flight_cache
+import synthetic_data
+
+
+## LOCAL STAND-IN FOR A CASSANDRA SESSION
+
+class _DoneFuture:
+    """ Already completed ResponseFuture stand-in."""
+
+    def __init__(self, rows):
+        self._rows = rows
+
+    def add_callbacks(self, callback, errback, callback_args=(), errback_args=(), **kwargs):
+        callback(self._rows, *callback_args)
+
+    def result(self):
+        return self._rows
+
+
+class StandInSession:
+    """ Session stand-in accepting every statement without a cluster (measures the client-side ingest cost)."""
+
+    def __init__(self):
+        self.statements = 0
+
+    def prepare(self, query):
+        return query
+
+    def execute(self, query, values=None, **kwargs):
+        self.statements += 1
+        return []
+
+    def execute_async(self, query, values=None, **kwargs):
+        self.statements += 1
+        return _DoneFuture([])
+
+
+## BENCHMARKS
+# Every benchmark takes (files, planeDict, workdir) & returns the number of processed rows.
+
+def _read_flights(files, planeDict, cache_dir=None):
+    return itertools.chain.from_iterable(flight_cache.read_flights(f, planeDict, cache_dir) for f in files)
+
+
+def bench_parse_csv(files, planeDict, workdir):
+    return sum(1 for _ in _read_flights(files, planeDict))
+
+
+def _dictreader_flights(file, planeDict):
+    """ Reference row-by-row reader (csv.DictReader & int() per cell, KVStore lookups), the reader replaced by
+    flight_data.read_flight_chunks: parse_csv & parse_chunks are compared with it."""
+    with open(file, newline="") as f:
+        for row in csv.DictReader(f):
+            try:
+                values = [int(row[name]) for name in fd.CSV_COLUMNS.values()]
+                dep_hour, dep_min = divmod(int(row["CRSDepTime"]), 100)
+                arr_hour, arr_min = divmod(int(row["CRSArrTime"]), 100)
+                mfryear = planeDict.read(row["TailNum"])
+            except (ValueError, KeyError):
+                continue
+            yield (*values, dep_hour, dep_min, arr_hour, arr_min, row["TailNum"], mfryear)
+
+
+def bench_parse_dictreader(files, planeDict, workdir):
+    planes = fd.createPlaneDict_from_csv(os.path.join(os.path.dirname(files[0]), "plane-data.csv"))
+    return sum(1 for f in files for _ in _dictreader_flights(f, planes))
+
+
+def bench_parse_chunks(files, planeDict, workdir):
+    return sum(int(chunk.Valid.sum()) for f in files for chunk in fd.read_flight_chunks(f, planeDict))
+
+
+def bench_parse_parallel(files, planeDict, workdir):
+    import get_rdd as grdd
+    return sum(1 for _ in grdd.read_flight_csvs(files, planeDict, processes=os.cpu_count()))
+
+
+def _bz2_files(files, workdir):
+    """ Returns the bzip2-compressed copies of the dataset files (written once in workdir)."""
+    out = []
+    for f in files:
+        path = os.path.join(workdir, "bz2", os.path.basename(f) + ".bz2")
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(f, "rb") as inp, bz2.open(path, "wb") as outp:
+                shutil.copyfileobj(inp, outp)
+        out.append(path)
+    return out
+
+
+def bench_parse_bz2(files, planeDict, workdir):
+    return sum(int(chunk.Valid.sum()) for f in _bz2_files(files, workdir) for chunk in fd.read_flight_chunks(f, planeDict))
+
+
+def bench_cache_build(files, planeDict, workdir):
+    cache_dir = os.path.join(workdir, "cache")
+    return sum(flight_cache.write_flight_cache(f, planeDict, cache_dir) for f in files)
+
+
+def bench_cache_read(files, planeDict, workdir):
+    cache_dir = os.path.join(workdir, "cache")
+    return sum(1 for _ in _read_flights(files, planeDict, cache_dir))
+
+
+def _bench_insert(files, planeDict, workdir, concurrency):
+    import feed_cassandra
+    data = feed_cassandra.FlightData("benchmark", session=StandInSession())
+    cache_dir = os.path.join(workdir, "cache")
+    return sum(data.insert_csv(f, planeDict, concurrency=concurrency, cache_dir=cache_dir).rows for f in files)
+
+
+def bench_insert_blocking(files, planeDict, workdir):
+    return _bench_insert(files, planeDict, workdir, None)
+
+
+def bench_insert_concurrent(files, planeDict, workdir):
+    return _bench_insert(files, planeDict, workdir, 64)
+
+
+def bench_insert_local(files, planeDict, workdir):
+    import feed_cassandra
+    import storage
+    data = feed_cassandra.FlightData(backend=storage.LocalBackend(":memory:"))
+    cache_dir = os.path.join(workdir, "cache")
+    try:
+        return sum(data.insert_csv(f, planeDict, cache_dir=cache_dir).rows for f in files)
+    finally:
+        data.close()
+
+
+def _bench_reducer(files, planeDict, workdir, name):
+    import analyse_cassandra
+    cache_dir = os.path.join(workdir, "cache")
+    counted = []
+
+    def stream():
+        for flight in _read_flights(files, planeDict, cache_dir):
+            counted.append(None)
+            yield flight
+
+    getattr(analyse_cassandra, name)(stream())
+    return len(counted)
+
+
+def bench_corr_emp(files, planeDict, workdir):
+    return _bench_reducer(files, planeDict, workdir, "corr_emp")
+
+
+def bench_meanvar_bydow(files, planeDict, workdir):
+    return _bench_reducer(files, planeDict, workdir, "meanvar_bydow")
+
+
+def bench_meanvar_bymonth(files, planeDict, workdir):
+    return _bench_reducer(files, planeDict, workdir, "meanvar_bymonth")
+
+
+def bench_corr_emp_shared(files, planeDict, workdir):
+    import analyse_cassandra
+    cache_dir = os.path.join(workdir, "cache")
+    rows = 0
+    for f in files:
+        columns = flight_cache.open_flight_cache(f, planeDict, cache_dir)
+        analyse_cassandra.corr_emp(columns, processes=os.cpu_count())
+        rows += len(columns.Valid)
+    return rows
+
+
+def bench_delay_cube(files, planeDict, workdir):
+    import delay_cube
+    cube = delay_cube.files_cube(files, planeDict, os.path.join(workdir, "cache"))
+    cube.best_slots()
+    return int(cube.count[0].sum())
+
+
+_spark = {}
+
+
+def _spark_rdd(files, planeDict):
+    import pyspark
+    import get_rdd as grdd
+    if "sc" not in _spark:
+        conf = pyspark.SparkConf().setMaster("local[*]").setAppName("benchmark")
+        _spark["sc"] = pyspark.SparkContext(conf=conf)
+    _, rdd = grdd.get_flight_RDD(files, planeDict, sc=_spark["sc"])
+    return rdd
+
+
+def bench_spark_mean_age(files, planeDict, workdir):
+    import analyse_spark
+    rdd = _spark_rdd(files, planeDict)
+    analyse_spark.Mean_Age(rdd)
+    return rdd.count()
+
+
+def bench_spark_count_age_del(files, planeDict, workdir):
+    import analyse_spark
+    rdd = _spark_rdd(files, planeDict)
+    analyse_spark.count_age_del(rdd)
+    return rdd.count()
+
+
+BENCHMARKS = {
+    "parse_dictreader": bench_parse_dictreader,
+    "parse_csv": bench_parse_csv,
+    "parse_chunks": bench_parse_chunks,
+    "parse_parallel": bench_parse_parallel,
+    "parse_bz2": bench_parse_bz2,
+    "cache_build": bench_cache_build,
+    "cache_read": bench_cache_read,
+    "insert_blocking": bench_insert_blocking,
+    "insert_concurrent": bench_insert_concurrent,
+    "insert_local": bench_insert_local,
+    "corr_emp": bench_corr_emp,
+    "meanvar_bydow": bench_meanvar_bydow,
+    "meanvar_bymonth": bench_meanvar_bymonth,
+    "corr_emp_shared": bench_corr_emp_shared,
+    "delay_cube": bench_delay_cube,
+    "spark_mean_age": bench_spark_mean_age,
+    "spark_count_age_del": bench_spark_count_age_del,
+}
+
+
+## RUNNER
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmarks(rows, names=None, repeat=3, seed=0, workdir=None):
+    """ Generates a synthetic dataset & times the benchmarks on it. Returns the results (JSON-serializable dict).
+    A benchmark whose optional dependency (cassandra driver, pyspark, ...) is missing is reported as skipped.
+
+    Parameters
+    ------------
+    rows:
+            number of synthetic flights.
+    names:
+            names of the benchmarks to run (see BENCHMARKS). If None, all of them are run.
+    repeat:
+            number of timed runs of each benchmark (the fastest one is reported).
+    seed:
+            random seed of the dataset.
+    workdir:
+            directory of the dataset & caches. If None, a temporary directory is used & removed.
+
+    """
+    names = list(BENCHMARKS) if names is None else names
+    tmp = workdir is None
+    workdir = tempfile.mkdtemp(prefix="flights-bench-") if tmp else workdir
+
+    try:
+        files, plane_file = synthetic_data.generate_dataset(os.path.join(workdir, "data"), rows, seed=seed)
+        planeDict = fd.createPlaneIndex_from_csv(plane_file)
+        for f in files:   #benchmarks reading the column caches must not time their creation
+            flight_cache.open_flight_cache(f, planeDict, os.path.join(workdir, "cache"))
+        if "parse_bz2" in names:   #nor the compression of the bz2 files
+            _bz2_files(files, workdir)
+
+        results = []
+        for name in names:
+            result = {"name": name}
+            try:
+                times = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    n = BENCHMARKS[name](files, planeDict, workdir)
+                    times.append(time.perf_counter() - start)
+                best = min(times)
+                result.update(status="ok", seconds=best, rows=n, rows_per_s=n / best if best > 0 else None)
+            except ImportError as e:
+                result.update(status="skipped", error=str(e))
+            except Exception as e:
+                result.update(status="error", error=repr(e))
+            results.append(result)
+    finally:
+        if tmp:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "rows": rows,
+        "seed": seed,
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def compare_results(old, new, threshold=1.1):
+    """ Compares two benchmark result dicts. Returns a list of (name, old seconds, new seconds, ratio, regression flag).
+
+    Parameters
+    ------------
+    old:
+            results of the reference commit.
+    new:
+            results of the tested commit.
+    threshold:
+            new/old time ratio above which a benchmark is flagged as a regression.
+
+    """
+    before = {r["name"]: r for r in old["results"] if r["status"] == "ok"}
+    comparison = []
+    for r in new["results"]:
+        if r["status"] != "ok" or r["name"] not in before:
+            continue
+        ratio = r["seconds"] / before[r["name"]]["seconds"]
+        comparison.append((r["name"], before[r["name"]]["seconds"], r["seconds"], ratio, ratio > threshold))
+    return comparison
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Times the flight data pipeline on a synthetic dataset.")
+    parser.add_argument("--rows", type=int, default=10000, help="number of synthetic flights (10k to 100M)")
+    parser.add_argument("--bench", nargs="+", choices=sorted(BENCHMARKS), help="benchmarks to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="keep the dataset & caches in this directory")
+    parser.add_argument("--out", help="JSON file to write the results to (default: stdout)")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=1.1, help="slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.rows, args.bench, args.repeat, args.seed, args.workdir)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        regressions = 0
+        for name, before, after, ratio, regression in compare_results(old, results, args.threshold):
+            print(f"{name:24s} {before:10.4f}s -> {after:10.4f}s  x{ratio:.2f}{'  REGRESSION' if regression else ''}",
+                  file=sys.stderr)
+            regressions += regression
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,229 @@
+import io
+import os
+import bz2
+import gzip
+import itertools
+import collections
+import multiprocessing
+
+
+# 48-bit magic numbers starting every bzip2 block & ending every bzip2 stream (they are not byte-aligned)
+BZ2_BLOCK_MAGIC = 0x314159265359
+BZ2_EOS_MAGIC = 0x177245385090
+
+# bz2 files smaller than this are decompressed sequentially (a few blocks do not pay for a process pool)
+PARALLEL_MIN_BYTES = 4 * 2**20
+
+_MASK48 = (1 << 48) - 1
+
+# Bit range of a bzip2 file between two magic numbers (block=True if it starts with a block magic)
+Segment = collections.namedtuple("Segment", ("start", "end", "block"))
+
+
+def compression(file):
+    """Returns the compression of a file from its name: "bz2", "gz" or None.
+
+    Parameters
+    ------------
+    file:
+            name of the file.
+
+    """
+    if file.endswith(".bz2"):
+        return "bz2"
+    if file.endswith(".gz"):
+        return "gz"
+    return None
+
+
+def _magic_patterns(magic):
+    """Returns (bit shift, 5 bytes) pairs: a 48-bit magic starting `shift` bits into a byte k always
+    fills the 5 bytes k+1..k+5 with the same values, which are searched for with bytes.find."""
+    return [(shift, (magic << (8 - shift)).to_bytes(7, "big")[1:6]) for shift in range(8)]
+
+
+def bz2_markers(file, bufsize=16 * 2**20):
+    """Creates generator of the bit offsets of the block & end of stream magic numbers of a bzip2 file,
+    as (bit offset, is block) pairs in file order.
+
+    A magic number may also occur by chance inside compressed data: such false markers are detected
+    (& skipped) when the block they cut is decompressed (see iter_bz2_parallel).
+
+    Parameters
+    ------------
+    file:
+            name of the bzip2 file.
+    bufsize:
+            number of bytes scanned at once.
+
+    """
+    patterns = [(magic, shift, pattern) for magic in (BZ2_BLOCK_MAGIC, BZ2_EOS_MAGIC)
+                for shift, pattern in _magic_patterns(magic)]
+    with open(file, "rb") as f:
+        base = 0   #file offset of buf[0]
+        buf = b""
+        while True:
+            data = f.read(bufsize)
+            eof = not data
+            buf = buf + (b"\0" if eof else data)   #at the end of file, a byte-aligned magic lacks its 7th byte
+            limit = len(buf) - 6   #windows starting at limit are scanned with the next data
+            hits = []
+            for magic, shift, pattern in patterns:
+                p = buf.find(pattern, 1)
+                while p != -1 and p - 1 < limit:
+                    k = p - 1
+                    if k + 7 <= len(buf) and (int.from_bytes(buf[k:k + 7], "big") >> (8 - shift)) & _MASK48 == magic:
+                        hits.append((8 * (base + k) + shift, magic == BZ2_BLOCK_MAGIC))
+                    p = buf.find(pattern, p + 1)
+            yield from sorted(hits)
+            if eof:
+                return
+            base += limit
+            buf = buf[limit:]
+
+
+def bz2_segments(file):
+    """Creates generator of the Segments of a bzip2 file: the bit ranges between consecutive magic numbers.
+
+    Parameters
+    ------------
+    file:
+            name of the bzip2 file.
+
+    """
+    size_bits = 8 * os.path.getsize(file)
+    previous = None
+    for bit, block in bz2_markers(file):
+        if previous is not None:
+            yield Segment(previous[0], bit, previous[1])
+        previous = (bit, block)
+    if previous is not None:
+        yield Segment(previous[0], size_bits, previous[1])
+
+
+def decompress_bz2_bits(file, start, end):
+    """Decompresses a bit range of a bzip2 file holding one block (from its magic number to the next magic number).
+    The block is wrapped into a standalone stream: a header, the block bits & an end of stream marker carrying
+    the block CRC (the CRC of a single-block stream). Returns the decompressed bytes, or None if the range is not
+    exactly one valid block.
+
+    Parameters
+    ------------
+    file:
+            name of the bzip2 file.
+    start, end:
+            bit offsets of the range.
+
+    """
+    nbits = end - start
+    if nbits < 80:   #magic number & block CRC
+        return None
+    with open(file, "rb") as f:
+        f.seek(start // 8)
+        raw = f.read((end + 7) // 8 - start // 8)
+    bits = (int.from_bytes(raw, "big") >> (8 * len(raw) - start % 8 - nbits)) & ((1 << nbits) - 1)
+    crc = (bits >> (nbits - 80)) & 0xFFFFFFFF
+    total = nbits + 48 + 32
+    pad = -total % 8
+    stream = ((((bits << 48) | BZ2_EOS_MAGIC) << 32) | crc) << pad
+    try:
+        return bz2.decompress(b"BZh9" + stream.to_bytes((total + pad) // 8, "big"))
+    except (OSError, EOFError, ValueError):
+        return None
+
+
+def _decompress_segment(task):
+    return decompress_bz2_bits(*task)
+
+
+def iter_bz2_parallel(file, processes=None, prefetch=None):
+    """Creates generator of the decompressed data of a bzip2 file, one block at a time, in file order.
+    The blocks are decompressed independently by a process pool; at most `prefetch` blocks are decompressed ahead
+    of the consumer. Multi-stream files (pbzip2, concatenated files) are supported.
+
+    Parameters
+    ------------
+    file:
+            name of the bzip2 file.
+    processes:
+            number of worker processes. If None, the number of CPUs is used.
+    prefetch:
+            max number of blocks decompressed ahead. If None, 2 per process.
+
+    """
+    processes = processes or os.cpu_count()
+    prefetch = prefetch or 2 * processes
+    segments = bz2_segments(file)
+    pending = collections.deque()   #(Segment, AsyncResult or None)
+
+    with multiprocessing.Pool(processes) as pool:
+        def fill():
+            for seg in itertools.islice(segments, max(0, prefetch - len(pending))):
+                task = (file, seg.start, seg.end)
+                pending.append((seg, pool.apply_async(_decompress_segment, (task,)) if seg.block else None))
+
+        fill()
+        while pending:
+            seg, result = pending.popleft()
+            data = result.get() if seg.block else b""
+            while data is None:   #false magic number inside the block: extend the range to the next marker
+                fill()
+                if not pending:
+                    raise OSError(f"{file}: invalid bzip2 data at bit {seg.start}")
+                data = decompress_bz2_bits(file, seg.start, pending.popleft()[0].end)
+            fill()
+            if data:
+                yield data
+
+
+class _ChunkStream(io.RawIOBase):
+    """Read-only binary stream over a generator of bytes chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._view = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not len(self._view):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._view = memoryview(chunk)
+        n = min(len(b), len(self._view))
+        b[:n] = self._view[:n]
+        self._view = self._view[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._chunks.close()
+        super().close()
+
+
+def open_text(file, processes=None):
+    """Opens a plain, gzip (.gz) or bzip2 (.bz2) text file for reading, decompressing it on the fly.
+    Large bzip2 files are decompressed by a process pool (see iter_bz2_parallel), except in daemonic processes
+    (e.g. pool workers), which cannot have children.
+
+    Parameters
+    ------------
+    file:
+            name of the file.
+    processes:
+            number of bzip2 decompression processes. If None, the number of CPUs is used; 1 decompresses sequentially.
+
+    """
+    kind = compression(file)
+    if kind == "gz":
+        return gzip.open(file, "rt", newline="")
+    if kind == "bz2":
+        processes = processes or os.cpu_count()
+        if (processes > 1 and os.path.getsize(file) >= PARALLEL_MIN_BYTES
+                and not multiprocessing.current_process().daemon):
+            raw = _ChunkStream(iter_bz2_parallel(file, processes))
+            return io.TextIOWrapper(io.BufferedReader(raw, 2**20), newline="")
+        return bz2.open(file, "rt", newline="")
+    return open(file, newline="")
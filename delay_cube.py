@@ -0,0 +1,342 @@
+import argparse
+import itertools
+import collections
+import numpy as np
+import flight_data as fd
+import flight_cache
+import storage
+
+
+# Cube dimensions (CQL column names) & the labels of the fixed-size axes (years grow with the data)
+DIMENSIONS = ("year", "month", "dayofweek", "dep_hour")
+AXES = {
+    "month": np.arange(1, 13),
+    "dayofweek": np.arange(1, 8),
+    "dep_hour": np.arange(0, 25),   #scheduled departures at 2400 have dep_hour 24
+}
+
+# Delay fields summarized by the cube
+DELAY_FIELDS = storage.DELAY_FIELDS
+
+# Count, mean & population variance of a cell, or arrays of them over the cells of a marginal
+CellStats = collections.namedtuple("CellStats", ("count", "mean", "var"))
+
+# Marginal of a delay field: dimension names, their labels (one array per dimension) & CellStats arrays
+CubeSlice = collections.namedtuple("CubeSlice", ("dims", "labels", "stats"))
+
+
+class DelayCube:
+    """ Dense (year, month, dayofweek, dep_hour) cube of the count, sum & M2 (sum of squared deviations from the mean)
+    of delay fields.
+
+    The cube is built in a single pass over a flight stream or column batches (one bincount per field & batch),
+    then answers every marginal, slice & ranking of the README question without reading data again:
+
+        cube = DelayCube().update_stream(flight_cache.read_flights("2007.csv", planeDict, cache_dir))
+        cube.marginal(("dayofweek",), where={"year": 2007})
+        cube.best_slots(("dayofweek", "dep_hour"), k=5)
+
+    Cubes of the same fields are merged cell by cell with Chan et al.'s pairwise formula, as moments.Moments does
+    (process-pool workers, Spark partitions); M2 avoids the cancellation of the sum of squares form of the variance.
+    Sums are float64: they are exact for integer delays as long as they stay below 2**53.
+
+    """
+
+    def __init__(self, fields=DELAY_FIELDS):
+        self.fields = tuple(fields)
+        self.first_year = None
+        shape = (len(self.fields), 0) + tuple(len(AXES[dim]) for dim in DIMENSIONS[1:])
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.sum = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.dropped = 0   #valid flights out of the fixed axes
+
+    @property
+    def years(self):
+        """ Labels of the year axis."""
+        if self.first_year is None:
+            return np.arange(0)
+        return np.arange(self.first_year, self.first_year + self.count.shape[1])
+
+    def labels(self):
+        """ Returns the labels of every dimension (dict dimension -> array)."""
+        return dict(AXES, year=self.years)
+
+    def _grow(self, first, last):
+        """ Extends the year axis to [first, last]."""
+        if self.first_year is None:
+            self.first_year = first
+        before = max(0, self.first_year - first)
+        after = max(0, last - (self.first_year + self.count.shape[1] - 1))
+        if before or after:
+            pad = ((0, 0), (before, after), (0, 0), (0, 0), (0, 0))
+            self.count, self.sum, self.m2 = (np.pad(a, pad) for a in (self.count, self.sum, self.m2))
+            self.first_year -= before
+
+    def update_batch(self, batch):
+        """ Adds a batch of flights. Fields missing from the batch are skipped; missing values (None, NaN) are not
+        counted. Returns the cube.
+
+        Parameters
+        ------------
+            batch:
+                flight_data.FlightChunk or dict of column arrays (Flight field or CQL column names) holding the
+                dimension columns.
+
+        """
+        if hasattr(batch, "_asdict"):
+            batch = batch._asdict()
+        columns = {storage.CQL_FIELDS.get(name, name): col for name, col in batch.items()}
+        year, month, dow, hour = (np.asarray(columns[storage.CQL_FIELDS[dim]], dtype=float) for dim in DIMENSIONS)
+        valid = np.isfinite(year)
+        if "Valid" in columns:
+            valid &= np.asarray(columns["Valid"], dtype=bool)
+        inside = valid & (month >= 1) & (month <= 12) & (dow >= 1) & (dow <= 7) & (hour >= 0) & (hour <= 24)
+        self.dropped += int((valid & ~inside).sum())
+        if not inside.any():
+            return self
+
+        year = year[inside].astype(np.int64)
+        self._grow(int(year.min()), int(year.max()))
+        shape = self.count.shape[1:]
+        cells = (((year - self.first_year) * 12 + month[inside].astype(np.int64) - 1) * 7
+                 + dow[inside].astype(np.int64) - 1) * 25 + hour[inside].astype(np.int64)
+        size = int(np.prod(shape))
+        for i, field in enumerate(self.fields):
+            if field not in columns:
+                continue
+            values = np.asarray(columns[field], dtype=float)[inside]
+            known = ~np.isnan(values)
+            c, v = cells[known], values[known]
+            count = np.bincount(c, minlength=size)
+            total = np.bincount(c, weights=v, minlength=size)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                mean = total / count
+            m2 = np.bincount(c, weights=(v - mean[c]) ** 2, minlength=size)
+            self._merge_cells(i, count.reshape(shape), total.reshape(shape), m2.reshape(shape))
+        return self
+
+    def _merge_cells(self, index, count, total, m2):
+        """ Adds the count, sum & M2 arrays of other flights to the cells self.count[index] (Chan et al.'s combine).
+
+        Parameters
+        ------------
+            index:
+                index of the updated cells in the cube arrays.
+            count, total, m2:
+                arrays of the shape of the updated cells.
+
+        """
+        n_a = self.count[index]
+        n = n_a + count
+        with np.errstate(divide="ignore", invalid="ignore"):
+            delta = total / count - self.sum[index] / n_a
+            between = np.where((n_a > 0) & (count > 0), delta * delta * (n_a * count / n), 0)
+        self.m2[index] += m2 + between
+        self.count[index] = n
+        self.sum[index] += total
+
+    def update_stream(self, flights, batch_size=65536):
+        """ Adds a stream of flight_data.Flight tuples, a batch at a time. Returns the cube.
+
+        Parameters
+        ------------
+            flights:
+                flight data generator.
+            batch_size:
+                number of flights added at once.
+
+        """
+        names = tuple(storage.CQL_FIELDS[dim] for dim in DIMENSIONS) + self.fields
+        flights = iter(flights)
+        while True:
+            batch = [tuple(getattr(f, name) for name in names) for f in itertools.islice(flights, batch_size)]
+            if not batch:
+                return self
+            self.update_batch(dict(zip(names, np.array(batch, dtype=float).T)))
+
+    def merge(self, other):
+        """ Adds the flights of another cube of the same fields. Returns the cube."""
+        if other.fields != self.fields:
+            raise ValueError("cubes of different fields cannot be merged")
+        if other.first_year is not None:
+            self._grow(other.first_year, other.first_year + other.count.shape[1] - 1)
+            start = other.first_year - self.first_year
+            years = slice(start, start + other.count.shape[1])
+            self._merge_cells((slice(None), years), other.count, other.sum, other.m2)
+        self.dropped += other.dropped
+        return self
+
+    @staticmethod
+    def merged(a, b):
+        """ Returns the merge of two cubes (Spark reduce / treeReduce operator; a is updated)."""
+        return a.merge(b)
+
+    def __add__(self, other):
+        return self.copy().merge(other)
+
+    def copy(self):
+        other = DelayCube(self.fields)
+        other.first_year, other.dropped = self.first_year, self.dropped
+        other.count, other.sum, other.m2 = self.count.copy(), self.sum.copy(), self.m2.copy()
+        return other
+
+    def marginal(self, by=(), field="DepDelay", where=None):
+        """ Returns the CubeSlice of a delay field over some dimensions (summed over the others),
+        optionally restricted to a slice of the cube. Empty cells have count 0 & NaN mean & variance.
+
+        Parameters
+        ------------
+            by:
+                dimensions kept, in output order (subset of DIMENSIONS). () returns the overall statistics.
+            field:
+                one of the cube fields.
+            where:
+                dict dimension -> label or list of labels kept (e.g. {"year": 2007, "month": [6, 7, 8]}). Optional.
+
+        """
+        by = tuple(by)
+        unknown = set(by).union(where or ()) - set(DIMENSIONS)
+        if unknown or len(set(by)) != len(by):
+            raise ValueError(f"invalid dimensions: {by} (where: {sorted(where or ())})")
+        i = self.fields.index(field)
+        labels = self.labels()
+        arrays = (self.count[i], self.sum[i], self.m2[i])
+        for axis, dim in enumerate(DIMENSIONS):
+            if where is not None and dim in where:
+                keep = np.flatnonzero(np.isin(labels[dim], where[dim]))
+                arrays = tuple(a.take(keep, axis=axis) for a in arrays)
+                labels[dim] = labels[dim][keep]
+
+        summed = tuple(axis for axis, dim in enumerate(DIMENSIONS) if dim not in by)
+        kept = [dim for dim in DIMENSIONS if dim in by]
+        order = [kept.index(dim) for dim in by]
+        cell_count, cell_total, cell_m2 = arrays
+        count, total = (a.sum(axis=summed, keepdims=True) for a in (cell_count, cell_total))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = total / count
+            between = np.where(cell_count > 0, cell_count * (cell_total / cell_count - mean) ** 2, 0)
+            m2 = (cell_m2 + between).sum(axis=summed, keepdims=True)   #Chan et al.'s combine of the summed cells
+            count, mean, var = (np.squeeze(a, axis=summed).transpose(order) for a in (count, mean, m2 / count))
+        return CubeSlice(by, [labels[dim] for dim in by], CellStats(count, mean, var))
+
+    def stats(self, by=(), field="DepDelay", where=None):
+        """ Returns the CellStats of the non-empty cells of a marginal (see marginal), as a dict key -> CellStats
+        (key: label for one dimension, tuple of labels for several), or the CellStats of the slice if by is ().
+
+        Parameters
+        ------------
+            by:
+                dimensions kept, in key order.
+            field:
+                one of the cube fields.
+            where:
+                dict dimension -> label or list of labels kept. Optional.
+
+        """
+        dims, labels, (count, mean, var) = self.marginal(by, field, where)
+        if not dims:
+            return CellStats(int(count), float(mean), float(var))
+        result = {}
+        for cell in zip(*np.nonzero(count)):
+            key = tuple(int(labels[axis][j]) for axis, j in enumerate(cell))
+            result[key[0] if len(key) == 1 else key] = CellStats(int(count[cell]), float(mean[cell]), float(var[cell]))
+        return result
+
+    def best_slots(self, by=("dayofweek", "dep_hour"), field="DepDelay", where=None, k=10, min_count=1):
+        """ Returns the k cells of a marginal with the lowest mean delay, as a list of (key, CellStats).
+
+        Parameters
+        ------------
+            by:
+                dimensions of a slot (e.g. ("dep_hour",) for the best hours of the day).
+            field:
+                one of the cube fields.
+            where:
+                dict dimension -> label or list of labels kept. Optional.
+            k:
+                number of slots returned (None for all, ranked).
+            min_count:
+                min number of flights of a ranked slot (ignores sparse slots).
+
+        """
+        cells = [(key, s) for key, s in self.stats(by, field, where).items() if s.count >= min_count]
+        cells.sort(key=lambda item: item[1].mean)
+        return cells if k is None else cells[:k]
+
+    def save(self, path):
+        """ Writes the cube to a NumPy .npz file."""
+        np.savez_compressed(path, fields=np.array(self.fields), first_year=-1 if self.first_year is None else self.first_year,
+                            dropped=self.dropped, count=self.count, sum=self.sum, m2=self.m2)
+
+    @classmethod
+    def load(cls, path):
+        """ Reads a cube written by save."""
+        with np.load(path) as data:
+            cube = cls(data["fields"].tolist())
+            first_year = int(data["first_year"])
+            cube.first_year = None if first_year < 0 else first_year
+            cube.dropped = int(data["dropped"])
+            cube.count, cube.sum = data["count"], data["sum"]
+            if "m2" in data:
+                cube.m2 = data["m2"]
+            else:   #written by older versions, with sums of squares
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    cube.m2 = np.where(cube.count > 0, np.maximum(data["sumsq"] - cube.sum ** 2 / cube.count, 0), 0)
+        return cube
+
+
+def partition_cube(flights, fields=DELAY_FIELDS):
+    """ Yields the DelayCube of a RDD partition (or any flight stream): rdd.mapPartitions(partition_cube).treeReduce(DelayCube.merged).
+
+    Parameters
+    ------------
+        flights:
+            iterator of flight data.
+        fields:
+            delay fields summarized by the cube.
+
+    """
+    yield DelayCube(fields).update_stream(flights)
+
+
+def files_cube(files, planeDict, cache_dir=None, fields=DELAY_FIELDS):
+    """ Returns the DelayCube of flight csv files, read once by column chunks (from their column caches if cache_dir is given).
+
+    Parameters
+    ------------
+        files:
+            names of the flight csv files.
+        planeDict:
+            Dictionary containing Plane data.
+        cache_dir:
+            directory of the binary column caches (see flight_cache). If None, the CSV files are parsed directly.
+        fields:
+            delay fields summarized by the cube.
+
+    """
+    cube = DelayCube(fields)
+    for f in files:
+        chunks = fd.read_flight_chunks(f, planeDict) if cache_dir is None else flight_cache.read_cached_chunks(f, planeDict, cache_dir)
+        for chunk in chunks:
+            cube.update_batch(chunk)
+    return cube
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ranks the departure slots with the lowest mean delay in one pass over flight csv files.")
+    parser.add_argument("files", nargs="+", help="flight csv files")
+    parser.add_argument("--planes", required=True, help="plane-data.csv file")
+    parser.add_argument("--cache-dir", help="directory of the binary column caches")
+    parser.add_argument("--by", nargs="+", default=["dayofweek", "dep_hour"], choices=DIMENSIONS, help="dimensions of a slot")
+    parser.add_argument("--field", default="DepDelay", choices=DELAY_FIELDS)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--min-count", type=int, default=100, help="min number of flights of a ranked slot")
+    parser.add_argument("--save", help="write the cube to this .npz file")
+    args = parser.parse_args()
+
+    cube = files_cube(args.files, fd.createPlaneIndex_from_csv(args.planes), args.cache_dir)
+    if args.save is not None:
+        cube.save(args.save)
+    for key, s in cube.best_slots(args.by, args.field, k=args.top, min_count=args.min_count):
+        print(f"{key}: mean {s.mean:.2f}, var {s.var:.2f}, flights {s.count}")
@@ -1,192 +1,766 @@
-import csv
-import functools
+import os
+import json
+import time
+import queue
+import itertools
+import threading
 import collections
 import numpy as np
 import textwrap
 import cassandra
 import cassandra.cluster
+import cassandra.query
 import flight_data
+import flight_cache
+import metrics as metrics_
+import storage
 
-class FlightData:
-    """ Flight data manager (stored cassandra tables & originally in csv files)."""
 
-    def __init__(self, keyspace):
-        self._cluster = cassandra.cluster.Cluster()
-        self._session = self._cluster.connect(keyspace)
+# Table layouts, partition & rollup definitions are shared with the local storage engine
+from storage import (
+    TABLE_COLUMNS, CQL_FIELDS, PARTITION_KEYS,
+    ROLLUP_GROUPINGS, ROLLUP_COUNTERS,
+)
 
-    def _insert_query_by_datetime(self, flight):
-        
-        """ Returns a query to insert a flight's data in the flight_by_datetime CQL table.
+RollupStats = collections.namedtuple(
+    "RollupStats", ("count", "dep_mean", "dep_var", "weather_mean", "weather_var", "dep_weather_corr"))
+
+IngestReport = collections.namedtuple("IngestReport", ("rows", "seconds", "rows_per_s"))
+
+
+def _rollup_to_stats(n, s_dep, s_dep2, s_wea, s_wea2, s_depwea):
+    """ Returns RollupStats from summed rollup counters (exact integer sums, divided once)."""
+    if n == 0:
+        return RollupStats(0, np.nan, np.nan, np.nan, np.nan, np.nan)
+    var_dep = (n * s_dep2 - s_dep ** 2) / n ** 2
+    var_wea = (n * s_wea2 - s_wea ** 2) / n ** 2
+    cov = (n * s_depwea - s_dep * s_wea) / n ** 2
+    corr = cov / np.sqrt(var_dep * var_wea) if var_dep > 0 and var_wea > 0 else np.nan
+    return RollupStats(n, s_dep / n, var_dep, s_wea / n, var_wea, corr)
+
+
+def _widen(col):
+    """ Returns a cached (compact) integer column as int64, like the columns of batches read from the backend."""
+    return col.astype(np.int64) if col.dtype.kind in "iu" else col
+
+
+# Write errors retried with bounded exponential backoff
+RETRYABLE_ERRORS = (
+    cassandra.RequestExecutionException,
+    cassandra.OperationTimedOut,
+    cassandra.cluster.NoHostAvailable,
+)
+
+
+def _backoff(attempt, base=0.1, cap=10.0):
+    """ Returns the delay (seconds) before retry number `attempt` (exponential, capped)."""
+    return min(cap, base * 2 ** attempt)
+
+
+class _ConcurrentWriter:
+    """ Keeps a bounded number of asynchronous writes in flight per CQL table.
+    Failed writes are resent with bounded exponential backoff."""
+
+    def __init__(self, session, concurrency, retries=5, metrics=metrics_.NULL_METRICS):
+        self._session = session
+        self._retries = retries
+        self._metrics = metrics
+        self._slots = collections.defaultdict(lambda: threading.Semaphore(concurrency))
+        self._cond = threading.Condition()
+        self._pending = 0
+        self._failed = []
+        self.written = collections.Counter()
+
+    def submit(self, table, statement, values, attempt=0):
+        """ Sends an asynchronous write, waiting first for a free slot of its table.
 
         Parameters
         ------------
-        flight:
-                tuple containing the following field values of the flight to insert : 
-                "Year", "Month", "Day", "DayOfWeek", 
-                "CRSDepHour", "CRSDepMin", "CRSArrHour", "CRSArrMin",
-                "DepDelay", "ArrDelay", "CarrierDelay", "WeatherDelay", "NASDelay", 
-                "SecurityDelay", "LateAircraftDelay", 
-                "TailNum", "MFRYear","FlightNum"
+        table:
+                name of the CQL table written to.
+        statement:
+                prepared INSERT statement of the table.
+        values:
+                values to bind to the statement.
+        attempt:
+                number of previous failed attempts of this write.
 
         """
+        self._retry_failed()
+        self._send(table, statement, values, attempt)
 
-        query = textwrap.dedent(
-            f"""
-            INSERT INTO flight_by_datetime(
-            year,
-            month,
-            day,
-            dep_hour,
-            dep_min,
-            arr_hour,
-            arr_min,
-            depdelay,
-            arrdelay,
-            carrierdel,
-            weatherdel,
-            NASdel,
-            securitydel,
-            lateACdel,
-            flightnum 
+    def _send(self, table, statement, values, attempt):
+        self._slots[table].acquire()
+        with self._cond:
+            self._pending += 1
+        start = time.perf_counter()
+        future = self._session.execute_async(statement, values)
+        future.add_callbacks(self._on_success, self._on_error,
+                             callback_args=(table, start), errback_args=(table, statement, values, attempt))
+
+    def _retry_failed(self):
+        """ Resends the failed writes after one backoff delay (that of the most retried write). 
+        Raises the error of a write which failed too many times (the other failed writes stay recorded)."""
+        with self._cond:
+            failed, self._failed = self._failed, []
+        if not failed:
+            return
+        for i, (exc, _table, _statement, _values, attempt) in enumerate(failed):
+            if attempt >= self._retries or not isinstance(exc, RETRYABLE_ERRORS):
+                with self._cond:
+                    self._failed[:0] = failed[:i] + failed[i + 1:]
+                raise exc
+        time.sleep(_backoff(max(attempt for *_, attempt in failed)))
+        for exc, table, statement, values, attempt in failed:
+            self._metrics.inc("write_retries", table=table)
+            self._send(table, statement, values, attempt + 1)
+
+    def _release(self, table):
+        self._slots[table].release()
+        with self._cond:
+            self._pending -= 1
+            self._cond.notify_all()
+
+    def _on_success(self, _rows, table, start):
+        self._metrics.observe("statement_seconds", time.perf_counter() - start, kind="insert", table=table)
+        self._metrics.inc("rows_written", table=table)
+        with self._cond:
+            self.written[table] += 1
+        self._release(table)
+
+    def _on_error(self, exc, table, statement, values, attempt):
+        self._metrics.inc("write_errors", table=table)
+        with self._cond:
+            self._failed.append((exc, table, statement, values, attempt))
+        self._release(table)
+
+    def drain(self):
+        """ Waits until every submitted write is acknowledged. Raises the error of a write which failed too many times."""
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending == 0)
+                if not self._failed:
+                    return
+            self._retry_failed()
+
+
+class CassandraBackend(storage.StorageBackend):
+    """ Storage of the flight tables in a Cassandra keyspace (tables created by cassandra_table.cql)."""
+
+    def __init__(self, keyspace, session=None, metrics=None, tables=None):
+        """ Connects to a keyspace.
+
+        Parameters
+        ------------
+        keyspace:
+                name of the Cassandra keyspace.
+        session:
+                already connected session (or stand-in with the same execute/execute_async/prepare methods).
+                If None, a new cluster connection is opened.
+        metrics:
+                metrics.Metrics recording row counters & statement latencies. Optional.
+        tables:
+                tables written by write_flights (see storage.LAYOUTS & storage.layout_tables). 
+                If None, the original layout is written.
+
+        """
+        super().__init__()
+        if tables is not None:
+            self.tables = tuple(tables)
+        self._cluster = None
+        if session is None:
+            self._cluster = cassandra.cluster.Cluster()
+            session = self._cluster.connect(keyspace)
+        self._session = session
+        self._metrics = metrics if metrics is not None else metrics_.NULL_METRICS
+        self._prepared = {}
+
+    def _prepared_insert(self, table):
+        """ Returns the prepared INSERT statement of a CQL table (prepared once per backend).
+
+        Parameters
+        ------------
+        table:
+                name of the CQL table.
+
+        """
+        if table not in self._prepared:
+            columns = TABLE_COLUMNS[table]
+            query = (
+                f"INSERT INTO {table}({', '.join(columns)}) "
+                f"VALUES ({', '.join('?' for _ in columns)});"
             )
-            VALUES
-            (
-            {flight.Year},
-            {flight.Month},
-            {flight.Day},
-            {flight.CRSDepHour},
-            {flight.CRSDepMin},
-            {flight.CRSArrHour},
-            {flight.CRSArrMin},
-            {flight.DepDelay},
-            {flight.ArrDelay},
-            {flight.CarrierDelay},
-            {flight.WeatherDelay},
-            {flight.NASDelay},
-            {flight.SecurityDelay},
-            {flight.LateAircraftDelay},
-            {flight.FlightNum}
-            );
-            """
-        )
-        return query
-    
-    def _insert_query_by_dayofweek(self, flight):
-        
-        """ Returns a query to insert a flight's data in the flight_by_dayofweek CQL table.
+            self._prepared[table] = self._session.prepare(query)
+        return self._prepared[table]
+
+    def _prepared_directory_insert(self):
+        """ Returns the prepared INSERT statement of the flight_partitions directory table."""
+        if "flight_partitions" not in self._prepared:
+            self._prepared["flight_partitions"] = self._session.prepare(
+                "INSERT INTO flight_partitions(table_name, pkey) VALUES (?, ?);")
+        return self._prepared["flight_partitions"]
+
+    def _prepared_rollup_insert(self):
+        """ Returns the prepared INSERT statement of the flight_rollup table."""
+        if "flight_rollup" not in self._prepared:
+            self._prepared["flight_rollup"] = self._session.prepare(
+                f"INSERT INTO flight_rollup(grouping, year, key, source, {', '.join(ROLLUP_COUNTERS)}) "
+                f"VALUES (?, ?, ?, ?, {', '.join('?' for _ in ROLLUP_COUNTERS)});")
+        return self._prepared["flight_rollup"]
+
+    def _directory_partitions(self, table):
+        query = f"SELECT pkey FROM flight_partitions WHERE table_name = '{table}';"
+        return sorted(tuple(r.pkey) for r in self._timed_execute(query, "select", "flight_partitions"))
+
+    def _scan_partitions(self, table):
+        query = f"SELECT DISTINCT {', '.join(PARTITION_KEYS[table])} FROM {table};"
+        return [tuple(r) for r in self._timed_execute(query, "select", table)]
+
+    def _record_partitions(self, table, keys):
+        for key in keys:
+            self._execute_retry(self._insert_query_partition(table, key), 5, "flight_partitions")
+
+    def _insert_query_partition(self, table, key):
+        """ Returns a query to record a partition key in the flight_partitions directory table.
 
         Parameters
         ------------
+        table:
+                name of the CQL table holding the partition.
+        key:
+                partition key values (tuple).
+
+        """
+        return f"INSERT INTO flight_partitions(table_name, pkey) VALUES ('{table}', {list(key)});"
+
+    def _insert_query(self, table, flight):
+        """ Returns a query to insert a flight's data in a CQL table of TABLE_COLUMNS.
+
+        Parameters
+        ------------
+        table:
+                name of the CQL table.
         flight:
-                tuple containing the following field values of the flight to insert : 
-                "Year", "Month", "Day", "DayOfWeek", 
-                "CRSDepHour", "CRSDepMin", "CRSArrHour", "CRSArrMin",
-                "DepDelay", "ArrDelay", "CarrierDelay", "WeatherDelay", "NASDelay", 
-                "SecurityDelay", "LateAircraftDelay", 
-                "TailNum", "MFRYear","FlightNum"
+                flight_data.Flight to insert.
+
+        """
+        columns = TABLE_COLUMNS[table]
+        values = ", ".join(str(getattr(flight, CQL_FIELDS[c])) for c in columns)
+        return f"INSERT INTO {table}({', '.join(columns)}) VALUES ({values});"
+
+    def write_flights(self, flights, written, concurrency=None, retries=5, tables=None, rollups=None):
+        """ Inserts a stream of flights in the CQL tables. Returns the number of rows once all writes are acknowledged.
+
+        Parameters
+        ------------
+        flights:
+               flight data generator.
+        written:
+               Counter of acknowledged writes per table (updated).
+        concurrency:
+               max number of asynchronous writes in flight per table. 
+               If None, every row is inserted with blocking queries (one query per row & table).
+        retries:
+               max number of retries of a failed write (with exponential backoff).
+        tables:
+               CQL tables written. If None, the tables of the backend layout are written.
+        rollups:
+               callable returning the (source, totals) rollups of the flights, written once every flight is acknowledged
+               (see set_rollups). Optional.
+        """
+
+        tables = self.tables if tables is None else tuple(tables)
+        if concurrency is None:
+            rows = self._insert_blocking(flights, written, retries, tables)
+        else:
+            writer = _ConcurrentWriter(self._session, concurrency, retries, self._metrics)
+            writer.written = written
+            rows = self._insert_concurrent(flights, writer, tables)
+        if rollups is not None:
+            self.set_rollups(*rollups(), retries=retries)
+        return rows
+
+    def _timed_execute(self, query, kind, table):
+        """ Executes a blocking query & records its latency.
+
+        Parameters
+        ------------
+        query:
+               CQL query.
+        kind:
+               statement type ("insert", "select", ...).
+        table:
+               name of the CQL table.
+        """
+
+        with self._metrics.timer("statement_seconds", kind=kind, table=table):
+            return self._session.execute(query)
+
+    def _execute_retry(self, query, retries, table):
+        """ Executes a blocking write, retrying failed attempts with exponential backoff.
+
+        Parameters
+        ------------
+        query:
+               CQL query.
+        retries:
+               max number of retries.
+        table:
+               name of the CQL table written to.
+        """
+
+        for attempt in itertools.count():
+            try:
+                result = self._timed_execute(query, "insert", table)
+            except RETRYABLE_ERRORS:
+                self._metrics.inc("write_errors", table=table)
+                if attempt >= retries:
+                    raise
+                self._metrics.inc("write_retries", table=table)
+                time.sleep(_backoff(attempt))
+            else:
+                self._metrics.inc("rows_written", table=table)
+                return result
+
+    def _insert_blocking(self, stream, written, retries, tables):
+        """ Inserts a flight stream with one blocking query per row & table. Returns the number of rows.
+
+        Parameters
+        ------------
+        stream:
+               flight data generator.
+        written:
+               Counter of acknowledged writes per table (updated).
+        retries:
+               max number of retries of a failed query.
+        tables:
+               CQL tables written.
+        """
+
+        rows = 0
+        pending = set()
+        for flight in stream:
+            for table, key in self._new_partitions(flight, pending, tables):
+                self._execute_retry(self._insert_query_partition(table, key), retries, "flight_partitions")
+                self._mark_known([(table, key)])
+            for table in tables:
+                self._execute_retry(self._insert_query(table, flight), retries, table)
+                written[table] += 1
+            rows += 1
+        return rows
+
+    def _insert_concurrent(self, stream, writer, tables):
+        """ Inserts a flight stream with prepared statements & bounded asynchronous writes. Returns the number of rows
+        once all of them are acknowledged.
+
+        Parameters
+        ------------
+        stream:
+               flight data generator.
+        writer:
+               _ConcurrentWriter sending the writes.
+        tables:
+               CQL tables written.
+        """
+
+        statements = [
+            (table, self._prepared_insert(table), [CQL_FIELDS[c] for c in TABLE_COLUMNS[table]])
+            for table in tables
+        ]
+        directory = self._prepared_directory_insert()
+
+        rows = 0
+        pending = set()   #partitions recorded by this call (known once every write is acknowledged)
+        for flight in stream:
+            for table, key in self._new_partitions(flight, pending, tables):
+                writer.submit("flight_partitions", directory, [table, list(key)])
+            for table, statement, fields in statements:
+                writer.submit(table, statement, [getattr(flight, f) for f in fields])
+            rows += 1
+        writer.drain()
+        self._mark_known(pending)
+        return rows
+
+    def set_rollups(self, source, totals, concurrency=64, retries=5):
+        """ Writes the rollup rows of a source file (upserts: rows written for the source by a previous load are replaced,
+        the rows of group keys which no longer hold flights of the source are kept). Returns once every row is acknowledged.
+
+        Parameters
+        ------------
+        source:
+               identifier of the source file (absolute path).
+        totals:
+               dict (grouping, year, key) -> list of ROLLUP_COUNTERS sums over the flights of the source.
+        concurrency:
+               max number of asynchronous writes in flight.
+        retries:
+               max number of retries of a failed write (with exponential backoff).
+        """
+
+        statement = self._prepared_rollup_insert()
+        writer = _ConcurrentWriter(self._session, concurrency, retries, self._metrics)
+        for (grouping, year, key), values in totals.items():
+            writer.submit("flight_rollup", statement, [grouping, year, key, source] + list(values))
+        writer.drain()
+
+    def rollup_rows(self, grouping):
+        query = f"SELECT year, key, {', '.join(ROLLUP_COUNTERS)} FROM flight_rollup WHERE grouping = '{grouping}';"
+        return self._timed_execute(query, "select", "flight_rollup")
+
+    def _execute_window(self, queries, concurrency, ordered=True, table=None):
+        """ Yields the result sets of several queries, keeping at most `concurrency` queries in flight.
 
+        Parameters
+        ------------
+        queries:
+               iterable of CQL queries.
+        concurrency:
+               max number of queries in flight.
+        ordered:
+               if True, result sets are yielded in query order. If False, they are yielded as they arrive.
+        table:
+               name of the queried CQL table (metrics label).
+        
         """
-        query = textwrap.dedent(
+        queries = iter(queries)
+
+        if ordered:
+            window = collections.deque(
+                self._execute_async_timed(q, table) for q in itertools.islice(queries, concurrency))
+            while window:
+                result = window.popleft().result()
+                for q in itertools.islice(queries, 1):
+                    window.append(self._execute_async_timed(q, table))
+                yield result
+            return
+
+        done = queue.Queue()
+
+        def submit(q):
+            future = self._execute_async_timed(q, table)
+            future.add_callbacks(lambda _rows: done.put(future), lambda _exc: done.put(future))
+
+        inflight = 0
+        for q in itertools.islice(queries, concurrency):
+            submit(q)
+            inflight += 1
+        while inflight:
+            result = done.get().result()
+            inflight -= 1
+            for q in itertools.islice(queries, 1):
+                submit(q)
+                inflight += 1
+            yield result
+
+    def _execute_async_timed(self, query, table, kind="select"):
+        """ Sends an asynchronous query & records its latency when it completes. Returns its ResponseFuture.
+
+        Parameters
+        ------------
+        query:
+               CQL query.
+        table:
+               name of the CQL table.
+        kind:
+               statement type.
+        """
+
+        start = time.perf_counter()
+        future = self._session.execute_async(query)
+        observe = lambda _result: self._metrics.observe(
+            "statement_seconds", time.perf_counter() - start, kind=kind, table=table)
+        future.add_callbacks(observe, observe)
+        return future
+
+    def _select_query(self, table, key, columns=None):
+        """ Returns a query selecting a partition of a CQL table.
+
+        Parameters
+        ------------
+        table:
+               name of the CQL table.
+        key:
+               partition key (tuple, in PARTITION_KEYS order), optionally followed by a prefix of the clustering key.
+        columns:
+               selected columns. If None, all columns of the table are selected.
+        """
+
+        where = "\n                AND\n                ".join(
+            f"{c} = {v}" for c, v in zip(storage.select_columns(table, key), key))
+        return textwrap.dedent(
             f"""
-            INSERT INTO flight_by_dayofweek(
-            year,
-            month,
-            day,
-            dayofweek,
-            dep_hour,
-            dep_min,
-            arr_hour,
-            arr_min,
-            depdelay,
-            arrdelay,
-            carrierdel,
-            weatherdel,
-            NASdel,
-            securitydel,
-            lateACdel,
-            flightnum 
-            )
-            VALUES
-            (
-            {flight.Year},
-            {flight.Month},
-            {flight.Day},
-            {flight.DayOfWeek},
-            {flight.CRSDepHour},
-            {flight.CRSDepMin},
-            {flight.CRSArrHour},
-            {flight.CRSArrMin},
-            {flight.DepDelay},
-            {flight.ArrDelay},
-            {flight.CarrierDelay},
-            {flight.WeatherDelay},
-            {flight.NASDelay},
-            {flight.SecurityDelay},
-            {flight.LateAircraftDelay},
-            {flight.FlightNum}
-            );
+            SELECT
+            {', '.join(TABLE_COLUMNS[table] if columns is None else columns)}
+            FROM
+            {table}
+            WHERE
+                {where}
+            ;
             """
+            )
+
+    def select(self, table, key):
+        return self._timed_execute(self._select_query(table, key), "select", table)
+
+    def select_many(self, table, keys, concurrency=32, ordered=True):
+        queries = (self._select_query(table, key) for key in keys)
+        return self._execute_window(queries, concurrency, ordered, table)
+
+    def select_batches(self, table, keys, columns, fetch_size=5000, concurrency=None):
+        statements = (
+            cassandra.query.SimpleStatement(self._select_query(table, key, columns), fetch_size=fetch_size)
+            for key in keys
         )
-        return query
+        for result in self._execute_window(statements, concurrency or 1, True, table):   #first pages in flight
+            for page in self._result_pages(result, table):
+                if page:
+                    yield storage.tuples_to_columns(page, columns)
+
+    def _result_pages(self, result, table):
+        """ Yields the pages of a result set, fetching the next page only once the current one is consumed.
+
+        Parameters
+        ------------
+        result:
+               ResultSet of a paged query (or plain sequence of rows).
+        table:
+               name of the CQL table (metrics label).
+        """
+
+        if not hasattr(result, "current_rows"):
+            yield list(result)
+            return
+        while True:
+            yield result.current_rows
+            if not result.has_more_pages:
+                return
+            with self._metrics.timer("statement_seconds", kind="fetch", table=table):
+                result.fetch_next_page()
+
+    def close(self):
+        if self._cluster is not None:
+            self._cluster.shutdown()
+
+
+class _SourceRollups:
+    """ Rollup sums of the flights of a source file. A flight with the primary key of a flight already counted 
+    (in flight_by_datetime) is not counted again, as its rows replace the rows of that flight."""
+
+    def __init__(self, batch=65536):
+        self.totals = collections.defaultdict(lambda: [0] * len(ROLLUP_COUNTERS))
+        self._seen = np.empty(0, np.int64)   #sorted primary keys of the counted flights
+        self._pending = []
+        self._batch = batch
+
+    @staticmethod
+    def _flight_id(flight):
+        """ Returns the flight_by_datetime primary key of a flight packed into an integer."""
+        key = flight.Year
+        for value, bits in ((flight.Month, 4), (flight.Day, 5), (flight.CRSDepHour, 5), (flight.CRSDepMin, 6),
+                            (flight.FlightNum, 20)):
+            key = (key << bits) | value
+        return key
 
-    def _insert_query_by_dephour(self, flight):
-        """ Returns a query to insert a flight's data in the flight_by_dephour CQL table.
+    def add(self, flight):
+        """ Adds a flight to the sums (flights are deduplicated by batches).
 
         Parameters
         ------------
         flight:
-                tuple containing the following field values of the flight to insert : 
-                "Year", "Month", "Day", "DayOfWeek", 
-                "CRSDepHour", "CRSDepMin", "CRSArrHour", "CRSArrMin",
-                "DepDelay", "ArrDelay", "CarrierDelay", "WeatherDelay", "NASDelay", 
-                "SecurityDelay", "LateAircraftDelay", 
-                "TailNum", "MFRYear","FlightNum"
+                flight_data.Flight.
 
         """
-        query = textwrap.dedent(
-            f"""
-            INSERT INTO flight_by_dephour(
-            year,
-            month,
-            day,
-            dep_hour,
-            dep_min,
-            arr_hour,
-            arr_min,
-            depdelay,
-            arrdelay,
-            carrierdel,
-            weatherdel,
-            NASdel,
-            securitydel,
-            lateACdel,
-            flightnum 
-            )
-            VALUES
-            (
-            {flight.Year},
-            {flight.Month},
-            {flight.Day},
-            {flight.CRSDepHour},
-            {flight.CRSDepMin},
-            {flight.CRSArrHour},
-            {flight.CRSArrMin},
-            {flight.DepDelay},
-            {flight.ArrDelay},
-            {flight.CarrierDelay},
-            {flight.WeatherDelay},
-            {flight.NASDelay},
-            {flight.SecurityDelay},
-            {flight.LateAircraftDelay},
-            {flight.FlightNum}
-            );
-            """
-        )
-        return query
+        x = flight.DepDelay
+        y = flight.WeatherDelay
+        keys = tuple(getattr(flight, field) for field in ROLLUP_GROUPINGS.values())
+        self._pending.append((self._flight_id(flight), flight.Year, keys, (1, x, x * x, y, y * y, x * y)))
+        if len(self._pending) >= self._batch:
+            self._merge()
+
+    def _merge(self):
+        if not self._pending:
+            return
+        ids = np.fromiter((p[0] for p in self._pending), np.int64, len(self._pending))
+        _, first = np.unique(ids, return_index=True)
+        new = first[~np.isin(ids[first], self._seen, assume_unique=True)]
+        for i in new:
+            _, year, keys, values = self._pending[i]
+            for grouping, key in zip(ROLLUP_GROUPINGS, keys):
+                acc = self.totals[(grouping, year, key)]
+                for j, v in enumerate(values):
+                    acc[j] += v
+        self._seen = np.union1d(self._seen, ids[new])
+        self._pending = []
+
+    def sums(self):
+        """ Returns the sums of the added flights: dict (grouping, year, key) -> list of ROLLUP_COUNTERS."""
+        self._merge()
+        return dict(self.totals)
+
+
+class FlightData:
+    """ Flight data manager (stored cassandra tables & originally in csv files)."""
+
+    def __init__(self, keyspace=None, metrics=None, session=None, backend=None, cache=None, layout="original"):
+        """ Opens the flight data storage: a Cassandra keyspace, or any storage.StorageBackend 
+        (e.g. storage.LocalBackend, an embedded on-disk engine which needs no cluster).
+
+        Parameters
+        ------------
+        keyspace:
+                name of the Cassandra keyspace (ignored if backend is given).
+        metrics:
+                metrics.Metrics recording row counters, statement latencies & throughput. Optional.
+        session:
+                already connected Cassandra session (or stand-in with the same execute/execute_async/prepare methods).
+                If None, a new cluster connection is opened.
+        backend:
+                storage.StorageBackend storing the flights. If None, a CassandraBackend on keyspace is used.
+        cache:
+                partition_cache.PartitionCache of the partitions read by the getters 
+                (entries of the partitions written by insert_csv are invalidated). If None, every read queries the backend.
+        layout:
+                table layout read by the getters (see storage.LAYOUTS): "original", or "bucketed" (day of week & 
+                departure hour tables partitioned by month). The CassandraBackend opened on keyspace writes the same layout.
+
+        """
+        if layout not in storage.LAYOUTS:
+            raise ValueError(f"unknown table layout: {layout}")
+        self._metrics = metrics if metrics is not None else metrics_.NULL_METRICS
+        if backend is None:
+            backend = CassandraBackend(keyspace, session, self._metrics, storage.LAYOUTS[layout])
+        self._backend = backend
+        self._layout = layout
+        self._cache = cache
+
+    def close(self):
+        """ Closes the storage backend."""
+        self._backend.close()
+
+    def partitions(self, table):
+        """ Returns the sorted partition keys of a table which hold data (partition directory).
+
+        Parameters
+        ------------
+        table:
+                name of the table.
+
+        """
+        return self._backend.partitions(table)
+
+    def backfill_partitions(self, tables=None):
+        """ Records the partitions of the rows of tables in the partition directory (e.g. rows loaded before 
+        the directory existed, which the getters would not find). Returns the number of partition keys per table.
+
+        Parameters
+        ------------
+        tables:
+                names of the tables. If None, the tables of the layout read by the getters.
+
+        """
+        tables = storage.LAYOUTS[self._layout] if tables is None else tables
+        return {table: len(self._backend.backfill_partitions(table)) for table in tables}
+
+    def _with_rollups(self, stream, rollups, touched=None):
+        """ Yields the flights of a stream, adding each one to the rollup sums of its source.
+
+        Parameters
+        ------------
+        stream:
+                flight data generator.
+        rollups:
+                _SourceRollups of the source file.
+        touched:
+                set of (table, partition key) updated with the partitions written by the flights. Optional.
+
+        """
+        for flight in stream:
+            rollups.add(flight)
+            if touched is not None:
+                touched.update((table, storage.partition_key(table, flight)) for table in self._backend.tables)
+            yield flight
+
+    def rollup_stats(self, grouping, years=None):
+        """ Returns delay statistics per group key from the rollup table, as a dict key -> RollupStats.
+        Answers the "best time to fly" statistics without scanning the flight tables.
+
+        Parameters
+        ------------
+        grouping:
+                "month", "dayofweek" or "dep_hour".
+        years:
+                years to include (iterable). If None, all loaded years are included.
+
+        """
+        if grouping not in ROLLUP_GROUPINGS:
+            raise ValueError(f"unknown rollup grouping: {grouping}")
+
+        totals = collections.defaultdict(lambda: [0] * len(ROLLUP_COUNTERS))
+        years = None if years is None else set(years)
+        for r in self._backend.rollup_rows(grouping):
+            if years is not None and r.year not in years:
+                continue
+            acc = totals[r.key]
+            for i, c in enumerate(ROLLUP_COUNTERS):
+                acc[i] += getattr(r, c) or 0
+
+        return {key: _rollup_to_stats(*acc) for key, acc in sorted(totals.items())}
 
-    def insert_csv(self, fname, planeDict, limit=None):
+    def best_time_to_fly(self, grouping, years=None, by="dep_mean"):
+        """ Returns the group keys (months, days of week or departure hours) sorted from the lowest to the highest delay,
+        as a list of (key, RollupStats).
 
-        """ Inserts csv flight data in all CQL tables.
+        Parameters
+        ------------
+        grouping:
+                "month", "dayofweek" or "dep_hour".
+        years:
+                years to include (iterable). If None, all loaded years are included.
+        by:
+                RollupStats field to rank by.
+
+        """
+        stats = self.rollup_stats(grouping, years)
+        return sorted(stats.items(), key=lambda item: getattr(item[1], by))
+
+    def hour_delay_corr(self, years=None):
+        """ Returns Pearson's empirical correlation of departure hour and delay time, computed from the dep_hour rollups
+        (same value as analyse_cassandra.corr_emp over all flights).
+
+        Parameters
+        ------------
+        years:
+                years to include (iterable). If None, all loaded years are included.
+
+        """
+        years = None if years is None else set(years)
+        s1 = sx = sy = sxy = sx2 = sy2 = 0
+        for r in self._backend.rollup_rows("dep_hour"):
+            if years is not None and r.year not in years:
+                continue
+            n, s_dep, s_dep2 = r.n or 0, r.s_dep or 0, r.s_dep2 or 0
+            s1 += n
+            sx += n * r.key
+            sx2 += n * r.key ** 2
+            sy += s_dep
+            sy2 += s_dep2
+            sxy += r.key * s_dep
+
+        covar_xy = s1 * sxy - sx * sy
+        var_x = s1 * sx2 - sx ** 2
+        var_y = s1 * sy2 - sy ** 2
+        return covar_xy / np.sqrt(float(var_x) * float(var_y))
+
+    def insert_csv(self, fname, planeDict, limit=None, concurrency=None, cache_dir=None,
+                   checkpoint=None, checkpoint_every=100000, retries=5):
+
+        """ Inserts csv flight data in all CQL tables. Returns an IngestReport (rows, seconds, rows_per_s).
+
+        Flights are inserted by segments of `checkpoint_every` rows. At the end of a segment every write is acknowledged,
+        the rollup rows of the file (sums over its flights so far) replace its previous ones & the checkpoint file (if any)
+        records the number of inserted rows. An interrupted load restarted with the same checkpoint resumes after 
+        the last recorded row (inserts are idempotent, so rows of the interrupted segment are simply written again,
+        & the skipped rows are added again to the rollup sums, which are rewritten as a whole).
 
         Parameters
         ------------
@@ -196,27 +770,252 @@ class FlightData:
                dictionary containing Plane data.  
         limit:
                max number of inserted elements.
+        concurrency:
+               max number of asynchronous writes in flight per table. 
+               If None, every row is inserted with blocking queries (one query per row & table).
+        cache_dir:
+               directory of the binary column caches (see flight_cache). If None, the CSV file is parsed directly.
+        checkpoint:
+               name of the JSON checkpoint file. If None, no progress is recorded.
+        checkpoint_every:
+               number of rows of a segment.
+        retries:
+               max number of retries of a failed write (with exponential backoff).
         """
 
-        stream = flight_data.read_flight_csv(fname, planeDict)
-        
-        INSERT_Q = (
-            self._insert_query_by_datetime, 
-            self._insert_query_by_dayofweek,
-            self._insert_query_by_dephour
-        )
+        state = self._load_checkpoint(checkpoint, fname)
+
+        stream = flight_cache.read_flights(fname, planeDict, cache_dir, self._metrics)
 
         if limit is not None:
             stream = flight_data.limiter(stream, limit)
-        for flight in stream:
-            for q in INSERT_Q:
-                query = q(flight)
-                self._session.execute(query)
+        source = state["source"]["file"]
+        rollups = _SourceRollups()
+        #skip rows inserted before the checkpoint (still counted in the rollups of the file)
+        collections.deque(self._with_rollups(itertools.islice(stream, state["rows"]), rollups), maxlen=0)
+
+        written = collections.Counter(state["written"])
+
+        start = time.perf_counter()
+        rows = 0
+        touched = set() if self._cache is not None else None
+        while True:
+            segment = self._with_rollups(itertools.islice(stream, checkpoint_every), rollups, touched)
+            try:
+                n = self._backend.write_flights(segment, written, concurrency, retries,
+                                                rollups=lambda: (source, rollups.sums()))
+            finally:
+                if touched:   #also the partitions of a segment partly written before an error
+                    for table, key in touched:
+                        self._cache.invalidate(table, key)
+                    touched.clear()
+            if n == 0:
+                break
+            rows += n
+            state["rows"] += n
+            state["written"] = dict(written)
+            self._save_checkpoint(checkpoint, state)
+            self._metrics.maybe_log()
+        seconds = time.perf_counter() - start
+
+        return IngestReport(rows, seconds, rows / seconds if seconds > 0 else 0.0)
+
+    def _load_checkpoint(self, checkpoint, fname):
+        """ Returns the ingestion state of a file from its checkpoint, or a new state if the checkpoint 
+        is missing or belongs to another file (or another version of the file).
+
+        Parameters
+        ------------
+        checkpoint:
+               name of the JSON checkpoint file (or None).
+        fname:
+               name of the CSV file to insert.
+        """
+
+        source = dict(flight_cache.source_stamp(fname), file=os.path.abspath(fname))
+        if checkpoint is not None and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                state = json.load(f)
+            if state.get("source") == source:
+                return state
+        return {"source": source, "rows": 0, "written": {}}
+
+    def _save_checkpoint(self, checkpoint, state):
+        """ Atomically writes the ingestion state to the checkpoint file.
+
+        Parameters
+        ------------
+        checkpoint:
+               name of the JSON checkpoint file (or None).
+        state:
+               ingestion state (source file identity, inserted rows, acknowledged writes per table).
+        """
+
+        if checkpoint is None:
+            return
+        tmp = checkpoint + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, checkpoint)
+
+    @staticmethod
+    def _row_to_flight(r):
+        """ Returns a flight_data.Flight from a row of one of the CQL tables (fields missing from the tables are filled with placeholders).
+
+        Parameters
+        ------------
+        r:
+               row returned by a SELECT query.
+        
+        """
+        return flight_data.Flight(r.year, r.month, r.day, 
+                getattr(r, "dayofweek", 9), r.dep_hour, r.dep_min, 
+                r.arr_hour, r.arr_min,
+                r.depdelay, r.arrdelay, 
+                np.nan, r.weatherdel, np.nan, 
+                np.nan, np.nan, 
+                0, 0, r.flightnum)
+
+    def _select(self, table, key):
+        """ Returns the rows of a partition, from the partition cache if it holds them.
+
+        Parameters
+        ------------
+        table:
+               name of the table.
+        key:
+               partition key (tuple, in PARTITION_KEYS order).
+        
+        """
+
+        if self._cache is None:
+            return self._backend.select(table, key)
+        columns = self._cache.get(table, key)
+        if columns is None:
+            columns = self._cache.put(table, key, self._backend.select(table, key))
+        return storage.columns_to_rows(table, columns)
+
+    def _select_many(self, table, keys, concurrency, ordered):
+        """ Yields the rows of several partitions. Partitions missing from the partition cache are queried 
+        (with a bounded number of queries in flight) & cached; with a cache, partitions are always yielded in key order.
+
+        Parameters
+        ------------
+        table:
+               name of the table.
+        keys:
+               list of partition keys.
+        concurrency:
+               max number of partition queries in flight.
+        ordered:
+               if True, partitions are yielded in key order. If False, they may be yielded as they arrive.
+        
+        """
+
+        if self._cache is None:
+            yield from self._backend.select_many(table, keys, concurrency, ordered)
+            return
+
+        cached = [self._cache.get(table, key) for key in keys]
+        missing = [key for key, columns in zip(keys, cached) if columns is None]
+        fetched = zip(missing, self._backend.select_many(table, missing, concurrency, True))
+        for columns in cached:
+            if columns is None:
+                key, rows = next(fetched)
+                columns = self._cache.put(table, key, rows)
+            yield storage.columns_to_rows(table, columns)
+
+    def _select_batches(self, table, keys, columns, fetch_size, concurrency=None):
+        """ Yields the rows of several partitions as column batches (dicts column -> NumPy array) of at most 
+        fetch_size rows, holding only the requested columns. Partitions held by the partition cache are sliced 
+        from it; the others are paged from the backend (& not cached, as only some of their columns are read).
+
+        Parameters
+        ------------
+        table:
+               name of the table.
+        keys:
+               list of partition keys.
+        columns:
+               requested column names. If None, all columns of the table are returned.
+        fetch_size:
+               max number of rows of a batch (page size of the queries).
+        concurrency:
+               max number of partition queries in flight.
+        
+        """
+
+        columns = storage.check_columns(table, columns)
+        if self._cache is None:
+            yield from self._backend.select_batches(table, keys, columns, fetch_size, concurrency)
+            return
+
+        cached = [(key, self._cache.get(table, key)) for key in keys]
+        for is_missing, run in itertools.groupby(cached, key=lambda item: item[1] is None):
+            run = list(run)
+            if is_missing:
+                yield from self._backend.select_batches(table, [key for key, _ in run], columns, fetch_size, concurrency)
+                continue
+            for _, partition in run:
+                for start in range(0, len(partition[columns[0]]), fetch_size):
+                    yield {c: _widen(partition[c][start:start + fetch_size]) for c in columns}
+
+    def _dow_keys(self, dow, yow):
+        """ Returns the table & select keys holding the flights of a day of week (one partition, or its month buckets).
+
+        Parameters
+        ------------
+        dow:
+               day of week.
+        yow:
+               year of the searched weeks.  
+        
+        """
+
+        if self._layout == "original":
+            return "flight_by_dayofweek", [(yow, dow)]
+        return "flight_by_dow_month", [key for key in self.partitions("flight_by_dow_month") if key[:2] == (yow, dow)]
+
+    def _dephour_keys(self, hour, minute, year):
+        """ Returns the table & select keys holding the flights of a departure year/hour/minute 
+        (one partition, or the minute slice of its month buckets).
+
+        Parameters
+        ------------
+        hour:
+               departure hour of searched flights.
+        minute:
+               departure minutes of searched flights. 
+        year:
+               departure year of searched flights. 
+        
+        """
+
+        if self._layout == "original":
+            return "flight_by_dephour", [(hour, minute, year)]
+        return "flight_by_hour_month", [
+            key + (minute,) for key in self.partitions("flight_by_hour_month") if key[:2] == (hour, year)]
+
+    def _hour_keys(self, hour):
+        """ Returns the table & partition keys holding the flights of a departure hour, in (year, minute) 
+        or (year, month) order.
+
+        Parameters
+        ------------
+        hour:
+               departure hour of searched flights.
+        
+        """
+
+        if self._layout == "original":
+            return "flight_by_dephour", sorted(
+                (key for key in self.partitions("flight_by_dephour") if key[0] == hour),  #partitions holding data
+                key=lambda key: (key[2], key[1]))
+        return "flight_by_hour_month", [key for key in self.partitions("flight_by_hour_month") if key[0] == hour]
 
-    
     def get_flight_by_dow(self, dow, yow):
         
-        """ Yields results of a query from flight_by_dayofweek table.
+        """ Yields results of a query from flight_by_dayofweek table (or from the month buckets of flight_by_dow_month).
 
         Parameters
         ------------
@@ -227,29 +1026,10 @@ class FlightData:
         
         """
 
-        query = textwrap.dedent(
-            f"""
-            SELECT
-            year, month, day, dayofweek, dep_hour, dep_min, arr_hour, arr_min,
-            depdelay, arrdelay, carrierdel, weatherdel, NASdel,
-            securitydel, lateACdel, flightnum 
-            FROM
-            flight_by_dayofweek
-            WHERE
-                year = {yow}
-                AND
-                dayofweek = {dow}
-            ;
-            """
-            )
-        for r in self._session.execute(query):
-                yield flight_data.Flight(r.year, r.month, r.day, 
-                        r.dayofweek, r.dep_hour, r.dep_min, 
-                        r.arr_hour, r.arr_min,
-                        r.depdelay, r.arrdelay, 
-                        np.nan, r.weatherdel, np.nan, 
-                        np.nan, np.nan, 
-                        0, 0, r.flightnum)
+        table, keys = self._dow_keys(dow, yow)
+        for rows in self._select_many(table, keys, len(keys) or 1, True):
+            for r in rows:
+                yield self._row_to_flight(r)
 
     def get_flight_by_datetime(self, year, month, day):
         
@@ -266,53 +1046,34 @@ class FlightData:
         
         """
 
-        query = textwrap.dedent(
-            f"""
-            SELECT
-            year, month, day, dep_hour, dep_min, arr_hour, arr_min,
-            depdelay, arrdelay, carrierdel, weatherdel, NASdel,
-            securitydel, lateACdel, flightnum 
-            FROM
-            flight_by_datetime
-            WHERE
-                year = {year}
-                AND
-                month = {month}
-                AND
-                day = {day}
-            ;
-            """
-            )
+        for r in self._select("flight_by_datetime", (year, month, day)):
+                yield self._row_to_flight(r)
 
-        for r in self._session.execute(query):            
-                yield flight_data.Flight(r.year, r.month, r.day, 
-                        9, r.dep_hour, r.dep_min, 
-                        r.arr_hour, r.arr_min,
-                        r.depdelay, r.arrdelay, 
-                        np.nan, r.weatherdel, np.nan, 
-                        np.nan, np.nan, 
-                        0, 0, r.flightnum)   
-
-    def get_flights_by_month(self, month):
+    def get_flights_by_month(self, month, concurrency=32, ordered=True):
         
         """ Yields results of a query from flight_by_datetime table using only month.
+        The partition queries are sent asynchronously, with a bounded number in flight.
 
         Parameters
         ------------
         month:
                month number of searched flights. 
+        concurrency:
+               max number of partition queries in flight.
+        ordered:
+               if True, flights are yielded in (year, day) order. If False, partitions are yielded as they arrive.
         
         """
 
-        for year in range(1987, 2008):  #years for which data is available
-            for day in range(1,32):
-                for x in self.get_flight_by_datetime(year, month, day):
-                    yield x
+        keys = [key for key in self.partitions("flight_by_datetime") if key[1] == month]  #partitions holding data
+        for rows in self._select_many("flight_by_datetime", keys, concurrency, ordered):
+            for r in rows:
+                yield self._row_to_flight(r)
 
-    
     def get_flight_by_dephour(self, hour, minute, year):
         
-        """ Yields results of a query from flight_by_dephour table using departure year/hour/minute.
+        """ Yields results of a query from flight_by_dephour table (or from the month buckets of flight_by_hour_month) 
+        using departure year/hour/minute.
 
         Parameters
         ------------
@@ -325,49 +1086,138 @@ class FlightData:
         
         """
 
-        query = textwrap.dedent(
-            f"""
-            SELECT
-            year, month, day, dep_hour, dep_min, 
-            arr_hour, arr_min,
-            depdelay, arrdelay, 
-            carrierdel, weatherdel, NASdel,
-            securitydel, lateACdel, flightnum 
-            FROM
-            flight_by_dephour
-            WHERE
-                dep_hour = {hour}
-                AND
-                dep_min = {minute}
-                AND
-                year = {year}
-            ;
-            """
-            )
+        table, keys = self._dephour_keys(hour, minute, year)
+        for rows in self._select_many(table, keys, len(keys) or 1, True):
+            for r in rows:
+                yield self._row_to_flight(r)
+
+    def get_flights_by_hour(self, hour, concurrency=32, ordered=True):
+        
+        """ Yields results of a query from flight_by_dephour table (or flight_by_hour_month) using departure hour.
+        The partition queries are sent asynchronously, with a bounded number in flight.
+
+        Parameters
+        ------------
+        hour:
+               departure hour of searched flights.
+        concurrency:
+               max number of partition queries in flight.
+        ordered:
+               if True, flights are yielded in (year, minute) order ((year, month) order with the bucketed layout). 
+               If False, partitions are yielded as they arrive.
+        
+        """
+
+        table, keys = self._hour_keys(hour)
+        for rows in self._select_many(table, keys, concurrency, ordered):
+            for r in rows:
+                yield self._row_to_flight(r)
+
+    def get_flight_batches_by_dow(self, dow, yow, columns=None, fetch_size=5000):
+        
+        """ Yields results of a query from flight_by_dayofweek table as column batches 
+        (dicts column -> NumPy array of at most fetch_size rows, holding only the requested columns).
+
+        Parameters
+        ------------
+        dow:
+               day of week.
+        yow:
+               year of the searched weeks.  
+        columns:
+               requested column names (see TABLE_COLUMNS). If None, all columns of the table are returned.
+        fetch_size:
+               max number of rows of a batch (page size of the queries).
+        
+        """
+
+        table, keys = self._dow_keys(dow, yow)
+        return self._select_batches(table, keys, columns, fetch_size, len(keys) or 1)
+
+    def get_flight_batches_by_datetime(self, year, month, day, columns=None, fetch_size=5000):
+        
+        """ Yields results of a query from flight_by_datetime table using year/month/day, as column batches 
+        (dicts column -> NumPy array of at most fetch_size rows, holding only the requested columns).
+
+        Parameters
+        ------------
+        year:
+               year of searched flights.
+        month:
+               month number of searched flights. 
+        day:
+               day of month of searched flights. 
+        columns:
+               requested column names (see TABLE_COLUMNS). If None, all columns of the table are returned.
+        fetch_size:
+               max number of rows of a batch (page size of the queries).
+        
+        """
+
+        return self._select_batches("flight_by_datetime", [(year, month, day)], columns, fetch_size)
+
+    def get_flight_batches_by_month(self, month, columns=None, fetch_size=5000, concurrency=32):
+        
+        """ Yields results of a query from flight_by_datetime table using only month, as column batches 
+        (dicts column -> NumPy array of at most fetch_size rows, holding only the requested columns), in (year, day) order.
+
+        Parameters
+        ------------
+        month:
+               month number of searched flights. 
+        columns:
+               requested column names (see TABLE_COLUMNS). If None, all columns of the table are returned.
+        fetch_size:
+               max number of rows of a batch (page size of the queries).
+        concurrency:
+               max number of partition queries in flight.
+        
+        """
+
+        keys = [key for key in self.partitions("flight_by_datetime") if key[1] == month]  #partitions holding data
+        return self._select_batches("flight_by_datetime", keys, columns, fetch_size, concurrency)
+
+    def get_flight_batches_by_dephour(self, hour, minute, year, columns=None, fetch_size=5000):
+        
+        """ Yields results of a query from flight_by_dephour table using departure year/hour/minute, as column batches 
+        (dicts column -> NumPy array of at most fetch_size rows, holding only the requested columns).
+
+        Parameters
+        ------------
+        hour:
+               departure hour of searched flights.
+        minute:
+               departure minutes of searched flights. 
+        year:
+               departure year of searched flights. 
+        columns:
+               requested column names (see TABLE_COLUMNS). If None, all columns of the table are returned.
+        fetch_size:
+               max number of rows of a batch (page size of the queries).
+        
+        """
+
+        table, keys = self._dephour_keys(hour, minute, year)
+        return self._select_batches(table, keys, columns, fetch_size, len(keys) or 1)
 
-        for r in self._session.execute(query):
-                yield flight_data.Flight(r.year, r.month, r.day, 
-                        9, r.dep_hour, r.dep_min, 
-                        r.arr_hour, r.arr_min,
-                        r.depdelay, r.arrdelay, 
-                        np.nan, r.weatherdel, np.nan, 
-                        np.nan, np.nan, 
-                        0, 0, r.flightnum) 
-
-    
-    
-    def get_flights_by_hour(self, hour):
+    def get_flight_batches_by_hour(self, hour, columns=None, fetch_size=5000, concurrency=32):
         
-        """ Yields results of a query from flight_by_dephour table using departure hour.
+        """ Yields results of a query from flight_by_dephour table using departure hour, as column batches 
+        (dicts column -> NumPy array of at most fetch_size rows, holding only the requested columns), 
+        in (year, minute) order ((year, month) order with the bucketed layout).
 
         Parameters
         ------------
         hour:
                departure hour of searched flights.
+        columns:
+               requested column names (see TABLE_COLUMNS). If None, all columns of the table are returned.
+        fetch_size:
+               max number of rows of a batch (page size of the queries).
+        concurrency:
+               max number of partition queries in flight.
         
         """
 
-        for year in range(1987, 2008):  #years for which data is available
-            for minute in range(60):
-                for x in self.get_flight_by_dephour(hour, minute, year):
-                    yield x
\ No newline at end of file
+        table, keys = self._hour_keys(hour)
+        return self._select_batches(table, keys, columns, fetch_size, concurrency)
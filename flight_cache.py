@@ -0,0 +1,245 @@
+import os
+import json
+import hashlib
+import shutil
+import numpy as np
+import flight_data as fd
+
+
+# Compact on-disk dtype of every Flight field
+COLUMN_DTYPES = {
+    "Year": np.int16, "Month": np.int8, "Day": np.int8, "DayOfWeek": np.int8,
+    "CRSDepHour": np.int8, "CRSDepMin": np.int8,
+    "CRSArrHour": np.int8, "CRSArrMin": np.int8,
+    "DepDelay": np.int16, "ArrDelay": np.int16,
+    "CarrierDelay": np.int16, "WeatherDelay": np.int16, "NASDelay": np.int16,
+    "SecurityDelay": np.int16, "LateAircraftDelay": np.int16,
+    "TailNum": "S8", "MFRYear": np.int16,
+    "FlightNum": np.int16,
+}
+
+CACHE_VERSION = 2
+
+
+def source_stamp(file):
+    """Returns the identity of a source file (size & modification time) used to invalidate its cache.
+
+    Parameters
+    ------------
+    file:
+            name of the source CSV file.
+
+    """
+    st = os.stat(file)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def plane_fingerprint(planeDict):
+    """Returns the digest of the plane data a cache was built with (MFRYear & row validity depend on it).
+
+    Parameters
+    ------------
+    planeDict:
+            Dictionary containing Plane data (flight_data.PlaneIndex or KVStore).
+
+    """
+    return planeDict.fingerprint()
+
+
+def cache_path(file, cache_dir):
+    """Returns the cache directory of a flight csv file (named after its absolute path, so that files with the same
+    name in different directories get different caches).
+
+    Parameters
+    ------------
+    file:
+            name of the source CSV file.
+    cache_dir:
+            directory containing the column caches.
+
+    """
+    digest = hashlib.sha1(os.path.abspath(file).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{os.path.basename(file)}-{digest}.cols")
+
+
+def _read_meta(path):
+    try:
+        with open(os.path.join(path, "meta.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_cache_valid(file, planeDict, cache_dir):
+    """Returns True if the column cache of a flight csv file exists & matches the current source file & plane data.
+
+    Parameters
+    ------------
+    file:
+            name of the source CSV file.
+    planeDict:
+            Dictionary containing Plane data.
+    cache_dir:
+            directory containing the column caches.
+
+    """
+    meta = _read_meta(cache_path(file, cache_dir))
+    return (
+        meta is not None
+        and meta.get("version") == CACHE_VERSION
+        and meta.get("source") == source_stamp(file)
+        and meta.get("planes") == plane_fingerprint(planeDict)
+    )
+
+
+def _to_disk_dtype(field, values):
+    dtype = np.dtype(COLUMN_DTYPES[field])
+    if dtype.kind == "S":
+        out = np.char.encode(values, "ascii")
+        if len(out) and np.char.str_len(out).max() > dtype.itemsize:
+            raise ValueError(f"{field} value longer than {dtype.itemsize} characters")
+        return out.astype(dtype)
+    info = np.iinfo(dtype)
+    if len(values) and (values.min() < info.min or values.max() > info.max):
+        raise ValueError(f"{field} value out of {dtype} range")
+    return values.astype(dtype)
+
+
+def write_flight_cache(file, planeDict, cache_dir):
+    """Parses a flight csv file once & writes its valid rows to a per-column binary cache. Returns the number of rows.
+
+    Parameters
+    ------------
+    file:
+            name of the source CSV file.
+    planeDict:
+            Dictionary containing Plane data.
+    cache_dir:
+            directory containing the column caches.
+
+    """
+    path = cache_path(file, cache_dir)
+    tmp = path + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    stamp = source_stamp(file)
+    outputs = {field: open(os.path.join(tmp, field + ".bin"), "wb") for field in fd.Flight._fields}
+    rows = 0
+    try:
+        for chunk in fd.read_flight_chunks(file, planeDict):
+            for field, out in outputs.items():
+                _to_disk_dtype(field, getattr(chunk, field)[chunk.Valid]).tofile(out)
+            rows += int(chunk.Valid.sum())
+    finally:
+        for out in outputs.values():
+            out.close()
+
+    meta = {
+        "version": CACHE_VERSION,
+        "source": stamp,
+        "planes": plane_fingerprint(planeDict),
+        "rows": rows,
+        "dtypes": {field: np.dtype(dtype).str for field, dtype in COLUMN_DTYPES.items()},
+    }
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp, path)
+    return rows
+
+
+def open_flight_cache(file, planeDict, cache_dir):
+    """Returns a FlightChunk of read-only memory maps over the column cache of a flight csv file.
+    The cache is (re)built first if it is missing or if the source file changed.
+
+    Parameters
+    ------------
+    file:
+            name of the source CSV file.
+    planeDict:
+            Dictionary containing Plane data.
+    cache_dir:
+            directory containing the column caches.
+
+    """
+    if not is_cache_valid(file, planeDict, cache_dir):
+        write_flight_cache(file, planeDict, cache_dir)
+
+    path = cache_path(file, cache_dir)
+    meta = _read_meta(path)
+    rows = meta["rows"]
+    columns = {}
+    for field, dtype in meta["dtypes"].items():
+        if rows == 0:
+            columns[field] = np.empty(0, dtype=dtype)
+        else:
+            columns[field] = np.memmap(os.path.join(path, field + ".bin"),
+                                       dtype=dtype, mode="r", shape=(rows,))
+    return fd.FlightChunk(Valid=np.ones(rows, dtype=bool), **columns)
+
+
+def read_cached_chunks(file, planeDict, cache_dir, chunksize=65536, metrics=None):
+    """Creates generator of FlightChunk batches read from the column cache of a flight csv file.
+
+    Parameters
+    ------------
+    file:
+            name of the source CSV file.
+    planeDict:
+            Dictionary containing Plane data.
+    cache_dir:
+            directory containing the column caches.
+    chunksize:
+            number of rows per chunk.
+    metrics:
+            metrics.Metrics counting read rows. Optional.
+
+    """
+    columns = open_flight_cache(file, planeDict, cache_dir)
+    for start in range(0, len(columns.Valid), chunksize):
+        chunk = {field: col[start:start + chunksize] for field, col in columns._asdict().items()}
+        chunk["TailNum"] = np.char.decode(chunk["TailNum"], "ascii")
+        if metrics is not None:
+            metrics.inc("rows_read", len(chunk["Valid"]), source="cache")
+        yield fd.FlightChunk(**chunk)
+
+
+def read_flight_cached(file, planeDict, cache_dir, metrics=None):
+    """Creates generator of Flight tuples read from the column cache of a flight csv file.
+
+    Parameters
+    ------------
+    file:
+            name of the source CSV file.
+    planeDict:
+            Dictionary containing Plane data.
+    cache_dir:
+            directory containing the column caches.
+    metrics:
+            metrics.Metrics counting read rows. Optional.
+
+    """
+    for chunk in read_cached_chunks(file, planeDict, cache_dir, metrics=metrics):
+        yield from fd.chunk_flights(chunk)
+
+
+def read_flights(file, planeDict, cache_dir=None, metrics=None):
+    """Creates generator of Flight tuples from a flight csv file, through its column cache when cache_dir is given.
+
+    Parameters
+    ------------
+    file:
+            name of the source CSV file.
+    planeDict:
+            Dictionary containing Plane data.
+    cache_dir:
+            directory containing the column caches. If None, the CSV file is parsed directly.
+    metrics:
+            metrics.Metrics recording row counters. Optional.
+
+    """
+    if cache_dir is None:
+        return fd.read_flight_csv(file, planeDict, metrics)
+    return read_flight_cached(file, planeDict, cache_dir, metrics)
@@ -1,8 +1,15 @@
+import io
+import os
+import hashlib
+import gc
+import contextlib
 import csv
 import time
+import itertools
 import collections
 import textwrap
 import numpy as np
+import compressed
 
 
 # LIMITERS
@@ -37,8 +44,188 @@ Flight = collections.namedtuple(
 )
 
 
-def read_flight_csv(file, planeDict):
-    """Creates generator from flight csv file.
+# Flight field -> column of the flight CSV files
+CSV_COLUMNS = {
+    "Year": "Year", "Month": "Month", "Day": "DayofMonth", "DayOfWeek": "DayOfWeek",
+    "DepDelay": "DepDelay", "ArrDelay": "ArrDelay",
+    "CarrierDelay": "CarrierDelay", "WeatherDelay": "WeatherDelay", "NASDelay": "NASDelay",
+    "SecurityDelay": "SecurityDelay", "LateAircraftDelay": "LateAircraftDelay",
+    "FlightNum": "FlightNum",
+}
+
+# Batch of flights: one NumPy array per Flight field & a mask of valid rows
+FlightChunk = collections.namedtuple("FlightChunk", Flight._fields + ("Valid",))
+
+
+# Bounds of the parsed integers (excluded: NumPy clips out of range values to them & the lower one marks invalid cells)
+_INT64_BOUNDS = np.array([np.iinfo(np.int64).min, np.iinfo(np.int64).max])
+
+
+def _parse_int(value):
+    """Returns the integer of a CSV cell (as int() parses it), or the lower int64 bound if it is not an integer
+    within the int64 bounds."""
+    try:
+        number = int(value)
+    except ValueError:
+        return _INT64_BOUNDS[0]
+    return number if _INT64_BOUNDS[0] < number < _INT64_BOUNDS[1] else _INT64_BOUNDS[0]
+
+
+def _parse_int_column(values):
+    """Parses a sequence of strings into integers (as int() does). Returns (int64 array, mask of parsable values).
+    Columns of plain decimal integers (the common case) are parsed at once by NumPy from the joined cells;
+    other columns parse every distinct string once (CSV columns hold few distinct values, e.g. "NA").
+
+    Parameters
+    ------------
+    values:
+            sequence of strings (CSV column).
+
+    """
+    n = len(values)
+    text = ",".join(values)
+    digits_only = not text.encode().translate(None, b"0123456789,-")
+    if digits_only and "-," not in text and not text.endswith("-"):
+        try:
+            parsed = np.fromstring(text, dtype=np.int64, sep=",")   #raises on empty cells & misplaced signs
+        except ValueError:
+            parsed = None
+        if parsed is not None and len(parsed) == n and not np.isin(parsed, _INT64_BOUNDS).any():
+            return parsed, np.ones(n, dtype=bool)
+
+    parsed = dict.fromkeys(values)
+    for value in parsed:
+        parsed[value] = _parse_int(value)
+    numbers = np.fromiter(map(parsed.__getitem__, values), np.int64, n)
+    ok = numbers != _INT64_BOUNDS[0]
+    numbers[~ok] = 0
+    return numbers, ok
+
+
+def _factorize(values):
+    """Returns (str array of the distinct values, in order of first occurrence; index of each value in it).
+
+    Parameters
+    ------------
+    values:
+            sequence of strings (CSV column).
+
+    """
+    codes = {value: i for i, value in enumerate(dict.fromkeys(values))}
+    inverse = np.fromiter(map(codes.__getitem__, values), np.intp, len(values))
+    return np.asarray(list(codes), dtype=str), inverse
+
+
+def _lookup_mfryear(planeDict, tailnums):
+    """Looks up manufacture years of an array of distinct tail numbers. Returns (year array, mask of found tail
+    numbers).
+
+    Parameters
+    ------------
+    planeDict:
+            dictionary containing Plane data.
+    tailnums:
+            array of distinct tail numbers.
+
+    """
+    if hasattr(planeDict, "lookup_many"):
+        return planeDict.lookup_many(tailnums)
+
+    years = np.zeros(len(tailnums), dtype=np.int64)
+    found = np.zeros(len(tailnums), dtype=bool)
+    for i, tailnum in enumerate(tailnums.tolist()):
+        try:
+            years[i] = planeDict.read(tailnum)
+        except MissingKeyError:
+            continue
+        found[i] = True
+    return years, found
+
+
+def parse_flight_rows(rows, header, planeDict, metrics=None):
+    """Parses rows of a flight csv file into a FlightChunk (invalid rows are marked in the Valid mask).
+    
+    Parameters
+    ------------
+    rows:
+            list of CSV rows (lists of strings), without the header.
+    header:
+            header row of the CSV file.
+    planeDict:
+            Dictionary containing Plane data.
+    metrics:
+            metrics.Metrics counting read & rejected rows (by reason: ragged, parse, unknown_tailnum). Optional.
+
+    """
+    index = {name: i for i, name in enumerate(header)}
+    ragged = np.fromiter(map(len, rows), np.int64, len(rows)) != len(header)
+    if ragged.any():
+        blank = [""] * len(header)
+        rows = [r if len(r) == len(header) else blank for r in rows]
+
+    with _gc_paused():
+        columns = list(zip(*rows)) if rows else [()] * len(header)
+
+    def column(name):
+        return columns[index[name]]
+
+    fields = {}
+    valid = np.ones(len(rows), dtype=bool)
+    for field, name in CSV_COLUMNS.items():
+        fields[field], ok = _parse_int_column(column(name))
+        valid &= ok
+
+    for prefix, name in (("CRSDep", "CRSDepTime"), ("CRSArr", "CRSArrTime")):
+        hhmm, ok = _parse_int_column(column(name))
+        fields[prefix + "Hour"], fields[prefix + "Min"] = np.divmod(hhmm, 100)
+        valid &= ok
+
+    tailnums, inverse = _factorize(column("TailNum"))   #each distinct tail number is looked up once
+    years, found = _lookup_mfryear(planeDict, tailnums)
+    fields["TailNum"], fields["MFRYear"], found = tailnums[inverse], years[inverse], found[inverse]
+
+    if metrics is not None:
+        metrics.inc("rows_read", len(rows))
+        metrics.inc("rows_rejected", int(ragged.sum()), reason="ragged")
+        metrics.inc("rows_rejected", int((~valid & ~ragged).sum()), reason="parse")
+        metrics.inc("rows_rejected", int((valid & ~found).sum()), reason="unknown_tailnum")
+
+    valid &= found
+
+    return FlightChunk(Valid=valid, **fields)
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """Pauses the garbage collector within the block. Building the rows of a chunk (& their columns) allocates
+    many container objects; each allocation burst would trigger collections scanning every row read so far,
+    although the rows hold no reference cycles."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _read_rows(reader, n):
+    """Returns the next n rows (at most) of a csv reader as a list, with the garbage collector paused.
+
+    Parameters
+    ------------
+    reader:
+            csv reader.
+    n:
+            max number of rows.
+
+    """
+    with _gc_paused():
+        return list(itertools.islice(reader, n))
+
+
+def read_flight_chunks(file, planeDict, chunksize=65536, metrics=None, processes=None):
+    """Creates generator of FlightChunk column batches from flight csv file (plain, .gz or .bz2).
     
     Parameters
     ------------
@@ -46,51 +233,144 @@ def read_flight_csv(file, planeDict):
             name of CSV file to read.
     planeDict:
             Dictionary containing Plane data.
+    chunksize:
+            number of CSV rows per chunk.
+    metrics:
+            metrics.Metrics recording row counters & parse times. Optional.
+    processes:
+            number of bz2 decompression processes (see compressed.open_text). If None, the number of CPUs is used.
+
+    """
+    with compressed.open_text(file, processes) as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        while True:
+            start = time.perf_counter()
+            rows = _read_rows(reader, chunksize)
+            if not rows:
+                return
+            chunk = parse_flight_rows(rows, header, planeDict, metrics)
+            if metrics is not None:
+                metrics.observe("parse_seconds", time.perf_counter() - start)
+            yield chunk
+
+
+def split_flight_csv(file, split_bytes):
+    """Splits a flight csv file into byte ranges of about split_bytes, cut on line boundaries.
+    Returns a list of (start, end) offsets; the first range starts after the header line.
+    Compressed files cannot be split (ValueError).
+    
+    Parameters
+    ------------
+    file:
+            name of CSV file to split.
+    split_bytes:
+            approximate size of a range, in bytes.
+
+    """
+    if compressed.compression(file) is not None:
+        raise ValueError(f"{file}: compressed files cannot be split into byte ranges")
+    size = os.path.getsize(file)
+    with open(file, "rb") as f:
+        f.readline()
+        bounds = [f.tell()]
+        while bounds[-1] < size:
+            f.seek(max(bounds[-1] + split_bytes - 1, bounds[-1]))
+            f.readline()
+            bounds.append(min(f.tell(), size))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def read_flight_header(file):
+    """Returns the header row of a flight csv file (plain, .gz or .bz2).
+    
+    Parameters
+    ------------
+    file:
+            name of CSV file.
 
     """
-    with open(file) as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            try:
-                year = int(row["Year"])
-                month = int(row["Month"])
-                day = int(row["DayofMonth"])
-                dow = int(row["DayOfWeek"])
-                
-                dep_hour = int(row["CRSDepTime"][:2])
-                dep_min =int(row["CRSDepTime"][2:])
-                
-                arr_hour = int(row["CRSArrTime"][:2])
-                arr_min = int(row["CRSArrTime"][2:])
-                
-                depdelay = int(row["DepDelay"])
-                arrdelay = int(row["ArrDelay"])
-                carrierdel = int(row["CarrierDelay"])
-                weatherdel = int(row["WeatherDelay"])
-                NASdel = int(row["NASDelay"])
-                securitydel = int(row["SecurityDelay"])
-                lateACdel = int(row["LateAircraftDelay"])
-                
-                tailnum = row["TailNum"]
-                mfryear = planeDict.read(tailnum)
-
-                flightnum = int(row["FlightNum"])
-            
-            except:
-                continue
-
-            else:
-                yield Flight(year, month, day, dow, 
-                dep_hour, dep_min, arr_hour, arr_min,
-                depdelay, arrdelay, 
-                carrierdel, weatherdel, NASdel, 
-                securitydel, lateACdel, 
-                tailnum, mfryear, flightnum)
+    with compressed.open_text(file, processes=1) as f:
+        return next(csv.reader(f))
+
+
+def read_flight_range(file, start, end, planeDict, chunksize=65536, header=None, metrics=None):
+    """Creates generator of FlightChunk column batches from a byte range of a flight csv file.
+    The range must be cut on line boundaries (see split_flight_csv).
+    
+    Parameters
+    ------------
+    file:
+            name of CSV file to read.
+    start, end:
+            byte offsets of the range.
+    planeDict:
+            Dictionary containing Plane data.
+    chunksize:
+            number of CSV rows per chunk.
+    header:
+            header row of the file. If None, it is read from the file.
+    metrics:
+            metrics.Metrics recording row counters. Optional.
+
+    """
+    if header is None:
+        header = read_flight_header(file)
+    with open(file, "rb") as f:
+        f.seek(start)
+        text = f.read(end - start).decode()
+    reader = csv.reader(io.StringIO(text, newline=""))
+    while True:
+        rows = _read_rows(reader, chunksize)
+        if not rows:
+            return
+        yield parse_flight_rows(rows, header, planeDict, metrics)
+
+
+def chunk_flights(chunk):
+    """Creates generator of Flight tuples from the valid rows of a FlightChunk.
+    
+    Parameters
+    ------------
+    chunk:
+            FlightChunk to unpack.
+
+    """
+    valid = chunk.Valid
+    columns = [np.asarray(col)[valid].tolist() for col in chunk[:-1]]
+    yield from itertools.starmap(Flight, zip(*columns))
+
+
+def read_flight_csv(file, planeDict, metrics=None, processes=None):
+    """Creates generator from flight csv file (plain, .gz or .bz2).
+    
+    Parameters
+    ------------
+    file:
+            name of CSV file to read.
+    planeDict:
+            Dictionary containing Plane data.
+    metrics:
+            metrics.Metrics recording row counters & parse times. Optional.
+    processes:
+            number of bz2 decompression processes (see compressed.open_text). If None, the number of CPUs is used.
+
+    """
+    for chunk in read_flight_chunks(file, planeDict, metrics=metrics, processes=processes):
+        yield from chunk_flights(chunk)
 
 
 
 ## READ CSV plane-data
 
+class KeyAlreadyExists(KeyError):
+    """ Raised when creating an entry whose key already exists."""
+
+
+class MissingKeyError(KeyError):
+    """ Raised when accessing an entry whose key is missing."""
+
+
 class KVStore:
     """ K/V store with CRUD"""
 
@@ -178,6 +458,11 @@ class KVStore:
 
         del self._content[key]
 
+    def fingerprint(self):
+        """ Returns a digest of the entries (changes whenever an entry changes)."""
+        items = sorted(self._content.items(), key=lambda item: str(item[0]))
+        return hashlib.sha1(repr(items).encode()).hexdigest()
+
 def createPlaneDict_from_csv(f):
     """ Creates dictionary with plane data from csv file.
 
@@ -195,3 +480,114 @@ def createPlaneDict_from_csv(f):
             MFRYear.create(row['tailnum'], int(row['year']))
     return MFRYear
 
+
+class PlaneIndex:
+    """ Read-only tail number -> manufacture year index, stored as a sorted tail number array & an int16 year array.
+    Same read interface as KVStore, plus a vectorized lookup_many."""
+
+    def __init__(self, tailnums, years):
+        tailnums, first = np.unique(np.asarray(tailnums, dtype=str), return_index=True)   #first entry kept for duplicates
+        self._tailnums = tailnums
+        self._years = np.asarray(years, dtype=np.int16)[first]
+
+    def __len__(self):
+        return len(self._tailnums)
+
+    def __contains__(self, key):
+        _, found = self.lookup_many([key])
+        return bool(found[0])
+
+    def lookup_many(self, tailnums):
+        """ Looks up manufacture years of several tail numbers. Returns (int16 year array, mask of found tail numbers).
+        The tail numbers are searched in the sorted index as they are (no re-encoding): callers looking up a column
+        pass its distinct values.
+
+        Parameters
+        ------------
+        tailnums:
+                array of tail numbers.
+
+        """
+        keys = np.asarray(tailnums, dtype=str)
+        if len(self._tailnums) == 0:
+            return np.zeros(len(keys), dtype=np.int16), np.zeros(len(keys), dtype=bool)
+        pos = np.searchsorted(self._tailnums, keys)
+        pos = np.minimum(pos, len(self._tailnums) - 1)
+        found = self._tailnums[pos] == keys
+        return np.where(found, self._years[pos], 0).astype(np.int16), found
+
+    def read(self, key):
+        """ Reads an entry.
+
+        Parameters
+        ------------
+        key:
+                tail number to read.
+
+        Raises
+        ------------
+        MissingKeyError
+                when the key is missing.
+
+        """
+        years, found = self.lookup_many([key])
+        if not found[0]:
+            raise MissingKeyError
+        return int(years[0])
+
+    def fingerprint(self):
+        """ Returns a digest of the index (changes whenever an entry changes)."""
+        digest = hashlib.sha1(self._tailnums.tobytes())
+        digest.update(self._tailnums.dtype.str.encode())
+        digest.update(self._years.astype(np.int16).tobytes())
+        return digest.hexdigest()
+
+    def save(self, f):
+        """ Saves the index to a single .npz file.
+
+        Parameters
+        ------------
+        f:
+            name of the file to write.
+
+        """
+        with open(f, "wb") as out:
+            np.savez(out, tailnums=self._tailnums, years=self._years)
+
+    @classmethod
+    def load(cls, f):
+        """ Loads an index saved with PlaneIndex.save.
+
+        Parameters
+        ------------
+        f:
+            name of the .npz file.
+
+        """
+        index = cls.__new__(cls)
+        with np.load(f) as data:
+            index._tailnums = data["tailnums"]
+            if index._tailnums.dtype.kind == "S":   #saved by older versions as sorted utf-8 bytes (same order)
+                index._tailnums = np.char.decode(index._tailnums, "utf-8")
+            index._years = data["years"]
+        return index
+
+
+def createPlaneIndex_from_csv(f):
+    """ Creates a PlaneIndex with plane data from csv file.
+
+    Parameters
+    ------------
+    f:
+        name of csv file containing plane data (plane-data.csv)
+
+    """
+
+    tailnums = []
+    years = []
+    with open(f) as inp:
+        for row in csv.DictReader(inp):
+            if (type(row['year']) == str) & (row['year'] != 'None') & (row['year'] is not None):
+                tailnums.append(row['tailnum'])
+                years.append(int(row['year']))
+    return PlaneIndex(tailnums, years)
@@ -0,0 +1,113 @@
+import argparse
+import pyspark
+import pyspark.sql
+import pyspark.sql.types
+import flight_data as fd
+import get_rdd as grdd
+
+# Directory partitioning of the Parquet dataset (path/Year=2007/Month=1/part-*.parquet)
+PARTITION_COLUMNS = ("Year", "Month")
+
+# Columns read by the plane-age analyses (analyse_spark.Mean_Age & count_age_del)
+AGE_COLUMNS = ("Year", "DepDelay", "MFRYear")
+
+
+def flight_schema():
+    """Returns the Spark SQL schema of the Flight rows (TailNum is a string, every other field an integer)."""
+    T = pyspark.sql.types
+    return T.StructType([
+        T.StructField(field, T.StringType() if field == "TailNum" else T.IntegerType(), nullable = True)
+        for field in fd.Flight._fields
+    ])
+
+
+def export_flight_parquet(files, planeDict, path, sc = None, mode = "overwrite", numSlices = None):
+    """Converts flight csv files, joined with the plane manufacture year (MFRYear), to a Parquet dataset
+    partitioned by Year & Month. Returns the SparkContext.
+
+    Parameters
+    ------------
+    files:
+            names of CSV files to read (list).
+
+    planeDict:
+            dictionary containing additional Plane data.
+
+    path:
+            directory of the Parquet dataset.
+
+    sc:
+            SparkContext object if already created. If not (value = None), a new SparkContext is created.
+
+    mode:
+            "overwrite" to replace the dataset, "append" to add years to it.
+
+    numSlices:
+            number of partitions the CSV files are parsed in (see get_rdd.get_flight_RDD).
+
+    """
+
+    sc, rdd = grdd.get_flight_RDD(files, planeDict, sc = sc, numSlices = numSlices)
+    spark = pyspark.sql.SparkSession(sc)
+    df = spark.createDataFrame(rdd.map(tuple), schema = flight_schema())
+    (
+        df.repartition(*PARTITION_COLUMNS)   #one file per (Year, Month) directory
+          .write.partitionBy(*PARTITION_COLUMNS)
+          .mode(mode)
+          .parquet(path)
+    )
+    return sc
+
+
+def get_flight_parquet_RDD(path, columns = None, years = None, months = None, where = None, sc = None):
+    """Creates a RDD of flight rows from a Parquet dataset written by export_flight_parquet.
+    Only the requested columns are read, & only the (Year, Month) directories selected by years & months are listed:
+    the analyses of the plane age (columns=AGE_COLUMNS) read a small fraction of the dataset bytes.
+    Rows have one attribute per requested column (e.g. flight.MFRYear).
+
+    Parameters
+    ------------
+    path:
+            directory of the Parquet dataset.
+
+    columns:
+            Flight fields to read (list). If None, all fields are read.
+
+    years:
+            years to read (iterable). If None, all years are read.
+
+    months:
+            months to read (iterable). If None, all months are read.
+
+    where:
+            SQL condition on the columns pushed down to the Parquet reader (e.g. "MFRYear > 0"). Optional.
+
+    sc:
+            SparkContext object if already created. If not (value = None), a new SparkContext is created.
+
+    """
+
+    sc = grdd.get_spark_context(sc)
+    spark = pyspark.sql.SparkSession(sc)
+    df = spark.read.parquet(path)
+    if years is not None:
+          df = df.where(df.Year.isin([int(y) for y in years]))
+    if months is not None:
+          df = df.where(df.Month.isin([int(m) for m in months]))
+    if where is not None:
+          df = df.where(where)
+    if columns is not None:
+          df = df.select(*columns)
+    return sc, df.rdd
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Converts flight csv files to a Parquet dataset partitioned by year & month.")
+    parser.add_argument("path", help = "directory of the Parquet dataset")
+    parser.add_argument("files", nargs = "+", help = "flight csv files")
+    parser.add_argument("--planes", required = True, help = "plane-data.csv file")
+    parser.add_argument("--append", action = "store_true", help = "add the files to an existing dataset")
+    args = parser.parse_args()
+
+    planeDict = fd.createPlaneIndex_from_csv(args.planes)
+    export_flight_parquet(args.files, planeDict, args.path, mode = "append" if args.append else "overwrite")
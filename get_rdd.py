@@ -1,11 +1,85 @@
+import os
 import csv
-import datetime
+import math
 import itertools
-import collections
+import multiprocessing
 import pyspark
+import compressed
 import flight_data as fd
+import flight_cache
 
-def read_flight_csvs(files, planeDict, limit = None):
+# planeDict of the parsing worker processes (set by _init_parse_worker)
+_worker_planeDict = None
+
+
+def _init_parse_worker(planeDict):
+    global _worker_planeDict
+    _worker_planeDict = planeDict
+
+
+def _parse_range(task):
+    """Parses a byte range of a flight csv file in a worker process. Returns the list of its FlightChunks (valid rows only)."""
+    file, start, end, header = task
+    chunks = []
+    for chunk in fd.read_flight_range(file, start, end, _worker_planeDict, header = header):
+        chunks.append(fd.FlightChunk(*[col[chunk.Valid] for col in chunk]))
+    return chunks
+
+
+def _range_tasks(file, split_bytes):
+    header = fd.read_flight_header(file)
+    return [(file, start, end, header) for start, end in fd.split_flight_csv(file, split_bytes)]
+
+
+def read_flight_csvs_parallel(files, planeDict, processes = None, ordered = True, split_bytes = 16 * 2**20):
+    """Creates a stream of flight data from one or multiple flight csv files parsed by a process pool.
+    Files are cut into byte ranges of about split_bytes on line boundaries, and every range is parsed by a worker.
+    Compressed files (.gz, .bz2) cannot be cut: they are parsed by the calling process, 
+    bz2 blocks being decompressed by `processes` workers (see compressed.open_text) while no parse pool is open.
+    
+    Parameters
+    ------------
+    files:
+            names of CSV files to read (list).
+
+    planeDict:
+            dictionary containing additional Plane data.
+
+    processes:
+            number of worker processes. If None, the number of CPUs is used.
+
+    ordered:
+            if True, flights are generated in file order (as read_flight_csvs does). 
+            If False, ranges are generated as soon as they are parsed (compressed files last).
+
+    split_bytes:
+            approximate size of a parsed byte range.
+
+    """
+
+    def parse(tasks):
+        with multiprocessing.Pool(processes, initializer = _init_parse_worker, initargs = (planeDict,)) as pool:
+            if ordered:
+                results = pool.imap(_parse_range, tasks)
+            else:
+                results = pool.imap_unordered(_parse_range, tasks)
+            for chunks in results:
+                for chunk in chunks:
+                    yield from fd.chunk_flights(chunk)
+
+    packed = lambda f : compressed.compression(f) is not None
+    if not ordered:
+          files = sorted(files, key = packed)   #compressed files last
+    #the parse pool is closed before compressed files are read, so at most `processes` workers run at once
+    for is_packed, run in itertools.groupby(files, key = packed):
+        if is_packed:
+              for f in run:
+                  yield from fd.read_flight_csv(f, planeDict, processes = processes)
+        else:
+              yield from parse([task for f in run for task in _range_tasks(f, split_bytes)])
+
+
+def read_flight_csvs(files, planeDict, limit = None, cache_dir = None, processes = None, ordered = True, metrics = None):
     """Creates a stream of flight data from one or multiple flight csv files.
     
     Parameters
@@ -19,21 +93,109 @@ def read_flight_csvs(files, planeDict, limit = None):
     limit:
             max number of generated elements in the stream.
 
+    cache_dir:
+            directory of the binary column caches (see flight_cache). If None, CSV files are parsed directly.
+
+    processes:
+            number of parsing processes (see read_flight_csvs_parallel). If None, files are parsed one at a time.
+            Ignored when cache_dir is given.
+
+    ordered:
+            if False, parallel parsing generates flights in completion order instead of file order.
+
+    metrics:
+            metrics.Metrics recording row counters of the sequential readers. Optional.
+
     """
 
-    gen = itertools.chain(*[fd.read_flight_csv(f, planeDict) for f in files])
+    if cache_dir is None and processes is not None:
+        gen = read_flight_csvs_parallel(files, planeDict, processes = processes, ordered = ordered)
+    else:
+        gen = itertools.chain(*[flight_cache.read_flights(f, planeDict, cache_dir, metrics) for f in files])
     if limit is None:
         return gen
     return fd.limiter(gen, limit)
 
-def get_flight_RDD(files, planeDict, sc = None, limit = None, numSlices = None):
+def _parse_flight_lines(lines, header, planeDict, chunksize = 65536):
+    """Parses an iterator of flight csv lines (a RDD partition) into Flight tuples. Header lines are skipped.
+    
+    Parameters
+    ------------
+    lines:
+            iterator of CSV lines.
+
+    header:
+            header row of the CSV files.
+
+    planeDict:
+            dictionary containing additional Plane data.
+
+    chunksize:
+            number of lines parsed at once.
+
+    """
+
+    rows = (row for row in csv.reader(lines) if row != header)
+    while True:
+        batch = list(itertools.islice(rows, chunksize))
+        if not batch:
+            return
+        yield from fd.chunk_flights(fd.parse_flight_rows(batch, header, planeDict))
+
+
+def _file_RDD(sc, file, header, planeDict_bc, minPartitions):
+    """Creates a RDD of the flights of one csv file, parsed on the executors against the header of that file.
+    
+    Parameters
+    ------------
+    sc: 
+            SparkContext object.
+
+    file:
+            name of the CSV file.
+
+    header:
+            header row of the file.
+
+    planeDict_bc:
+            broadcast dictionary containing additional Plane data.
+
+    minPartitions:
+            min number of partitions of the file.
+
+    """
+
+    return sc.textFile(file, minPartitions = minPartitions).mapPartitions(
+        lambda lines : _parse_flight_lines(lines, header, planeDict_bc.value))
+
+
+def get_spark_context(sc = None):
+    """Returns the given SparkContext, or a new one if sc is None.
+    
+    Parameters
+    ------------
+    sc: 
+            SparkContext object if already created.
+
+    """
+
+    if sc is None:
+          sparkconf = pyspark.SparkConf()
+          sparkconf.set('spark.port.maxRetries', 128)
+          sc = pyspark.SparkContext(conf = sparkconf)
+    return sc
+
+
+def get_flight_RDD(files, planeDict, sc = None, limit = None, numSlices = None, distributed = True,
+                   bytes_per_slice = 64 * 2**20):
     
     """Creates a RDD of flight data from one or multiple flight csv files.
     
     Parameters
     ------------
     files:
-            names of CSV files to read (list).
+            names of CSV files to read (list). Compressed files are read by Spark directly
+            (.bz2 files are split into partitions, a .gz file is read by one task).
 
     planeDict:
             dictionary containing additional Plane data.
@@ -45,16 +207,33 @@ def get_flight_RDD(files, planeDict, sc = None, limit = None, numSlices = None):
             max number of generated elements in the stream.
     
     numSlices:
-            number of partitions to cut the dataset into.
+            number of partitions to cut the dataset into. If None, it is sized from the input size (see bytes_per_slice).
+
+    distributed:
+            if True, files are read & parsed on the executors (textFile splits parsed with mapPartitions, 
+            planeDict broadcast once). If False, flights are parsed on the driver & parallelized.
+
+    bytes_per_slice:
+            input bytes per partition used to size numSlices.
 
     """
 
-    if sc is None:
-          sparkconf = pyspark.SparkConf()
-          sparkconf.set('spark.port.maxRetries', 128)
-          sc = pyspark.SparkContext(conf = sparkconf)
+    sc = get_spark_context(sc)
     if numSlices is None:
-          numSlices = 1000
+          total = sum(os.path.getsize(f) for f in files)
+          numSlices = max(1, math.ceil(total / bytes_per_slice))
+
+    if not distributed:
+          return sc, sc.parallelize(read_flight_csvs(files, planeDict, limit), numSlices = numSlices)
 
-    return sc, sc.parallelize(read_flight_csvs(files, planeDict, limit), numSlices = numSlices)
+    planeDict_bc = sc.broadcast(planeDict)
+    total = sum(os.path.getsize(f) for f in files)
+    rdds = [
+        _file_RDD(sc, f, fd.read_flight_header(f), planeDict_bc, max(1, round(numSlices * os.path.getsize(f) / (total or 1))))
+        for f in files
+    ]
+    rdd = rdds[0] if len(rdds) == 1 else sc.union(rdds)
+    if limit is not None:
+          rdd = sc.parallelize(rdd.take(limit), numSlices = numSlices)   #take only scans the partitions it needs
 
+    return sc, rdd
@@ -0,0 +1,183 @@
+import time
+import logging
+import threading
+import contextlib
+import collections
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Metrics:
+    """ Counters, latency histograms & throughput samples of the ingestion & query pipeline.
+
+    Counters & histograms are identified by a name & labels, e.g.
+        metrics.inc("rows_rejected", reason="parse")
+        metrics.observe("statement_seconds", 0.002, kind="insert", table="flight_by_datetime")
+
+    They can be exported as a log line (periodically with maybe_log) or as Prometheus text (to_prometheus).
+
+    """
+
+    def __init__(self, log_interval=60.0, prefix="flights", rate_counter="rows_read"):
+        self.log_interval = log_interval
+        self.prefix = prefix
+        self.rate_counter = rate_counter
+        self.counters = collections.Counter()
+        self.histograms = {}
+        self.throughput = []   #(elapsed seconds, rate of rate_counter per second since the previous sample)
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._last_sample = (self._start, 0)
+
+    def inc(self, name, value=1, **labels):
+        """ Increments a counter.
+
+        Parameters
+        ------------
+        name:
+                counter name.
+        value:
+                increment.
+        labels:
+                labels of the counter.
+
+        """
+        with self._lock:
+            self.counters[(name, _labels_key(labels))] += value
+
+    def observe(self, name, seconds, **labels):
+        """ Adds a latency to a histogram.
+
+        Parameters
+        ------------
+        name:
+                histogram name.
+        seconds:
+                observed latency.
+        labels:
+                labels of the histogram.
+
+        """
+        key = (name, _labels_key(labels))
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = {"buckets": [0] * (len(LATENCY_BUCKETS) + 1), "sum": 0.0, "count": 0}
+            i = 0
+            while i < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[i]:
+                i += 1
+            hist["buckets"][i] += 1
+            hist["sum"] += seconds
+            hist["count"] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """ Context manager adding the duration of its block to a histogram."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def total(self, name):
+        """ Returns the sum of a counter over all its labels."""
+        with self._lock:
+            return sum(v for (n, _), v in self.counters.items() if n == name)
+
+    def sample_throughput(self):
+        """ Records & returns the rate (per second) of the rate counter since the previous sample."""
+        now = time.monotonic()
+        count = self.total(self.rate_counter)
+        last_time, last_count = self._last_sample
+        rate = (count - last_count) / (now - last_time) if now > last_time else 0.0
+        self._last_sample = (now, count)
+        self.throughput.append((now - self._start, rate))
+        return rate
+
+    def log_line(self):
+        """ Returns a one-line summary of the counters, mean latencies & current throughput."""
+        rate = self.sample_throughput()
+        with self._lock:
+            parts = [f"elapsed={time.monotonic() - self._start:.1f}s", f"{self.rate_counter}/s={rate:.0f}"]
+            for (name, key), value in sorted(self.counters.items()):
+                parts.append(f"{name}{_format_labels(key)}={value}")
+            for (name, key), hist in sorted(self.histograms.items()):
+                mean = hist["sum"] / hist["count"] if hist["count"] else 0.0
+                parts.append(f"{name}{_format_labels(key)}.mean={mean * 1000:.2f}ms")
+        return " ".join(parts)
+
+    def maybe_log(self, force=False):
+        """ Logs the summary line (logging.INFO) if log_interval seconds passed since the last one.
+
+        Parameters
+        ------------
+        force:
+                if True, logs whatever the elapsed time.
+
+        """
+        if self.log_interval is None and not force:
+            return
+        if force or time.monotonic() - self._last_sample[0] >= self.log_interval:
+            logger.info(self.log_line())
+
+    def to_prometheus(self):
+        """ Returns the counters & histograms in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                metric = f"{self.prefix}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for (n, key), value in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append(f"{metric}{_format_labels(key)} {value}")
+
+            names = sorted({name for name, _ in self.histograms})
+            for name in names:
+                metric = f"{self.prefix}_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                for (n, key), hist in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), hist["buckets"]):
+                        cumulative += count
+                        lines.append(f"{metric}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                    lines.append(f"{metric}_sum{_format_labels(key)} {hist['sum']}")
+                    lines.append(f"{metric}_count{_format_labels(key)} {hist['count']}")
+        return "\n".join(lines) + "\n"
+
+
+class NullMetrics:
+    """ Metrics sink doing nothing (used when no Metrics object is given)."""
+
+    def inc(self, name, value=1, **labels):
+        pass
+
+    def observe(self, name, seconds, **labels):
+        pass
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        yield
+
+    def maybe_log(self, force=False):
+        pass
+
+
+NULL_METRICS = NullMetrics()
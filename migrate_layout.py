@@ -0,0 +1,113 @@
+import argparse
+import collections
+import concurrent.futures
+import storage
+import metrics as metrics_
+
+
+def migrate_table(backend, source, target, workers=8, concurrency=64, retries=5, metrics=None):
+    """ Copies every partition of a table into a table of another layout (with the same columns, or a subset of them).
+    Returns the Counter of acknowledged writes per table.
+
+    Partitions are read & written by `workers` threads, so the source table stays online. Writes are upserts:
+    a partition copied again (or written meanwhile by dual-writing ingestion) simply gets the same rows.
+
+    Parameters
+    ------------
+    backend:
+            storage.StorageBackend holding both tables.
+    source:
+            name of the table to copy.
+    target:
+            name of the table to fill.
+    workers:
+            number of partitions copied at once.
+    concurrency:
+            max number of asynchronous writes in flight per worker (if the backend writes asynchronously).
+    retries:
+            max number of retries of a failed write.
+    metrics:
+            metrics.Metrics counting copied partitions & logging progress. Optional.
+
+    """
+    metrics = metrics if metrics is not None else metrics_.NULL_METRICS
+    missing = set(storage.TABLE_COLUMNS[target]) - set(storage.TABLE_COLUMNS[source])
+    if missing:
+        raise ValueError(f"{source} lacks columns of {target}: {', '.join(sorted(missing))}")
+
+    def copy(key):
+        written = collections.Counter()
+        rows = backend.select(source, key)
+        backend.write_flights(map(storage.flight_from_row, rows), written, concurrency, retries, tables=(target,))
+        metrics.inc("partitions_migrated", table=target)
+        return written
+
+    written = collections.Counter()
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        for partial in pool.map(copy, backend.partitions(source)):
+            written.update(partial)
+            metrics.maybe_log()
+    return written
+
+
+def migrate_layout(backend, source="original", target="bucketed", workers=8, concurrency=64, retries=5, metrics=None):
+    """ Copies the tables of a layout which are not part of another layout into it (see storage.LAYOUTS).
+    Returns the Counter of acknowledged writes per table.
+
+    Migration without downtime:
+        1. create the tables of the target layout (cassandra_table.cql);
+        2. make ingestion write both layouts (backend tables=storage.layout_tables("original", "bucketed"));
+        3. run migrate_layout;
+        4. read the target layout (FlightData(..., layout="bucketed")) & write it only.
+
+    Parameters
+    ------------
+    backend:
+            storage.StorageBackend holding both layouts.
+    source:
+            name of the migrated layout.
+    target:
+            name of the new layout.
+    workers:
+            number of partitions copied at once.
+    concurrency:
+            max number of asynchronous writes in flight per worker (if the backend writes asynchronously).
+    retries:
+            max number of retries of a failed write.
+    metrics:
+            metrics.Metrics counting copied partitions & logging progress. Optional.
+
+    """
+    written = collections.Counter()
+    for old, new in zip(storage.LAYOUTS[source], storage.LAYOUTS[target]):
+        if old != new:
+            written.update(migrate_table(backend, old, new, workers, concurrency, retries, metrics))
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copies the flight tables of a layout into another layout.")
+    parser.add_argument("keyspace", nargs="?", help="Cassandra keyspace")
+    parser.add_argument("--local", help="SQLite database of a storage.LocalBackend (instead of a keyspace)")
+    parser.add_argument("--source", default="original", choices=sorted(storage.LAYOUTS))
+    parser.add_argument("--target", default="bucketed", choices=sorted(storage.LAYOUTS))
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--retries", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.local is not None:
+        backend = storage.LocalBackend(args.local)
+    elif args.keyspace is not None:
+        import feed_cassandra
+        backend = feed_cassandra.CassandraBackend(args.keyspace)
+    else:
+        parser.error("a keyspace or --local is required")
+
+    try:
+        written = migrate_layout(backend, args.source, args.target, args.workers, args.concurrency, args.retries,
+                                 metrics_.Metrics(log_interval=10.0, rate_counter="partitions_migrated"))
+    finally:
+        backend.close()
+    for table, n in sorted(written.items()):
+        print(f"{table}: {n}")
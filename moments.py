@@ -0,0 +1,220 @@
+import fractions
+import itertools
+import numpy as np
+
+
+class Moments:
+    """ Mergeable accumulator of the count, means & co-moments of d variables.
+
+    Observations are added one at a time (Welford's update) or by NumPy batches, and partial
+    accumulators are combined with Chan et al.'s pairwise formula, so the same object can be
+    used on a local stream, returned by process-pool workers or used as a Spark aggregate zero value:
+
+        rdd.aggregate(Moments(2), Moments.seq_op, Moments.comb_op)
+
+    """
+
+    def __init__(self, dim=1):
+        self.n = 0
+        self.mean = np.zeros(dim)
+        self.comoment = np.zeros((dim, dim))   #sum of (x - mean)(x - mean)^T
+
+    @property
+    def dim(self):
+        return len(self.mean)
+
+    def copy(self):
+        """ Returns a copy of the accumulator."""
+        other = Moments(self.dim)
+        other.n = self.n
+        other.mean = self.mean.copy()
+        other.comoment = self.comoment.copy()
+        return other
+
+    def update(self, x):
+        """ Adds one observation. Returns the accumulator.
+
+        Parameters
+        ------------
+            x:
+                sequence of d values (or a number when d = 1).
+
+        """
+        x = np.asarray(x, dtype=float).reshape(self.dim)
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.comoment += np.outer(delta, x - self.mean)
+        return self
+
+    def update_batch(self, X):
+        """ Adds a batch of observations. Returns the accumulator.
+
+        Parameters
+        ------------
+            X:
+                array of shape (n, d) (or (n,) when d = 1).
+
+        """
+        X = np.asarray(X, dtype=float).reshape(-1, self.dim)
+        if len(X) == 0:
+            return self
+        batch = Moments(self.dim)
+        batch.n = len(X)
+        batch.mean = X.mean(axis=0)
+        centered = X - batch.mean
+        batch.comoment = centered.T @ centered
+        return self.merge(batch)
+
+    def merge(self, other):
+        """ Adds the observations of another accumulator (Chan et al.'s combine). Returns the accumulator.
+
+        Parameters
+        ------------
+            other:
+                Moments accumulator of the same dimension.
+
+        """
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.n = other.n
+            self.mean = other.mean.copy()
+            self.comoment = other.comoment.copy()
+            return self
+
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.comoment += other.comoment + np.outer(delta, delta) * (self.n * other.n / n)
+        self.mean += delta * (other.n / n)
+        self.n = n
+        return self
+
+    def __add__(self, other):
+        return self.copy().merge(other)
+
+    def subtract(self, other):
+        """ Removes the observations of an accumulator previously merged into this one (inverse of merge).
+        Returns the accumulator.
+
+        Parameters
+        ------------
+            other:
+                Moments accumulator of a subset of the observations.
+
+        """
+        if other.n == 0:
+            return self
+        n = self.n - other.n
+        if n < 0:
+            raise ValueError("cannot subtract more observations than the accumulator holds")
+        if n == 0:
+            self.n = 0
+            self.mean = np.zeros(self.dim)
+            self.comoment = np.zeros((self.dim, self.dim))
+            return self
+
+        mean = (self.n * self.mean - other.n * other.mean) / n
+        delta = other.mean - mean
+        self.comoment = self.comoment - other.comoment - np.outer(delta, delta) * (n * other.n / self.n)
+        self.mean = mean
+        self.n = n
+        return self
+
+    def __sub__(self, other):
+        return self.copy().subtract(other)
+
+    def to_dict(self):
+        """ Returns a JSON-serializable dict of the accumulator."""
+        return {"n": self.n, "mean": self.mean.tolist(), "comoment": self.comoment.tolist()}
+
+    @classmethod
+    def from_dict(cls, d):
+        """ Returns the accumulator of a dict written by to_dict."""
+        acc = cls(len(d["mean"]))
+        acc.n = d["n"]
+        acc.mean = np.array(d["mean"], dtype=float)
+        acc.comoment = np.array(d["comoment"], dtype=float).reshape(acc.dim, acc.dim)
+        return acc
+
+    @classmethod
+    def from_sums(cls, n, sums, products):
+        """ Returns the accumulator of exact power sums of integer observations (rounded once, at the end).
+
+        Parameters
+        ------------
+            n:
+                number of observations.
+            sums:
+                sequence of the d integer sums of the variables.
+            products:
+                d x d nested sequence of the integer sums of the products of two variables.
+
+        """
+        dim = len(sums)
+        acc = cls(dim)
+        acc.n = int(n)
+        if acc.n:
+            sums = [int(s) for s in sums]
+            acc.mean = np.array([fractions.Fraction(s, acc.n) for s in sums], dtype=float)
+            acc.comoment = np.array([[fractions.Fraction(acc.n * int(products[i][j]) - sums[i] * sums[j], acc.n)
+                                      for j in range(dim)] for i in range(dim)], dtype=float)
+        return acc
+
+    @property
+    def var(self):
+        """ Population variances of the d variables."""
+        if self.n == 0:
+            return np.full(self.dim, np.nan)
+        return np.diag(self.comoment) / self.n
+
+    @property
+    def cov(self):
+        """ Population covariance matrix."""
+        if self.n == 0:
+            return np.full((self.dim, self.dim), np.nan)
+        return self.comoment / self.n
+
+    @property
+    def corr(self):
+        """ Pearson correlation matrix."""
+        std = np.sqrt(np.diag(self.comoment))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.comoment / np.outer(std, std)
+
+    def __repr__(self):
+        return f"Moments(n={self.n}, mean={self.mean.tolist()}, var={self.var.tolist()})"
+
+    # Spark aggregate / treeAggregate operators
+
+    @staticmethod
+    def seq_op(acc, x):
+        """ Adds one observation to an accumulator (Spark seqOp)."""
+        return acc.update(x)
+
+    @staticmethod
+    def comb_op(a, b):
+        """ Merges two accumulators (Spark combOp / functools.reduce reducer)."""
+        return a.merge(b)
+
+
+def reduce_stream(stream, dim, batch_size=65536):
+    """ Returns a Moments accumulator of a stream of observations, added by NumPy batches.
+
+    Parameters
+    ------------
+        stream:
+            iterable of observations (sequences of d values, or numbers when d = 1).
+        dim:
+            number of variables d.
+        batch_size:
+            number of observations converted to an array at once.
+
+    """
+    acc = Moments(dim)
+    stream = iter(stream)
+    while True:
+        batch = list(itertools.islice(stream, batch_size))
+        if not batch:
+            return acc
+        acc.update_batch(batch)
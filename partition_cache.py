@@ -0,0 +1,130 @@
+import time
+import threading
+import collections
+import storage
+import metrics as metrics_
+
+
+class PartitionCache:
+    """ Size-bounded LRU cache of table partitions with an optional time to live.
+
+    Entries are keyed by (table, select key) & hold the partition rows as compact column arrays,
+    so a warm cache of millions of rows costs a few bytes per value. A select key is a partition key, 
+    optionally followed by a clustering key prefix (slice of a partition, see storage.select_columns).
+
+    """
+
+    def __init__(self, max_bytes=256 * 2**20, ttl=None, metrics=None):
+        """ Creates an empty cache.
+
+        Parameters
+        ------------
+        max_bytes:
+                max total size of the cached column arrays. Least recently used partitions are evicted first.
+        ttl:
+                time to live of an entry (seconds). If None, entries only leave the cache by eviction or invalidation.
+        metrics:
+                metrics.Metrics counting hits, misses & evictions. Optional.
+
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self._metrics = metrics if metrics is not None else metrics_.NULL_METRICS
+        self._entries = collections.OrderedDict()   #(table, key) -> (expiry time, nbytes, columns)
+        self._slices = collections.defaultdict(set)   #(table, partition key) -> cached (table, key) of the partition
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, item):
+        return self.get(*item, count=False) is not None
+
+    def get(self, table, key, count=True):
+        """ Returns the cached columns of a partition (dict column -> array), or None if it is missing or expired.
+
+        Parameters
+        ------------
+        table:
+                name of the table.
+        key:
+                select key (partition key, optionally followed by a clustering key prefix).
+        count:
+                if True, the lookup is counted as a cache hit or miss.
+
+        """
+        item = (table, tuple(key))
+        with self._lock:
+            entry = self._entries.get(item)
+            if entry is not None and entry[0] is not None and entry[0] <= time.monotonic():
+                self._remove(item)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(item)
+        if count:
+            self._metrics.inc("cache_hits" if entry is not None else "cache_misses", table=table)
+        return None if entry is None else entry[2]
+
+    def put(self, table, key, rows):
+        """ Caches the rows of a partition. Returns their columns (dict column -> array).
+
+        Parameters
+        ------------
+        table:
+                name of the table.
+        key:
+                select key (partition key, optionally followed by a clustering key prefix).
+        rows:
+                iterable of rows holding the columns of the table in TABLE_COLUMNS order (see storage.rows_to_columns).
+
+        """
+        columns = storage.rows_to_columns(table, rows)
+        nbytes = sum(col.nbytes for col in columns.values())
+        expiry = None if self.ttl is None else time.monotonic() + self.ttl
+        item = (table, tuple(key))
+        with self._lock:
+            self._remove(item)
+            if nbytes <= self.max_bytes:
+                self._entries[item] = (expiry, nbytes, columns)
+                self._slices[self._partition(item)].add(item)
+                self.nbytes += nbytes
+                while self.nbytes > self.max_bytes:
+                    self._remove(next(iter(self._entries)))
+                    self._metrics.inc("cache_evictions", table=table)
+        return columns
+
+    def invalidate(self, table, key):
+        """ Removes a partition (& all its cached slices) from the cache (after a write to it).
+
+        Parameters
+        ------------
+        table:
+                name of the table.
+        key:
+                partition key (tuple, in PARTITION_KEYS order).
+
+        """
+        with self._lock:
+            for item in list(self._slices.get((table, tuple(key)), ())):
+                self._remove(item)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._slices.clear()
+            self.nbytes = 0
+
+    @staticmethod
+    def _partition(item):
+        table, key = item
+        return table, key[:len(storage.PARTITION_KEYS[table])]
+
+    def _remove(self, item):
+        entry = self._entries.pop(item, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+            partition = self._partition(item)
+            self._slices[partition].discard(item)
+            if not self._slices[partition]:
+                del self._slices[partition]
@@ -0,0 +1,229 @@
+import os
+import mmap
+import math
+import itertools
+import collections
+import multiprocessing
+import multiprocessing.shared_memory
+import numpy as np
+import moments
+
+
+# Rows reduced by one task (bounds the int64 power sums of 16-bit columns far below overflow)
+MAX_TASK_ROWS = 2**22
+
+# Shared arrays attached by the worker process (descriptor -> (SharedMemory or None, array))
+_attached = {}
+
+
+class SharedArrays:
+    """ Arrays readable by the processes of a pool without pickling their values: each worker attaches them
+    from a small descriptor. Memory maps of files (e.g. the column caches of flight_cache.open_flight_cache)
+    are shared as they are; other arrays are copied once into shared memory blocks, released by close():
+
+        with SharedArrays({"x": x}) as shared:
+            pool.map(task, [(shared.descriptors["x"], start, stop) ...])
+
+    """
+
+    def __init__(self, arrays=None):
+        self.descriptors = {}
+        self._blocks = []
+        for name, array in (arrays or {}).items():
+            self.add(name, array)
+
+    def add(self, name, array):
+        """ Shares an array. Returns its descriptor.
+
+        Parameters
+        ------------
+            name:
+                key of the descriptor.
+            array:
+                NumPy array (object arrays of numbers with missing values are converted to float, None -> NaN).
+
+        """
+        if isinstance(array, np.memmap) and isinstance(array.base, mmap.mmap) and array.filename is not None:
+            descriptor = ("memmap", array.filename, array.dtype.str, array.offset, array.shape)
+        else:
+            array = np.asarray(array)
+            if array.dtype.kind == "O":
+                array = array.astype(float)
+            self.allocate(name, array.shape, array.dtype)[...] = array
+            return self.descriptors[name]
+        self.descriptors[name] = descriptor
+        return descriptor
+
+    def allocate(self, name, shape, dtype):
+        """ Shares a new array in a shared memory block. Returns the array (filled by the caller).
+
+        Parameters
+        ------------
+            name:
+                key of the descriptor.
+            shape:
+                shape of the array.
+            dtype:
+                NumPy dtype of the array.
+
+        """
+        dtype = np.dtype(dtype)
+        block = multiprocessing.shared_memory.SharedMemory(create=True, size=max(1, math.prod(shape) * dtype.itemsize))
+        self._blocks.append(block)
+        self.descriptors[name] = ("shm", block.name, dtype.str, 0, tuple(shape))
+        return np.ndarray(shape, dtype, buffer=block.buf)
+
+    def close(self):
+        """ Releases the shared memory blocks."""
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach(descriptor):
+    """ Returns the array of a SharedArrays descriptor (in a worker process; attached once per process).
+
+    Parameters
+    ------------
+        descriptor:
+            descriptor of SharedArrays.descriptors.
+
+    """
+    if descriptor not in _attached:
+        kind, name, dtype, offset, shape = descriptor
+        if kind == "memmap":
+            _attached[descriptor] = (None, np.memmap(name, dtype=dtype, mode="r", offset=offset, shape=shape))
+        else:
+            block = multiprocessing.shared_memory.SharedMemory(name=name)
+            _attached[descriptor] = (block, np.ndarray(shape, dtype, buffer=block.buf, offset=offset))
+    return _attached[descriptor][1]
+
+
+def _reduce_rows(task):
+    """ Reduces a range of rows of shared columns (see _reduce_array)."""
+    columns, valid, start, stop = task
+    X = np.column_stack([attach(d)[start:stop] for d in columns])
+    if valid is not None:
+        X = X[attach(valid)[start:stop]]
+    return _reduce_array(X)
+
+
+def _reduce_array(X):
+    """ Reduces an array of observations. Returns ("sums", n, sums, products) of integer columns (exact),
+    or ("moments", Moments) of float columns."""
+    if X.dtype.kind in "iub":
+        X = X.astype(np.int64)
+        return ("sums", len(X), X.sum(axis=0).tolist(), (X.T @ X).tolist())
+    return ("moments", moments.Moments(X.shape[1]).update_batch(X))
+
+
+def _merge(results, dim):
+    """ Merges the results of _reduce_rows in task order: integer power sums are added exactly, Moments with Chan's formula."""
+    if results and all(r[0] == "sums" for r in results):
+        n = sum(r[1] for r in results)
+        sums = [sum(r[2][i] for r in results) for i in range(dim)]
+        products = [[sum(r[3][i][j] for r in results) for j in range(dim)] for i in range(dim)]
+        return moments.Moments.from_sums(n, sums, products)
+    acc = moments.Moments(dim)
+    for r in results:
+        acc.merge(r[1] if r[0] == "moments" else moments.Moments.from_sums(*r[1:]))
+    return acc
+
+
+def reduce_shared(shared, columns, valid=None, processes=None, task_rows=None):
+    """ Returns the Moments accumulator of shared columns, reduced by row ranges in a process pool.
+
+    Parameters
+    ------------
+        shared:
+            SharedArrays holding the columns.
+        columns:
+            names of the reduced columns (1-d arrays of the same length, or a single 2-d array of observations).
+        valid:
+            name of a shared boolean mask of the reduced rows. Optional.
+        processes:
+            number of worker processes. If None, the number of CPUs is used.
+        task_rows:
+            number of rows reduced by a task. If None, about 4 tasks per process (at most MAX_TASK_ROWS rows).
+
+    """
+    descriptors = [shared.descriptors[c] for c in columns]
+    dim = sum(1 if len(d[4]) == 1 else d[4][1] for d in descriptors)
+    rows = descriptors[0][4][0]
+    processes = processes or os.cpu_count()
+    if task_rows is None:
+        task_rows = min(MAX_TASK_ROWS, max(65536, math.ceil(rows / (4 * processes))))
+    valid = None if valid is None else shared.descriptors[valid]
+    tasks = [(descriptors, valid, start, min(start + task_rows, rows)) for start in range(0, rows, task_rows)]
+    with multiprocessing.Pool(min(processes, max(1, len(tasks)))) as pool:
+        return _merge(pool.map(_reduce_rows, tasks), dim)
+
+
+def reduce_stream_parallel(stream, dim, processes=None, batch_size=65536, prefetch=None):
+    """ Returns a Moments accumulator of a stream of observations (same result as moments.reduce_stream):
+    the stream is cut into NumPy batches, reduced by a process pool as they are read, with at most `prefetch` batches
+    in flight (memory stays bounded). Reading & converting the observations stays serial in the calling process:
+    columns (FlightChunk, memory-mapped caches) are reduced without this step by reduce_columns_parallel.
+
+    Parameters
+    ------------
+        stream:
+            iterable of observations (sequences of d values, or numbers when d = 1).
+        dim:
+            number of variables d.
+        processes:
+            number of worker processes. If None, the number of CPUs is used.
+        batch_size:
+            number of observations converted to an array at once.
+        prefetch:
+            max number of batches in flight. If None, 2 per process.
+
+    """
+    processes = processes or os.cpu_count()
+    prefetch = prefetch or 2 * processes
+    stream = iter(stream)
+    pending = collections.deque()
+    results = []
+    with multiprocessing.Pool(processes) as pool:
+        while True:
+            batch = list(itertools.islice(stream, batch_size))
+            if not batch:
+                break
+            X = np.asarray(batch)
+            if X.dtype.kind == "O":   #missing values (None -> NaN), as in SharedArrays.add
+                X = X.astype(float)
+            if len(pending) >= prefetch:
+                results.append(pending.popleft().get())
+            pending.append(pool.apply_async(_reduce_array, (X.reshape(-1, dim),)))
+        results.extend(r.get() for r in pending)
+    return _merge(results, dim)
+
+
+def reduce_columns_parallel(columns, fields, processes=None):
+    """ Returns the Moments accumulator of columns of a FlightChunk or dict of column arrays (valid rows only),
+    e.g. the memory-mapped column cache of flight_cache.open_flight_cache, which workers map without any copy.
+
+    Parameters
+    ------------
+        columns:
+            flight_data.FlightChunk or dict column name -> array (with an optional "Valid" mask).
+        fields:
+            names of the reduced columns.
+        processes:
+            number of worker processes. If None, the number of CPUs is used.
+
+    """
+    if hasattr(columns, "_asdict"):
+        columns = columns._asdict()
+    if len(columns[fields[0]]) == 0:
+        return moments.Moments(len(fields))
+    names = list(fields) + (["Valid"] if "Valid" in columns else [])
+    with SharedArrays({name: columns[name] for name in names}) as shared:
+        return reduce_shared(shared, fields, "Valid" if "Valid" in columns else None, processes)
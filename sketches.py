@@ -0,0 +1,309 @@
+import json
+import itertools
+import numpy as np
+import storage
+
+
+# Delay fields summarized by DelaySketches & their groupings (same as the flight_rollup groupings)
+DELAY_FIELDS = storage.DELAY_FIELDS
+GROUPINGS = storage.ROLLUP_GROUPINGS
+
+
+class LogHistogram:
+    """ Mergeable quantile sketch of a signed variable (e.g. delays in minutes) with fixed logarithmic bins.
+
+    A value v with |v| >= 1 falls in bin sign(v) * ceil(log(|v|) / log(gamma)), gamma = (1 + e) / (1 - e), so every
+    quantile is returned within a relative error e; values with |v| < 1 share the zero bin. The bins only depend
+    on (rel_error, max_value): two histograms with the same parameters are merged by adding their count arrays.
+
+        h = LogHistogram().update_batch(delays)
+        h.quantile(0.95)
+
+    """
+
+    def __init__(self, rel_error=0.01, max_value=1e5):
+        self.rel_error = rel_error
+        self.max_value = max_value
+        self.gamma = (1 + rel_error) / (1 - rel_error)
+        self.size = int(np.ceil(np.log(max_value) / np.log(self.gamma)))   #bins per sign
+        self.counts = np.zeros(2 * self.size + 1, dtype=np.int64)   #bins -size..size, zero bin at index size
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def _same_bins(self, other):
+        return self.rel_error == other.rel_error and self.max_value == other.max_value
+
+    def index(self, values):
+        """ Returns the bin indices (in counts) of an array of finite values (beyond max_value, values fall in the
+        last bins). Missing values (NaN) have no bin: callers drop them first.
+
+        Parameters
+        ------------
+            values:
+                array of finite values.
+
+        """
+        values = np.asarray(values, dtype=float)
+        magnitude = np.abs(values)
+        k = np.zeros(len(values), dtype=np.int64)
+        big = magnitude >= 1
+        k[big] = np.clip(np.ceil(np.log(magnitude[big]) / np.log(self.gamma)), 1, self.size)
+        return self.size + np.sign(values).astype(np.int64) * k
+
+    def bin_values(self):
+        """ Returns the representative value of every bin (value with the lowest relative error over the bin)."""
+        k = np.arange(-self.size, self.size + 1)
+        magnitude = np.where(k == 0, 0.0, 2 * self.gamma ** np.abs(k) / (self.gamma + 1))
+        return np.sign(k) * magnitude
+
+    def update(self, x):
+        """ Adds one value. Returns the histogram."""
+        return self.update_batch([x])
+
+    def update_batch(self, values):
+        """ Adds an array of values. Missing values (None, NaN) are not counted. Returns the histogram.
+
+        Parameters
+        ------------
+            values:
+                array (or sequence) of values.
+
+        """
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return self
+        self.counts += np.bincount(self.index(values), minlength=len(self.counts))
+        self.n += len(values)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        return self
+
+    def merge(self, other):
+        """ Adds the values of another histogram with the same bins. Returns the histogram.
+
+        Parameters
+        ------------
+            other:
+                LogHistogram with the same rel_error & max_value.
+
+        """
+        if not self._same_bins(other):
+            raise ValueError("histograms with different bins cannot be merged")
+        self.counts += other.counts
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def __add__(self, other):
+        return self.copy().merge(other)
+
+    def copy(self):
+        other = LogHistogram(self.rel_error, self.max_value)
+        other.counts = self.counts.copy()
+        other.n, other.min, other.max = self.n, self.min, self.max
+        return other
+
+    def quantiles(self, qs):
+        """ Returns the approximate quantiles of the values (NaN for an empty histogram).
+
+        Parameters
+        ------------
+            qs:
+                sequence of quantile levels in [0, 1].
+
+        """
+        qs = np.asarray(qs, dtype=float)
+        if self.n == 0:
+            return np.full(qs.shape, np.nan)
+        rank = np.floor(qs * (self.n - 1))
+        bins = np.searchsorted(np.cumsum(self.counts), rank, side="right")
+        return np.clip(self.bin_values()[bins], self.min, self.max)
+
+    def quantile(self, q):
+        """ Returns the approximate q-quantile of the values."""
+        return float(self.quantiles([q])[0])
+
+    def to_dict(self):
+        """ Returns a JSON-serializable dict of the histogram (non-empty bins only)."""
+        nonzero = np.flatnonzero(self.counts)
+        return {
+            "rel_error": self.rel_error, "max_value": self.max_value, "n": self.n,
+            "min": self.min if self.n else None, "max": self.max if self.n else None,
+            "bins": (nonzero - self.size).tolist(), "counts": self.counts[nonzero].tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        """ Returns the histogram of a dict written by to_dict."""
+        h = cls(d["rel_error"], d["max_value"])
+        h.counts[np.asarray(d["bins"], dtype=np.int64) + h.size] = d["counts"]
+        h.n = d["n"]
+        if h.n:
+            h.min, h.max = d["min"], d["max"]
+        return h
+
+
+class DelaySketches:
+    """ LogHistograms of the delay fields (DELAY_FIELDS) per group key of every grouping (GROUPINGS):
+    e.g. the distribution of DepDelay for the flights leaving at 17h.
+
+    Sketches are updated from column batches (flight_data.FlightChunk, dicts of columns named as Flight fields or as
+    CQL columns) or from flight streams, merged across workers & Spark partitions, and saved as JSON:
+
+        acc = rdd.mapPartitions(sketches.partition_sketches).treeReduce(sketches.DelaySketches.merged)
+
+    """
+
+    def __init__(self, rel_error=0.01, max_value=1e5):
+        self.rel_error = rel_error
+        self.max_value = max_value
+        self.histograms = {}   #(grouping, field) -> {group key: LogHistogram}
+
+    def _histogram(self, grouping, field, key):
+        groups = self.histograms.setdefault((grouping, field), {})
+        if key not in groups:
+            groups[key] = LogHistogram(self.rel_error, self.max_value)
+        return groups[key]
+
+    def update_batch(self, batch):
+        """ Adds a batch of flights. Groupings & fields missing from the batch are skipped; missing values (None, NaN)
+        are not counted. Returns the sketches.
+
+        Parameters
+        ------------
+            batch:
+                flight_data.FlightChunk or dict of column arrays (Flight field or CQL column names).
+
+        """
+        if hasattr(batch, "_asdict"):
+            batch = batch._asdict()
+        columns = {storage.CQL_FIELDS.get(name, name): np.asarray(col) for name, col in batch.items()}
+        if "Valid" in columns:
+            valid = columns.pop("Valid")
+            columns = {name: col[valid] for name, col in columns.items()}
+
+        probe = LogHistogram(self.rel_error, self.max_value)
+        nbins = len(probe.counts)
+        for field in DELAY_FIELDS:
+            if field not in columns or len(columns[field]) == 0:
+                continue
+            values = columns[field].astype(float)
+            known = np.isfinite(values)
+            if not known.any():
+                continue
+            values = values[known]
+            bins = probe.index(values)
+            for grouping, group_field in GROUPINGS.items():
+                if group_field not in columns:
+                    continue
+                keys, inverse = np.unique(columns[group_field][known], return_inverse=True)
+                counts = np.bincount(inverse * nbins + bins, minlength=len(keys) * nbins).reshape(len(keys), nbins)
+                n = np.bincount(inverse, minlength=len(keys))
+                low = np.full(len(keys), np.inf)
+                high = np.full(len(keys), -np.inf)
+                np.minimum.at(low, inverse, values)
+                np.maximum.at(high, inverse, values)
+                for i, key in enumerate(keys.tolist()):
+                    h = self._histogram(grouping, field, key)
+                    h.counts += counts[i]
+                    h.n += int(n[i])
+                    h.min = min(h.min, float(low[i]))
+                    h.max = max(h.max, float(high[i]))
+        return self
+
+    def update_stream(self, flights, batch_size=65536):
+        """ Adds a stream of flight_data.Flight tuples, a batch at a time. Returns the sketches.
+
+        Parameters
+        ------------
+            flights:
+                flight data generator.
+            batch_size:
+                number of flights added at once.
+
+        """
+        fields = DELAY_FIELDS + tuple(GROUPINGS.values())
+        flights = iter(flights)
+        while True:
+            batch = [tuple(getattr(f, name) for name in fields) for f in itertools.islice(flights, batch_size)]
+            if not batch:
+                return self
+            self.update_batch(dict(zip(fields, np.array(batch).T)))
+
+    def merge(self, other):
+        """ Adds the flights of other sketches with the same bins. Returns the sketches."""
+        for (grouping, field), groups in other.histograms.items():
+            for key, h in groups.items():
+                self._histogram(grouping, field, key).merge(h)
+        return self
+
+    @staticmethod
+    def merged(a, b):
+        """ Returns the merge of two sketches (Spark reduce / treeReduce operator; a is updated)."""
+        return a.merge(b)
+
+    def quantiles(self, grouping, field, qs=(0.5, 0.9, 0.99)):
+        """ Returns the approximate quantiles of a delay field per group key, as a dict key -> array.
+
+        Parameters
+        ------------
+            grouping:
+                "month", "dayofweek" or "dep_hour".
+            field:
+                one of DELAY_FIELDS.
+            qs:
+                quantile levels.
+
+        """
+        groups = self.histograms.get((grouping, field), {})
+        return {key: groups[key].quantiles(qs) for key in sorted(groups)}
+
+    def to_dict(self):
+        """ Returns a JSON-serializable dict of the sketches."""
+        return {
+            "rel_error": self.rel_error, "max_value": self.max_value,
+            "histograms": [
+                {"grouping": grouping, "field": field, "key": key, "histogram": h.to_dict()}
+                for (grouping, field), groups in sorted(self.histograms.items())
+                for key, h in sorted(groups.items())
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        """ Returns the sketches of a dict written by to_dict."""
+        sketches = cls(d["rel_error"], d["max_value"])
+        for item in d["histograms"]:
+            key = item["key"]
+            sketches.histograms.setdefault((item["grouping"], item["field"]), {})[key] = LogHistogram.from_dict(item["histogram"])
+        return sketches
+
+    def save(self, path):
+        """ Writes the sketches to a JSON file."""
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        """ Reads sketches written by save."""
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def partition_sketches(flights, rel_error=0.01, max_value=1e5):
+    """ Yields the DelaySketches of a RDD partition (or any flight stream): rdd.mapPartitions(partition_sketches).
+
+    Parameters
+    ------------
+        flights:
+            iterator of flight data.
+        rel_error:
+            relative error of the quantiles.
+        max_value:
+            largest absolute delay with its own bin.
+
+    """
+    yield DelaySketches(rel_error, max_value).update_stream(flights)
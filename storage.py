@@ -0,0 +1,581 @@
+import sqlite3
+import itertools
+import threading
+import collections
+import numpy as np
+import flight_data
+import flight_cache
+import metrics as metrics_
+
+
+# Table layouts (column names as created in cassandra_table.cql)
+
+TABLE_COLUMNS = {
+    "flight_by_datetime": (
+        "year", "month", "day", "dep_hour", "dep_min", "arr_hour", "arr_min",
+        "depdelay", "arrdelay", "carrierdel", "weatherdel", "NASdel",
+        "securitydel", "lateACdel", "flightnum"),
+    "flight_by_dayofweek": (
+        "year", "month", "day", "dayofweek", "dep_hour", "dep_min", "arr_hour", "arr_min",
+        "depdelay", "arrdelay", "carrierdel", "weatherdel", "NASdel",
+        "securitydel", "lateACdel", "flightnum"),
+    "flight_by_dephour": (
+        "year", "month", "day", "dep_hour", "dep_min", "arr_hour", "arr_min",
+        "depdelay", "arrdelay", "carrierdel", "weatherdel", "NASdel",
+        "securitydel", "lateACdel", "flightnum"),
+    "flight_by_dow_month": (
+        "year", "month", "day", "dayofweek", "dep_hour", "dep_min", "arr_hour", "arr_min",
+        "depdelay", "arrdelay", "carrierdel", "weatherdel", "NASdel",
+        "securitydel", "lateACdel", "flightnum"),
+    "flight_by_hour_month": (
+        "year", "month", "day", "dep_hour", "dep_min", "arr_hour", "arr_min",
+        "depdelay", "arrdelay", "carrierdel", "weatherdel", "NASdel",
+        "securitydel", "lateACdel", "flightnum"),
+}
+
+# CQL column -> flight_data.Flight field
+CQL_FIELDS = {
+    "year": "Year", "month": "Month", "day": "Day", "dayofweek": "DayOfWeek",
+    "dep_hour": "CRSDepHour", "dep_min": "CRSDepMin",
+    "arr_hour": "CRSArrHour", "arr_min": "CRSArrMin",
+    "depdelay": "DepDelay", "arrdelay": "ArrDelay",
+    "carrierdel": "CarrierDelay", "weatherdel": "WeatherDelay", "NASdel": "NASDelay",
+    "securitydel": "SecurityDelay", "lateACdel": "LateAircraftDelay",
+    "flightnum": "FlightNum",
+}
+
+# Partition key columns of every table (recorded in the flight_partitions directory table)
+PARTITION_KEYS = {
+    "flight_by_datetime": ("year", "month", "day"),
+    "flight_by_dayofweek": ("year", "dayofweek"),
+    "flight_by_dephour": ("dep_hour", "dep_min", "year"),
+    "flight_by_dow_month": ("year", "dayofweek", "month"),
+    "flight_by_hour_month": ("dep_hour", "year", "month"),
+}
+
+# Clustering columns of every table (rows of a partition are sorted & unique on them)
+CLUSTERING_KEYS = {
+    "flight_by_datetime": ("dep_hour", "dep_min", "flightnum"),
+    "flight_by_dayofweek": ("month", "day", "dep_hour", "flightnum"),
+    "flight_by_dephour": ("month", "day", "flightnum"),
+    "flight_by_dow_month": ("day", "dep_hour", "flightnum"),
+    "flight_by_hour_month": ("dep_min", "day", "flightnum"),
+}
+
+# Tables written for every layout. The original layout has tiny (hour, minute, year) & huge (year, day of week) partitions;
+# the bucketed layout splits both on month, giving partitions of similar sizes (about one day of flights).
+LAYOUTS = {
+    "original": ("flight_by_datetime", "flight_by_dayofweek", "flight_by_dephour"),
+    "bucketed": ("flight_by_datetime", "flight_by_dow_month", "flight_by_hour_month"),
+}
+
+# Rollup groupings (flight_rollup table): grouping name -> Flight field of the group key
+ROLLUP_GROUPINGS = {
+    "month": "Month",
+    "dayofweek": "DayOfWeek",
+    "dep_hour": "CRSDepHour",
+}
+
+# Sums of a rollup row: count, sums & sums of squares of DepDelay and WeatherDelay, cross-product
+ROLLUP_COUNTERS = ("n", "s_dep", "s_dep2", "s_wea", "s_wea2", "s_depwea")
+
+# Delay fields summarized by the delay distributions (sketches.DelaySketches & delay_cube.DelayCube)
+DELAY_FIELDS = ("DepDelay", "ArrDelay", "WeatherDelay")
+
+# Lower-cased CQL column -> flight_data.Flight field (Cassandra rows have lower-cased field names)
+_LOWER_CQL_FIELDS = {column.lower(): field for column, field in CQL_FIELDS.items()}
+
+# Row type of every table (rows returned by the local backend & the partition cache)
+TABLE_ROWS = {table: collections.namedtuple(table, columns) for table, columns in TABLE_COLUMNS.items()}
+
+RollupRow = collections.namedtuple("RollupRow", ("year", "key") + ROLLUP_COUNTERS)
+
+
+def partition_key(table, flight):
+    """ Returns the partition key (tuple) of a flight in a table.
+
+    Parameters
+    ------------
+    table:
+            name of the table.
+    flight:
+            flight_data.Flight.
+
+    """
+    return tuple(getattr(flight, CQL_FIELDS[c]) for c in PARTITION_KEYS[table])
+
+
+def layout_tables(*layouts):
+    """ Returns the tables of one or several layouts (e.g. the tables dual-written during a layout migration).
+
+    Parameters
+    ------------
+    layouts:
+            names of LAYOUTS.
+
+    """
+    tables = []
+    for layout in layouts:
+        tables.extend(t for t in LAYOUTS[layout] if t not in tables)
+    return tuple(tables)
+
+
+def flight_from_row(row):
+    """ Returns a flight_data.Flight holding the values of a table row (fields missing from the table are None).
+
+    Parameters
+    ------------
+    row:
+            row with one attribute per column of a table (namedtuple, column names in any case).
+
+    """
+    values = dict.fromkeys(flight_data.Flight._fields)
+    for column, value in zip(row._fields, row):
+        values[_LOWER_CQL_FIELDS[column.lower()]] = value
+    return flight_data.Flight(**values)
+
+
+def select_columns(table, key):
+    """ Returns the columns restricted by a select key: the partition key, optionally followed by a prefix of the clustering key.
+
+    Parameters
+    ------------
+    table:
+            name of the table.
+    key:
+            select key (tuple).
+
+    """
+    columns = PARTITION_KEYS[table] + CLUSTERING_KEYS[table]
+    if not len(PARTITION_KEYS[table]) <= len(key) <= len(columns):
+        raise ValueError(f"invalid key of {table}: {key}")
+    return columns[:len(key)]
+
+
+def check_columns(table, columns):
+    """ Returns the requested columns of a table (all of them if columns is None), raising ValueError on unknown ones.
+
+    Parameters
+    ------------
+    table:
+            name of the table.
+    columns:
+            iterable of column names (or None).
+
+    """
+    if columns is None:
+        return TABLE_COLUMNS[table]
+    columns = tuple(columns)
+    unknown = [c for c in columns if c not in TABLE_COLUMNS[table]]
+    if unknown:
+        raise ValueError(f"unknown columns of {table}: {', '.join(unknown)}")
+    return columns
+
+
+def tuples_to_columns(rows, columns):
+    """ Returns a batch of rows as a dict column -> NumPy array (int64, or object arrays for columns holding nulls).
+
+    Parameters
+    ------------
+    rows:
+            list of tuples of values, in columns order.
+    columns:
+            column names.
+
+    """
+    values = list(zip(*rows)) or [()] * len(columns)
+    return {c: np.array(v, dtype=None if None in v else np.int64) for c, v in zip(columns, values)}
+
+
+def _compact(values, dtype):
+    """ Returns a column array of the smallest dtype of the column (falls back to the inferred dtype
+    for null or out of range values)."""
+    col = np.array(values)
+    if col.dtype.kind in "iu":
+        info = np.iinfo(dtype)
+        if len(col) == 0 or (col.min() >= info.min and col.max() <= info.max):
+            return col.astype(dtype)
+    elif len(col) == 0:
+        return col.astype(dtype)
+    return col
+
+
+def rows_to_columns(table, rows):
+    """ Returns the rows of a partition as a dict column -> compact NumPy array (flight_cache.COLUMN_DTYPES).
+
+    Parameters
+    ------------
+    table:
+            name of the table.
+    rows:
+            iterable of rows holding the columns of the table in TABLE_COLUMNS order (tuples, or namedtuples with 
+            any field names, e.g. the lower-cased columns of Cassandra rows).
+
+    """
+    columns = TABLE_COLUMNS[table]
+    values = list(zip(*rows)) or [()] * len(columns)
+    return {c: _compact(v, flight_cache.COLUMN_DTYPES[CQL_FIELDS[c]]) for c, v in zip(columns, values)}
+
+
+def columns_to_rows(table, columns):
+    """ Yields the rows (TABLE_ROWS namedtuples) of a partition stored as column arrays.
+
+    Parameters
+    ------------
+    table:
+            name of the table.
+    columns:
+            dict column -> array (see rows_to_columns).
+
+    """
+    row = TABLE_ROWS[table]
+    for values in zip(*(columns[c].tolist() for c in TABLE_COLUMNS[table])):
+        yield row(*values)
+
+
+class StorageBackend:
+    """ Storage of the flight tables, of their partition directory & of the delay rollups, used by feed_cassandra.FlightData.
+
+    A backend stores every flight in the three table layouts of TABLE_COLUMNS, partitioned by PARTITION_KEYS
+    (rows of a partition sorted & unique on CLUSTERING_KEYS), & answers partition-key lookups.
+
+    """
+
+    tables = LAYOUTS["original"]   #tables written by write_flights
+
+    def __init__(self):
+        self._known_partitions = {}   #table -> set of the partition keys known to be in the directory
+        self._known_lock = threading.Lock()   #guards _known_partitions (written by the threads of a migration)
+
+    def write_flights(self, flights, written, concurrency=None, retries=0, tables=None, rollups=None):
+        """ Writes a stream of flights in the three tables & records their partitions.
+        Returns the number of flights once all of them are durably written.
+
+        Parameters
+        ------------
+        flights:
+                iterable of flight_data.Flight.
+        written:
+                Counter of acknowledged writes per table (updated).
+        concurrency:
+                max number of writes in flight per table (if the backend sends writes asynchronously).
+        retries:
+                max number of retries of a failed write.
+        tables:
+                tables written. If None, the tables of the backend layout are written.
+        rollups:
+                callable returning the (source, totals) rollups of the flights (see set_rollups), called once the flights
+                are read & written with them (in the same transaction if the backend has transactions). Optional.
+
+        """
+        raise NotImplementedError
+
+    def partitions(self, table):
+        """ Returns the sorted partition keys of a table which hold data, read from the partition directory.
+        If the directory holds no key of the table (e.g. data loaded before the directory existed),
+        it is backfilled from the table first (see backfill_partitions).
+
+        Parameters
+        ------------
+        table:
+                name of the table.
+
+        """
+        keys = self._directory_partitions(table)
+        return keys if keys else self.backfill_partitions(table)
+
+    def backfill_partitions(self, table):
+        """ Records the partition keys of the rows of a table in the partition directory (scanning the whole table).
+        Returns the sorted partition keys of the table.
+
+        Parameters
+        ------------
+        table:
+                name of the table.
+
+        """
+        recorded = set(self._directory_partitions(table))
+        keys = sorted(recorded.union(self._scan_partitions(table)))
+        self._record_partitions(table, [key for key in keys if key not in recorded])
+        return keys
+
+    def _directory_partitions(self, table):
+        """ Returns the sorted partition keys of a table recorded in the partition directory."""
+        raise NotImplementedError
+
+    def _scan_partitions(self, table):
+        """ Returns the distinct partition keys of the rows of a table (full table scan)."""
+        raise NotImplementedError
+
+    def _record_partitions(self, table, keys):
+        """ Writes partition keys of a table in the partition directory."""
+        raise NotImplementedError
+
+    def select(self, table, key):
+        """ Returns the rows of a partition (iterable of rows holding the columns of the table in TABLE_COLUMNS order).
+
+        Parameters
+        ------------
+        table:
+                name of the table.
+        key:
+                partition key (tuple, in PARTITION_KEYS order), optionally followed by a prefix of the clustering key
+                (to select a slice of the partition).
+
+        """
+        raise NotImplementedError
+
+    def select_many(self, table, keys, concurrency=None, ordered=True):
+        """ Yields the rows of several partitions (one iterable of rows per partition).
+
+        Parameters
+        ------------
+        table:
+                name of the table.
+        keys:
+                iterable of partition keys (see select).
+        concurrency:
+                max number of partition queries in flight (if the backend queries asynchronously).
+        ordered:
+                if True, partitions are yielded in key order. If False, they may be yielded as they arrive.
+
+        """
+        for key in keys:
+            yield self.select(table, key)
+
+    def select_batches(self, table, keys, columns, fetch_size=5000, concurrency=None):
+        """ Yields the rows of several partitions (in key order) as column batches: dicts column -> NumPy array 
+        of at most fetch_size rows, holding only the requested columns (see tuples_to_columns).
+
+        Parameters
+        ------------
+        table:
+                name of the table.
+        keys:
+                iterable of partition keys (see select).
+        columns:
+                requested column names.
+        fetch_size:
+                max number of rows of a batch (page size of the queries).
+        concurrency:
+                max number of partition queries in flight (if the backend queries asynchronously).
+
+        """
+        positions = [TABLE_COLUMNS[table].index(c) for c in columns]   #rows of select hold the columns in table order
+        for rows in self.select_many(table, keys, concurrency):
+            rows = iter(rows)
+            while True:
+                page = [tuple(r[i] for i in positions) for r in itertools.islice(rows, fetch_size)]
+                if not page:
+                    break
+                yield tuples_to_columns(page, columns)
+
+    def set_rollups(self, source, totals):
+        """ Writes the rollup rows of a source file, replacing the rows previously written for it 
+        (so loading a file again does not count its flights twice). Rollup rows are summed over sources by the readers.
+
+        Parameters
+        ------------
+        source:
+                identifier of the source file (absolute path).
+        totals:
+                dict (grouping, year, key) -> list of ROLLUP_COUNTERS sums over the flights of the source.
+
+        """
+        raise NotImplementedError
+
+    def rollup_rows(self, grouping):
+        """ Returns the rollup rows (RollupRow-like: year, key & ROLLUP_COUNTERS) of a grouping, one per source file
+        & group key (see set_rollups).
+
+        Parameters
+        ------------
+        grouping:
+                one of ROLLUP_GROUPINGS.
+
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """ Releases the resources of the backend."""
+
+    def _new_partitions(self, flight, pending, tables=None):
+        """ Returns the (table, partition key) pairs of a flight which are neither in the partition directory 
+        nor in `pending`, & adds them to `pending`. Once their directory writes are acknowledged, the caller marks 
+        them as known with _mark_known (so a failed write is recorded again by the next attempt).
+
+        Parameters
+        ------------
+        flight:
+                flight_data.Flight to insert.
+        pending:
+                set of the (table, partition key) pairs written by the caller (updated).
+        tables:
+                tables written. If None, the tables of the backend layout.
+
+        """
+        new = []
+        for table in self.tables if tables is None else tables:
+            key = partition_key(table, flight)
+            if (table, key) not in pending and key not in self._known(table):
+                pending.add((table, key))
+                new.append((table, key))
+        return new
+
+    def _known(self, table):
+        """ Returns the set of the partition keys of a table known to be in the partition directory."""
+        with self._known_lock:
+            if table not in self._known_partitions:
+                self._known_partitions[table] = set(self.partitions(table))
+            return self._known_partitions[table]
+
+    def _mark_known(self, pairs):
+        """ Marks (table, partition key) pairs as recorded in the partition directory.
+
+        Parameters
+        ------------
+        pairs:
+                iterable of (table, partition key) pairs whose directory writes are acknowledged.
+
+        """
+        for table, key in pairs:
+            known = self._known(table)
+            with self._known_lock:
+                known.add(key)
+
+
+class LocalBackend(StorageBackend):
+    """ Embedded on-disk storage engine (SQLite file) with the same partition-key semantics as the Cassandra tables:
+    each table is clustered on (partition key, clustering key), & a write with an existing primary key replaces the row."""
+
+    def __init__(self, path, metrics=None, tables=None):
+        """ Opens (or creates) a local database.
+
+        Parameters
+        ------------
+        path:
+                name of the SQLite database file (":memory:" for a temporary in-memory database).
+        metrics:
+                metrics.Metrics recording statement latencies. Optional.
+        tables:
+                tables written by write_flights (see LAYOUTS & layout_tables). If None, the original layout is written.
+
+        """
+        super().__init__()
+        self._metrics = metrics if metrics is not None else metrics_.NULL_METRICS
+        if tables is not None:
+            self.tables = tuple(tables)
+        self._lock = threading.Lock()   #the connection is shared by the threads of a migration
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._create_tables()
+
+    def _create_tables(self):
+        with self._db:
+            for table, columns in TABLE_COLUMNS.items():
+                primary = PARTITION_KEYS[table] + CLUSTERING_KEYS[table]
+                self._db.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} ("
+                    f"{', '.join(c + ' INTEGER' for c in columns)}, "
+                    f"PRIMARY KEY ({', '.join(primary)})) WITHOUT ROWID")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS flight_partitions ("
+                "table_name TEXT, pkey TEXT, PRIMARY KEY (table_name, pkey)) WITHOUT ROWID")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS flight_rollup ("
+                f"grouping TEXT, year INTEGER, key INTEGER, source TEXT, "
+                f"{', '.join(c + ' INTEGER' for c in ROLLUP_COUNTERS)}, "
+                "PRIMARY KEY (grouping, year, key, source)) WITHOUT ROWID")
+
+    def write_flights(self, flights, written, concurrency=None, retries=0, tables=None, rollups=None):
+        tables = self.tables if tables is None else tuple(tables)
+        inserts = {
+            table: f"INSERT OR REPLACE INTO {table}({', '.join(TABLE_COLUMNS[table])}) "
+                   f"VALUES ({', '.join('?' * len(TABLE_COLUMNS[table]))})"
+            for table in tables
+        }
+        fields = {table: [CQL_FIELDS[c] for c in TABLE_COLUMNS[table]] for table in tables}
+
+        rows = {table: [] for table in tables}
+        new = set()
+        n = 0
+        for flight in flights:
+            self._new_partitions(flight, new, tables)
+            for table, names in fields.items():
+                rows[table].append(tuple(getattr(flight, f) for f in names))
+            n += 1
+
+        with self._metrics.timer("statement_seconds", kind="insert_batch", table="local"), self._lock, self._db:
+            self._db.executemany("INSERT OR IGNORE INTO flight_partitions(table_name, pkey) VALUES (?, ?)",
+                                 [(table, ",".join(map(str, key))) for table, key in new])
+            for table, values in rows.items():
+                self._db.executemany(inserts[table], values)
+            if rollups is not None:
+                self._write_rollups(*rollups())
+        self._mark_known(new)
+        for table, values in rows.items():
+            written[table] += len(values)
+            self._metrics.inc("rows_written", len(values), table=table)
+        written["flight_partitions"] += len(new)
+        return n
+
+    def _directory_partitions(self, table):
+        with self._lock:
+            cursor = self._db.execute("SELECT pkey FROM flight_partitions WHERE table_name = ?", (table,))
+            keys = cursor.fetchall()
+        return sorted(tuple(int(v) for v in pkey.split(",")) for (pkey,) in keys)
+
+    def _scan_partitions(self, table):
+        with self._lock:
+            keys = self._db.execute(f"SELECT DISTINCT {', '.join(PARTITION_KEYS[table])} FROM {table}").fetchall()
+        return [tuple(key) for key in keys]
+
+    def _record_partitions(self, table, keys):
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR IGNORE INTO flight_partitions(table_name, pkey) VALUES (?, ?)",
+                                 [(table, ",".join(map(str, key))) for key in keys])
+
+    def _select_query(self, table, key, columns):
+        where = " AND ".join(f"{c} = ?" for c in select_columns(table, key))
+        return (f"SELECT {', '.join(columns)} FROM {table} WHERE {where} "
+                f"ORDER BY {', '.join(CLUSTERING_KEYS[table])}")
+
+    def select(self, table, key):
+        query = self._select_query(table, key, TABLE_COLUMNS[table])
+        with self._metrics.timer("statement_seconds", kind="select", table=table), self._lock:
+            rows = self._db.execute(query, tuple(key)).fetchall()
+        return [TABLE_ROWS[table](*r) for r in rows]
+
+    def select_batches(self, table, keys, columns, fetch_size=5000, concurrency=None):
+        for key in keys:
+            with self._lock:
+                cursor = self._db.execute(self._select_query(table, key, columns), tuple(key))
+            while True:
+                with self._metrics.timer("statement_seconds", kind="fetch", table=table), self._lock:
+                    page = cursor.fetchmany(fetch_size)
+                if not page:
+                    break
+                yield tuples_to_columns(page, columns)
+
+    def set_rollups(self, source, totals):
+        with self._lock, self._db:
+            self._write_rollups(source, totals)
+
+    def _write_rollups(self, source, totals):
+        """ Replaces the rollup rows of a source (in the current transaction)."""
+        self._db.execute("DELETE FROM flight_rollup WHERE source = ?", (source,))
+        self._db.executemany(
+            f"INSERT INTO flight_rollup(grouping, year, key, source, {', '.join(ROLLUP_COUNTERS)}) "
+            f"VALUES (?, ?, ?, ?, {', '.join('?' * len(ROLLUP_COUNTERS))})",
+            [(g, y, k, source, *values) for (g, y, k), values in totals.items()])
+
+    def rollup_rows(self, grouping):
+        with self._lock:
+            cursor = self._db.execute(
+                f"SELECT year, key, {', '.join(ROLLUP_COUNTERS)} FROM flight_rollup WHERE grouping = ?", (grouping,))
+            rows = cursor.fetchall()
+        return [RollupRow(*r) for r in rows]
+
+    def close(self):
+        self._db.close()
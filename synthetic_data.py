@@ -0,0 +1,184 @@
+import os
+import argparse
+import numpy as np
+
+
+# Columns of the ASA on-time performance CSV files
+FLIGHT_HEADER = (
+    "Year", "Month", "DayofMonth", "DayOfWeek", "DepTime", "CRSDepTime", "ArrTime", "CRSArrTime",
+    "UniqueCarrier", "FlightNum", "TailNum", "ActualElapsedTime", "CRSElapsedTime", "AirTime",
+    "ArrDelay", "DepDelay", "Origin", "Dest", "Distance", "TaxiIn", "TaxiOut",
+    "Cancelled", "CancellationCode", "Diverted",
+    "CarrierDelay", "WeatherDelay", "NASDelay", "SecurityDelay", "LateAircraftDelay",
+)
+
+# Columns of plane-data.csv
+PLANE_HEADER = (
+    "tailnum", "type", "manufacturer", "issue_date", "model", "status", "aircraft_type", "engine_type", "year",
+)
+
+CARRIERS = np.array(["AA", "DL", "UA", "WN", "US", "NW", "CO", "MQ"])
+AIRPORTS = np.array(["ATL", "ORD", "DFW", "LAX", "DEN", "JFK", "SFO", "SEA", "BOS", "MIA"])
+
+_DAYS_IN_MONTH = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+
+def tailnums(n_planes):
+    """ Returns the tail numbers of the synthetic fleet.
+
+    Parameters
+    ------------
+    n_planes:
+            number of planes.
+
+    """
+    return np.array([f"N{i:05d}" for i in range(n_planes)])
+
+
+def write_plane_csv(f, n_planes=5000, seed=0):
+    """ Writes a synthetic plane-data.csv (about 5% of the planes have no manufacture year,
+    2% are listed with the tail number only).
+
+    Parameters
+    ------------
+    f:
+            name of the CSV file to write.
+    n_planes:
+            number of planes.
+    seed:
+            random seed.
+
+    """
+    rng = np.random.default_rng(seed)
+    years = rng.integers(1960, 2008, n_planes)
+    kind = rng.random(n_planes)
+    with open(f, "w") as out:
+        out.write(",".join(PLANE_HEADER) + "\n")
+        for tailnum, year, k in zip(tailnums(n_planes).tolist(), years.tolist(), kind.tolist()):
+            if k < 0.02:
+                out.write(f"{tailnum}\n")
+            elif k < 0.05:
+                out.write(f"{tailnum},Corporation,BOEING,None,737-2Y5,Valid,Fixed Wing Multi-Engine,Turbo-Fan,None\n")
+            else:
+                out.write(f"{tailnum},Corporation,BOEING,01/01/{year},737-2Y5,Valid,"
+                          f"Fixed Wing Multi-Engine,Turbo-Fan,{year}\n")
+
+
+def _flight_block(rng, year, rows, n_planes):
+    """ Returns the CSV text of a block of synthetic flights of one year."""
+    month = rng.integers(1, 13, rows)
+    day = (rng.random(rows) * _DAYS_IN_MONTH[month - 1]).astype(int) + 1
+    dow = rng.integers(1, 8, rows)
+    dep_hour = rng.integers(5, 24, rows)
+    dep_min = rng.integers(0, 12, rows) * 5
+    duration = rng.integers(40, 360, rows)
+    arr = (dep_hour * 60 + dep_min + duration) % 1440
+    crs_dep = dep_hour * 100 + dep_min
+    crs_arr = (arr // 60) * 100 + arr % 60
+
+    # delays grow during the day, in winter & summer, with a long tail
+    base = 2 * (dep_hour - 5) + 6 * np.isin(month, (6, 7, 12)) - 5
+    depdelay = np.round(base + rng.normal(0, 8, rows) + rng.exponential(15, rows) * (rng.random(rows) < 0.3))
+    depdelay = depdelay.astype(int)
+    arrdelay = depdelay + rng.integers(-15, 16, rows)
+    weatherdelay = np.where(rng.random(rows) < 0.05, rng.integers(0, 120, rows), 0)
+    carrierdelay = np.where(depdelay > 15, rng.integers(0, 30, rows), 0)
+    nasdelay = np.where(arrdelay > 15, rng.integers(0, 30, rows), 0)
+    lateacdelay = np.where(depdelay > 30, rng.integers(0, 60, rows), 0)
+
+    def text(values):
+        return np.asarray(values).astype(str)
+
+    cols = {
+        "Year": np.full(rows, str(year)), "Month": text(month), "DayofMonth": text(day),
+        "DayOfWeek": text(dow), "DepTime": text(crs_dep), "CRSDepTime": text(crs_dep),
+        "ArrTime": text(crs_arr), "CRSArrTime": text(crs_arr),
+        "UniqueCarrier": CARRIERS[rng.integers(0, len(CARRIERS), rows)],
+        "FlightNum": text(rng.integers(1, 7000, rows)),
+        "TailNum": np.char.add("N", np.char.zfill(text(rng.integers(0, n_planes, rows)), 5)),
+        "ActualElapsedTime": text(duration), "CRSElapsedTime": text(duration), "AirTime": text(duration - 20),
+        "ArrDelay": text(arrdelay), "DepDelay": text(depdelay),
+        "Origin": AIRPORTS[rng.integers(0, len(AIRPORTS), rows)],
+        "Dest": AIRPORTS[rng.integers(0, len(AIRPORTS), rows)],
+        "Distance": text(duration * 8), "TaxiIn": text(rng.integers(2, 20, rows)),
+        "TaxiOut": text(rng.integers(5, 40, rows)),
+        "Cancelled": np.full(rows, "0"), "CancellationCode": np.full(rows, ""), "Diverted": np.full(rows, "0"),
+        "CarrierDelay": text(carrierdelay), "WeatherDelay": text(weatherdelay), "NASDelay": text(nasdelay),
+        "SecurityDelay": np.full(rows, "0"), "LateAircraftDelay": text(lateacdelay),
+    }
+
+    # about 2% of the flights have missing values (as cancelled flights in the real files)
+    missing = rng.random(rows) < 0.02
+    for name in ("DepTime", "ArrTime", "ArrDelay", "DepDelay"):
+        cols[name] = np.where(missing, "NA", cols[name])
+
+    lines = map(",".join, zip(*(cols[name].tolist() for name in FLIGHT_HEADER)))
+    return "\n".join(lines) + "\n"
+
+
+def write_flight_csv(f, rows, year=2007, n_planes=5000, seed=0, block=100000):
+    """ Writes a synthetic flight CSV file (same columns as the ASA yearly files) of one year.
+
+    Parameters
+    ------------
+    f:
+            name of the CSV file to write.
+    rows:
+            number of flights.
+    year:
+            year of the flights.
+    n_planes:
+            number of planes of the fleet (see write_plane_csv).
+    seed:
+            random seed.
+    block:
+            number of rows generated at once.
+
+    """
+    rng = np.random.default_rng([seed, year])
+    with open(f, "w") as out:
+        out.write(",".join(FLIGHT_HEADER) + "\n")
+        for start in range(0, rows, block):
+            out.write(_flight_block(rng, year, min(block, rows - start), n_planes))
+
+
+def generate_dataset(directory, rows, years=(2005, 2006, 2007), n_planes=5000, seed=0):
+    """ Writes a deterministic synthetic dataset: one flight CSV file per year & a plane-data.csv file.
+    Returns (list of flight file names, plane file name).
+
+    Parameters
+    ------------
+    directory:
+            output directory.
+    rows:
+            total number of flights (split evenly between the years).
+    years:
+            years of the flight files.
+    n_planes:
+            number of planes.
+    seed:
+            random seed.
+
+    """
+    os.makedirs(directory, exist_ok=True)
+    plane_file = os.path.join(directory, "plane-data.csv")
+    write_plane_csv(plane_file, n_planes, seed)
+
+    files = []
+    for i, year in enumerate(years):
+        n = rows // len(years) + (1 if i < rows % len(years) else 0)
+        f = os.path.join(directory, f"{year}.csv")
+        write_flight_csv(f, n, year, n_planes, seed)
+        files.append(f)
+    return files, plane_file
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Writes a synthetic airline on-time performance dataset.")
+    parser.add_argument("directory")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--years", type=int, nargs="+", default=[2005, 2006, 2007])
+    parser.add_argument("--planes", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate_dataset(args.directory, args.rows, args.years, args.planes, args.seed)
@@ -0,0 +1,50 @@
+import bz2
+import gzip
+import compressed
+
+
+# ~1 MB of CSV-like text: several bzip2 blocks at compression level 1 (100 kB blocks)
+DATA = b"".join(b"%d,%d,%d,N%03dAA\n" % (i, i * 7919 % 1000, i % 7 + 1, i % 500) for i in range(60000))
+
+
+def _write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_bz2_multi_block_round_trip(tmp_path):
+    file = _write(tmp_path / "flights.csv.bz2", bz2.compress(DATA, 1))
+    segments = list(compressed.bz2_segments(file))
+    assert sum(seg.block for seg in segments) > 3
+    assert not segments[-1].block   #end of stream marker
+    assert b"".join(compressed.iter_bz2_parallel(file, processes=2, prefetch=3)) == DATA
+
+
+def test_bz2_multi_stream_round_trip(tmp_path):
+    half = len(DATA) // 2
+    file = _write(tmp_path / "flights.csv.bz2", bz2.compress(DATA[:half], 1) + bz2.compress(DATA[half:], 9))
+    assert sum(not seg.block for seg in compressed.bz2_segments(file)) == 2
+    assert b"".join(compressed.iter_bz2_parallel(file, processes=2)) == DATA
+
+
+def test_decompress_bz2_bits_rejects_partial_blocks(tmp_path):
+    file = _write(tmp_path / "flights.csv.bz2", bz2.compress(DATA, 1))
+    seg = next(compressed.bz2_segments(file))
+    block = compressed.decompress_bz2_bits(file, seg.start, seg.end)
+    assert block and DATA.startswith(block)
+    assert compressed.decompress_bz2_bits(file, seg.start, seg.end - 8) is None
+    assert compressed.decompress_bz2_bits(file, seg.start + 1, seg.end) is None
+
+
+def test_open_text(tmp_path, monkeypatch):
+    text = DATA.decode()
+    plain = _write(tmp_path / "flights.csv", DATA)
+    gz = _write(tmp_path / "flights.csv.gz", gzip.compress(DATA))
+    bz = _write(tmp_path / "flights.csv.bz2", bz2.compress(DATA[:1000], 1) + bz2.compress(DATA[1000:], 1))
+    for file in (plain, gz, bz):
+        with compressed.open_text(file, processes=1) as f:
+            assert f.read() == text
+    monkeypatch.setattr(compressed, "PARALLEL_MIN_BYTES", 0)   #decompressed by the process pool
+    with compressed.open_text(bz, processes=2) as f:
+        assert f.readline() == text[:text.index("\n") + 1]
+        assert f.readline() + f.read() == text[text.index("\n") + 1:]
@@ -0,0 +1,68 @@
+import pytest
+import numpy as np
+import delay_cube
+
+
+N = 20000
+
+
+def _batch(seed, offset=0.0):
+    rng = np.random.default_rng(seed)
+    dep = rng.normal(10, 30, N) + offset
+    dep[rng.random(N) < 0.1] = np.nan   #cancelled flights
+    return {
+        "Year": rng.integers(2005, 2008, N), "Month": rng.integers(1, 13, N),
+        "DayOfWeek": rng.integers(1, 8, N), "CRSDepHour": rng.integers(0, 25, N),
+        "DepDelay": dep, "ArrDelay": np.where(rng.random(N) < 0.5, None, rng.integers(-10, 60, N)).astype(object),
+    }
+
+
+def _exact(batch, field, mask):
+    values = np.asarray(batch[field], dtype=float)[mask]
+    values = values[~np.isnan(values)]
+    return len(values), values.mean(), values.var()
+
+
+def test_marginals_skip_missing_values():
+    batch = _batch(0)
+    cube = delay_cube.DelayCube().update_batch(batch)
+    for (dow, hour), s in cube.stats(("dayofweek", "dep_hour"), where={"year": 2006}).items():
+        count, mean, var = _exact(batch, "DepDelay", (batch["Year"] == 2006) & (batch["DayOfWeek"] == dow)
+                                  & (batch["CRSDepHour"] == hour))
+        assert s.count == count
+        assert np.isclose(s.mean, mean) and np.isclose(s.var, var)
+    s = cube.stats((), "ArrDelay")
+    assert (s.count, s.mean, s.var) == pytest.approx(_exact(batch, "ArrDelay", slice(None)))
+    assert cube.stats((), "WeatherDelay").count == 0
+
+
+def test_merged_cubes_equal_single_pass():
+    a, b = _batch(1), _batch(2)
+    merged = delay_cube.DelayCube().update_batch(a) + delay_cube.DelayCube().update_batch(b)
+    single = delay_cube.DelayCube().update_batch({k: np.concatenate((a[k], b[k])) for k in a})
+    assert np.array_equal(merged.count, single.count)
+    assert np.allclose(merged.m2, single.m2)
+    for month, s in merged.stats(("month",)).items():
+        assert s.count == single.stats(("month",))[month].count
+        assert np.isclose(s.var, single.stats(("month",))[month].var)
+
+
+def test_variance_of_large_delays():
+    batch = _batch(3, offset=1e9)
+    cube = delay_cube.DelayCube()
+    for part in range(4):
+        cube.update_batch({k: v[part::4] for k, v in batch.items()})
+    count, mean, var = _exact(batch, "DepDelay", slice(None))
+    s = cube.stats()
+    assert s.count == count
+    assert np.isclose(s.mean, mean, rtol=0, atol=1e-3)
+    assert np.isclose(s.var, var, rtol=1e-6)
+
+
+def test_save_load(tmp_path):
+    cube = delay_cube.DelayCube().update_batch(_batch(4))
+    cube.save(str(tmp_path / "cube.npz"))
+    loaded = delay_cube.DelayCube.load(str(tmp_path / "cube.npz"))
+    assert loaded.fields == cube.fields and loaded.first_year == cube.first_year
+    assert loaded.best_slots(k=5) == cube.best_slots(k=5)
+
@@ -0,0 +1,112 @@
+import json
+import collections
+import pytest
+import flight_data as fd
+import synthetic_data
+
+cassandra = pytest.importorskip("cassandra")
+import feed_cassandra
+
+
+ROWS = 2000
+N_PLANES = 200
+
+
+class _Future:
+    """ Completed ResponseFuture stand-in (its callbacks run at once)."""
+
+    def __init__(self, exc=None):
+        self._exc = exc
+
+    def add_callbacks(self, callback, errback, callback_args=(), errback_args=(), **kwargs):
+        if self._exc is None:
+            callback([], *callback_args)
+        else:
+            errback(self._exc, *errback_args)
+
+
+class _FlakySession:
+    """ Session stand-in keeping the rows written by prepared INSERTs. Every `period`-th asynchronous write
+    times out (retryable), & every write fails for good after `crash_after` writes."""
+
+    def __init__(self, period=None, crash_after=None):
+        self.period = period
+        self.crash_after = crash_after
+        self.calls = 0
+        self.prepared = []
+        self.writes = []   #acknowledged (table, values), in order
+
+    def prepare(self, query):
+        self.prepared.append(query)
+        return query
+
+    def execute(self, query, values=None, **kwargs):
+        return []   #empty partition directory & tables
+
+    def execute_async(self, query, values=None, **kwargs):
+        self.calls += 1
+        if self.crash_after is not None and self.calls > self.crash_after:
+            return _Future(RuntimeError("connection lost"))
+        if self.period and self.calls % self.period == 0:
+            return _Future(cassandra.OperationTimedOut("write timed out"))
+        values = tuple(tuple(v) if isinstance(v, list) else v for v in values)   #partition keys are bound as lists
+        self.writes.append((query.split()[2].split("(")[0], values))
+        return _Future()
+
+    def tables(self):
+        """ Returns the rows of every flight table (set) & the latest rollup rows (dict primary key -> counters)."""
+        rows = collections.defaultdict(set)
+        rollups = {}
+        for table, values in self.writes:
+            if table == "flight_rollup":
+                rollups[values[:4]] = values[4:]
+            else:
+                rows[table].add(values)
+        return dict(rows), rollups
+
+
+@pytest.fixture
+def flights(tmp_path, monkeypatch):
+    monkeypatch.setattr(feed_cassandra, "_backoff", lambda attempt: 0)
+    synthetic_data.write_plane_csv(str(tmp_path / "plane-data.csv"), N_PLANES)
+    synthetic_data.write_flight_csv(str(tmp_path / "2007.csv"), ROWS, n_planes=N_PLANES)
+    return str(tmp_path / "2007.csv"), fd.createPlaneIndex_from_csv(str(tmp_path / "plane-data.csv"))
+
+
+def _insert(session, file, planes, **kwargs):
+    data = feed_cassandra.FlightData("test", session=session)
+    return data.insert_csv(file, planes, concurrency=8, checkpoint_every=500, **kwargs)
+
+
+def test_concurrent_writes_retried(flights):
+    file, planes = flights
+    clean, flaky = _FlakySession(), _FlakySession(period=7)
+    assert _insert(clean, file, planes).rows == _insert(flaky, file, planes).rows
+    assert flaky.tables() == clean.tables()
+    assert len(clean.tables()[0]["flight_by_datetime"]) > ROWS // 2
+    assert sum("flight_rollup" in q for q in flaky.prepared) == 1
+
+
+def test_concurrent_writes_give_up(flights):
+    file, planes = flights
+    with pytest.raises(cassandra.OperationTimedOut):
+        _insert(_FlakySession(period=1), file, planes, retries=2)
+
+
+def test_insert_resumes_from_checkpoint(flights, tmp_path):
+    file, planes = flights
+    checkpoint = str(tmp_path / "2007.checkpoint.json")
+    clean = _FlakySession()
+    total = _insert(clean, file, planes).rows
+
+    session = _FlakySession(period=5, crash_after=4000)
+    with pytest.raises(RuntimeError):
+        _insert(session, file, planes, checkpoint=checkpoint)
+    with open(checkpoint) as f:
+        done = json.load(f)["rows"]
+    assert 0 < done < total and done % 500 == 0
+
+    session.crash_after = None
+    assert _insert(session, file, planes, checkpoint=checkpoint).rows == total - done
+    assert session.tables() == clean.tables()
+    assert _insert(session, file, planes, checkpoint=checkpoint).rows == 0   #already loaded
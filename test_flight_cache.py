@@ -0,0 +1,62 @@
+import os
+import shutil
+import numpy as np
+import flight_data as fd
+import flight_cache
+import synthetic_data
+
+
+ROWS = 1000
+N_PLANES = 100
+
+
+def _dataset(directory, seed=0):
+    os.makedirs(directory, exist_ok=True)
+    synthetic_data.write_plane_csv(os.path.join(directory, "plane-data.csv"), N_PLANES, seed=seed)
+    synthetic_data.write_flight_csv(os.path.join(directory, "2007.csv"), ROWS, n_planes=N_PLANES, seed=seed)
+    return os.path.join(directory, "2007.csv"), fd.createPlaneIndex_from_csv(os.path.join(directory, "plane-data.csv"))
+
+
+def test_cache_reused_until_source_changes(tmp_path):
+    file, planes = _dataset(str(tmp_path / "data"))
+    cache_dir = str(tmp_path / "cache")
+    assert not flight_cache.is_cache_valid(file, planes, cache_dir)
+    assert list(flight_cache.read_flights(file, planes, cache_dir)) == list(fd.read_flight_csv(file, planes))
+    assert flight_cache.is_cache_valid(file, planes, cache_dir)
+
+    meta = os.path.join(flight_cache.cache_path(file, cache_dir), "meta.json")
+    built = os.stat(meta).st_mtime_ns
+    flight_cache.open_flight_cache(file, planes, cache_dir)
+    assert os.stat(meta).st_mtime_ns == built   #not rebuilt
+
+    synthetic_data.write_flight_csv(file, ROWS // 2, n_planes=N_PLANES, seed=1)
+    os.utime(file, ns=(built + 10**9, built + 10**9))
+    assert not flight_cache.is_cache_valid(file, planes, cache_dir)
+    assert list(flight_cache.read_flights(file, planes, cache_dir)) == list(fd.read_flight_csv(file, planes))
+
+
+def test_cache_rebuilt_for_other_plane_data(tmp_path):
+    file, planes = _dataset(str(tmp_path / "data"))
+    _, other_planes = _dataset(str(tmp_path / "other"), seed=1)
+    cache_dir = str(tmp_path / "cache")
+    flight_cache.open_flight_cache(file, planes, cache_dir)
+    assert not flight_cache.is_cache_valid(file, other_planes, cache_dir)
+    columns = flight_cache.open_flight_cache(file, other_planes, cache_dir)
+    expected = [f.MFRYear for f in fd.read_flight_csv(file, other_planes)]
+    assert expected != [f.MFRYear for f in fd.read_flight_csv(file, planes)]
+    assert columns.MFRYear.tolist() == expected
+    assert flight_cache.is_cache_valid(file, other_planes, cache_dir)
+
+
+def test_caches_keyed_on_absolute_path(tmp_path):
+    file, planes = _dataset(str(tmp_path / "a"))
+    other = str(tmp_path / "b" / "2007.csv")
+    os.makedirs(os.path.dirname(other))
+    shutil.copyfile(file, other)
+    cache_dir = str(tmp_path / "cache")
+    assert flight_cache.cache_path(file, cache_dir) != flight_cache.cache_path(other, cache_dir)
+    flight_cache.open_flight_cache(file, planes, cache_dir)
+    assert not flight_cache.is_cache_valid(other, planes, cache_dir)
+    a = flight_cache.open_flight_cache(file, planes, cache_dir)
+    b = flight_cache.open_flight_cache(other, planes, cache_dir)
+    assert all(np.array_equal(x, y) for x, y in zip(a, b))
@@ -0,0 +1,53 @@
+import collections
+import pytest
+import flight_data as fd
+import synthetic_data
+import storage
+import migrate_layout
+
+
+ROWS = 1500
+N_PLANES = 200
+
+
+@pytest.fixture
+def backend(tmp_path):
+    """ Local backend dual-writing both layouts, holding flights written in the original layout only."""
+    synthetic_data.write_plane_csv(str(tmp_path / "plane-data.csv"), N_PLANES)
+    synthetic_data.write_flight_csv(str(tmp_path / "2007.csv"), ROWS, n_planes=N_PLANES)
+    planes = fd.createPlaneIndex_from_csv(str(tmp_path / "plane-data.csv"))
+    db = str(tmp_path / "flights.db")
+    original = storage.LocalBackend(db)
+    original.write_flights(fd.read_flight_csv(str(tmp_path / "2007.csv"), planes), collections.Counter())
+    original.close()
+    backend = storage.LocalBackend(db, tables=storage.layout_tables("original", "bucketed"))
+    yield backend
+    backend.close()
+
+
+def _rows(backend, table):
+    return sorted(tuple(r) for key in backend.partitions(table) for r in backend.select(table, key))
+
+
+def test_migrate_layout_copies_every_partition(backend):
+    assert backend.partitions("flight_by_dow_month") == []
+    written = migrate_layout.migrate_layout(backend, workers=4)
+    for old, new in (("flight_by_dayofweek", "flight_by_dow_month"), ("flight_by_dephour", "flight_by_hour_month")):
+        rows = _rows(backend, old)
+        assert rows and _rows(backend, new) == rows
+        assert written[new] == len(rows)
+        index = [storage.TABLE_COLUMNS[new].index(c) for c in storage.PARTITION_KEYS[new]]
+        assert set(map(tuple, backend.partitions(new))) == {tuple(r[i] for i in index) for r in rows}
+    assert "flight_by_datetime" not in written   #shared by both layouts
+
+
+def test_migrate_layout_again_upserts(backend):
+    migrate_layout.migrate_layout(backend, workers=4)
+    before = _rows(backend, "flight_by_hour_month")
+    migrate_layout.migrate_layout(backend, workers=2)
+    assert _rows(backend, "flight_by_hour_month") == before
+
+
+def test_migrate_table_rejects_missing_columns(backend):
+    with pytest.raises(ValueError):
+        migrate_layout.migrate_table(backend, "flight_by_datetime", "flight_by_dow_month")
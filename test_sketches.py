@@ -0,0 +1,59 @@
+import collections
+import numpy as np
+import sketches
+
+
+def test_histogram_skips_missing_values():
+    h = sketches.LogHistogram().update_batch([12.0, None, np.nan, -4, 30])
+    assert (h.n, h.min, h.max) == (3, -4.0, 30.0)
+    assert h.counts.sum() == 3
+    assert np.isfinite(h.quantiles([0, 0.5, 1])).all()
+    assert sketches.LogHistogram().update_batch([None, np.nan]).n == 0
+
+
+def test_sketches_skip_missing_delays():
+    batch = {
+        "Month": np.array([1, 1, 1, 2, 2]),
+        "DepDelay": np.array([10, None, 20, None, None], dtype=object),
+        "ArrDelay": np.array([1.0, 2.0, np.nan, 4.0, 5.0]),
+    }
+    s = sketches.DelaySketches().update_batch(batch)
+    dep = s.histograms[("month", "DepDelay")]
+    assert list(dep) == [1]
+    assert (dep[1].n, dep[1].min, dep[1].max) == (2, 10.0, 20.0)
+    arr = s.histograms[("month", "ArrDelay")]
+    assert (arr[1].n, arr[2].n) == (2, 2)
+    assert np.isfinite(arr[2].quantiles([0, 0.5, 1])).all()
+
+
+def test_histogram_quantiles_within_relative_error():
+    rng = np.random.default_rng(0)
+    delays = np.round(rng.gamma(1.5, 20, 50000) - 15)
+    delays[::10] = np.nan
+    h = sketches.LogHistogram(rel_error=0.01)
+    for batch in np.array_split(delays, 7):
+        h.merge(sketches.LogHistogram(rel_error=0.01).update_batch(batch))
+    known = np.sort(delays[np.isfinite(delays)])
+    qs = np.array([0, 0.01, 0.25, 0.5, 0.9, 0.99, 1])
+    exact = known[np.floor(qs * (len(known) - 1)).astype(int)]
+    assert h.n == len(known)
+    assert np.all(np.abs(h.quantiles(qs) - exact) <= 0.01 * np.abs(exact) + 1e-9)
+    assert sketches.LogHistogram.from_dict(h.to_dict()).quantiles(qs).tolist() == h.quantiles(qs).tolist()
+
+
+def test_sketches_stream_per_group_quantiles():
+    rng = np.random.default_rng(1)
+    n = 20000
+    fields = sketches.DELAY_FIELDS + tuple(sketches.GROUPINGS.values())
+    Flight = collections.namedtuple("Flight", fields)
+    dep = rng.integers(-20, 400, n)
+    hour = rng.integers(0, 24, n)
+    flights = [Flight(int(d) if i % 13 else None, None, 0, 1, 1, int(h)) for i, (d, h) in enumerate(zip(dep, hour))]
+    s = sketches.DelaySketches().update_stream(iter(flights), batch_size=3000)
+    known = np.arange(n) % 13 != 0
+    for key, (median,) in s.quantiles("dep_hour", "DepDelay", qs=(0.5,)).items():
+        values = np.sort(dep[known & (hour == key)])
+        exact = values[(len(values) - 1) // 2]
+        assert abs(median - exact) <= 0.01 * abs(exact) + 1e-9
+    assert ("dep_hour", "ArrDelay") not in s.histograms
+    assert s.histograms[("month", "WeatherDelay")][1].n == n
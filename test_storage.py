@@ -0,0 +1,46 @@
+import collections
+import numpy as np
+import storage
+import partition_cache
+
+
+TABLE = "flight_by_datetime"
+
+# Rows as returned by the Cassandra driver: namedtuples with lower-cased column names
+CassandraRow = collections.namedtuple("Row", [c.lower() for c in storage.TABLE_COLUMNS[TABLE]])
+
+ROWS = [
+    CassandraRow(2005, 1, 3, 10, 5, 12, 0, 7, -2, 0, 3, 4, 0, 5, 1234),
+    CassandraRow(2005, 1, 3, 11, 30, 13, 15, -4, -9, None, 0, None, 0, None, 99),
+]
+
+
+class _RowsBackend(storage.StorageBackend):
+    """ Backend returning the same rows for every partition."""
+
+    def select(self, table, key):
+        return list(ROWS)
+
+
+def test_partition_cache_put_lower_case_rows():
+    cache = partition_cache.PartitionCache()
+    columns = cache.put(TABLE, (2005, 1, 3), ROWS)
+    assert columns["NASdel"].tolist() == [4, None]
+    assert columns["lateACdel"].tolist() == [5, None]
+    assert columns["flightnum"].tolist() == [1234, 99]
+    assert columns["flightnum"].dtype == np.int16
+    assert list(storage.columns_to_rows(TABLE, cache.get(TABLE, (2005, 1, 3)))) == [tuple(r) for r in ROWS]
+
+
+def test_select_batches_lower_case_rows():
+    batches = list(_RowsBackend().select_batches(TABLE, [(2005, 1, 3), (2005, 1, 4)], ["lateACdel", "depdelay"],
+                                                  fetch_size=1))
+    assert [len(b["depdelay"]) for b in batches] == [1, 1, 1, 1]
+    assert np.concatenate([b["depdelay"] for b in batches]).tolist() == [7, -4, 7, -4]
+    assert np.concatenate([b["lateACdel"] for b in batches]).tolist() == [5, None, 5, None]
+
+
+def test_flight_from_lower_case_row():
+    flight = storage.flight_from_row(ROWS[0])
+    assert (flight.NASDelay, flight.LateAircraftDelay, flight.FlightNum) == (4, 5, 1234)
+    assert flight.DayOfWeek is None